@@ -0,0 +1,72 @@
+import copy
+import random
+from correction_time import change_states_time, update_states_time
+
+"""
+状态开始时间增量更新的随机对拍
+在随机状态图的多轮随机扩展上比较 update_states_time 与 change_states_time 的结果
+"""
+
+
+def _random_extension(graph, rng, changes):
+    """随机修改已计算开始时间的状态图：增删状态和变迁、修改 duration，删除状态时可能保留悬空变迁"""
+    graph = copy.deepcopy(graph)
+    for _ in range(changes):
+        ids = [state["id"] for state in graph["states"]]
+        op = rng.random()
+        if op < 0.3:
+            state_id = f"N{rng.randrange(10 ** 9)}"
+            graph["states"].append({"id": state_id, "timing": {"duration": rng.choice([0, 3, 50])}, "crition": "x"})
+            graph["transitions"].append({"from": rng.choice(ids), "to": state_id, "crition": "x"})
+            if rng.random() < 0.5:
+                graph["transitions"].append({"from": state_id, "to": rng.choice(ids)})
+        elif op < 0.5:
+            graph["transitions"].append({"from": rng.choice(ids), "to": rng.choice(ids)})
+        elif op < 0.65 and graph["transitions"]:
+            graph["transitions"].pop(rng.randrange(len(graph["transitions"])))
+        elif op < 0.85 and len(ids) > 2:
+            victim = rng.choice(ids[1:])
+            graph["states"] = [state for state in graph["states"] if state["id"] != victim]
+            if rng.random() < 0.5:
+                graph["transitions"] = [t for t in graph["transitions"] if victim not in (t["from"], t["to"])]
+        else:
+            state = rng.choice(graph["states"][1:] or graph["states"])
+            state["timing"]["duration"] = rng.choice([0, 1, 20, 400, 5000])
+    for state in graph["states"]:
+        state["timing"]["start_time"] = rng.choice([None, 0, 123])
+    return graph
+
+
+def check_update_states_time(trials=3000, rounds=3, seed=0):
+    """
+    在随机状态图的多轮随机扩展上比较 update_states_time 与 change_states_time 的结果。
+
+    参数:
+    - trials: int, 随机状态图的数量。
+    - rounds: int, 每个状态图连续扩展的轮数，每轮以上一轮增量计算的结果作为原图。
+    - seed: int, 随机种子。
+
+    返回值:
+    - int, 结果不一致的扩展数量，正确时为0。
+    """
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(trials):
+        n = rng.randint(1, 30)
+        states = [{"id": f"S{i}", "timing": {"duration": rng.choice([0, 5, 10, 100]), "start_time": 0}} for i in range(n)]
+        edges = {(f"S{rng.randrange(i)}", f"S{i}") for i in range(1, n) if rng.random() < 0.9}
+        edges |= {(f"S{rng.randrange(n)}", f"S{rng.randrange(n)}") for _ in range(rng.randint(0, 2 * n))}
+        transitions = [{"id": f"T{k}", "from": u, "to": v} for k, (u, v) in enumerate(sorted(edges))]
+        graph = change_states_time({"states": states, "transitions": transitions}, "S0")
+        for _ in range(rounds):
+            extended = _random_extension(graph, rng, rng.randint(1, 6))
+            expected = change_states_time(copy.deepcopy(extended), "S0")
+            graph = update_states_time(graph, extended, "S0")
+            if graph != expected:
+                mismatches += 1
+                graph = expected
+    return mismatches
+
+
+if __name__ == "__main__":
+    print("update_states_time 与 change_states_time 不一致的随机扩展数:", check_update_states_time())
@@ -1,5 +1,12 @@
+import heapq
 import networkx as nx
 import json
+from collections import defaultdict, deque
+
+# 从初始状态不可达的状态的开始时间
+UNREACHABLE_START_TIME = None
+# duration 为0的状态按该停留时间计算
+DEFAULT_DURATION = 1000
 
 def setup_initial_state_and_duration(json_data, start_id):
 
@@ -7,7 +14,7 @@ def setup_initial_state_and_duration(json_data, start_id):
         if state['id'] == start_id:
             state['timing']['start_time'] = 0
         if state['timing']['duration'] == 0:
-            state['timing']['duration'] = 1000
+            state['timing']['duration'] = DEFAULT_DURATION
 
 def convert_to_networkx(data):
     """
@@ -44,45 +51,146 @@ def convert_to_networkx(data):
 
     return graph
 
-def get_all_paths(graph, start, end):
-    paths = list(nx.all_simple_paths(graph, start, end))
-    return paths
+def change_states_time(graph_data, start_id):
+    """
+    以 start_id 为初始状态，计算每个状态的最早开始时间 timing.start_time。
 
+    状态的开始时间为从初始状态出发到达该状态所经过的各状态 duration 之和的最小值（不含该状态本身），
+    初始状态为0，duration 为0的状态按1000计（见 setup_initial_state_and_duration）。
+    duration 非负，把它作为从该状态出发的变迁的权重，一次单源 Dijkstra 即可得到所有状态的开始时间，
+    与枚举所有简单路径取最小值的结果相同，复杂度为 O((V+E)logV)。
+    从初始状态不可达的状态（包括只能经过 states 中没有的状态才能到达的）start_time 为 UNREACHABLE_START_TIME。
 
-def get_timing_duration(graph, state_id):
-    """
-    获取指定状态中timing对应的duration字段值
-    """
-    node_attributes = graph.nodes.get(state_id)
-    if node_attributes and 'timing' in node_attributes and 'duration' in node_attributes['timing']:
-        return node_attributes['timing']['duration']
-    return None
-
-
-def cal_min_time(paths, graph):
-    times = []
-    for path in paths:
-        start_time = 0
-        for state_id in path[:-1]:
-            duration = get_timing_duration(graph, state_id)
-            start_time += duration
-        times.append(start_time)
-    return min(times)
+    参数:
+    - graph_data: dict, 状态图数据，就地修改。
+    - start_id: str, 初始状态ID。
 
-def change_states_time(graph_data, start_id):
-    
+    返回值:
+    - dict, 修改后的 graph_data。
+    """
     states = graph_data["states"]
+    if all(state["id"] == start_id for state in states):
+        return graph_data
+    setup_initial_state_and_duration(graph_data, start_id)
+
+    durations = {state["id"]: state["timing"]["duration"] for state in states}
+    graph = nx.DiGraph()
+    graph.add_nodes_from(durations)
+    graph.add_edges_from((transition["from"], transition["to"]) for transition in graph_data["transitions"])
+    # 权重函数返回 None 的边被忽略：没有 duration 的状态无法计算经过它的时间
+    start_times = nx.single_source_dijkstra_path_length(graph, start_id, weight=lambda u, v, d: durations.get(u))
+
     for state in states:
-        state_id = state["id"]
-        if state_id == start_id:
-            continue
-        setup_initial_state_and_duration(graph_data, start_id)
-        graph_nex = convert_to_networkx(graph_data)
-        paths = get_all_paths(graph_nex, start_id, state_id)
-        state_min_time = cal_min_time(paths, graph_nex)
-        state['timing']['start_time'] = state_min_time
+        if state["id"] != start_id:
+            state["timing"]["start_time"] = start_times.get(state["id"], UNREACHABLE_START_TIME)
     return graph_data
 
+def update_states_time(original, extended, start_id):
+    """
+    状态图扩展后增量更新各状态的 start_time，结果与对 extended 调用 change_states_time 相同。
+
+    original 为扩展前的状态图，其 start_time 必须已由 change_states_time 或本函数以同一 start_id 计算过。
+    比较两图得到新增/删除的状态和变迁以及 duration 的变化，只重新计算最短路径长度会因此改变的状态：
+    1. 删除的变迁、删除的状态以及 duration 变大的状态使原最短路径上的“紧”变迁（d(u) + duration(u) == d(v)）失效，
+       沿紧变迁向后找出不再有任何有效紧前驱的状态，这些状态的开始时间置为未知；
+    2. 以未知状态来自其他状态的入边、新增变迁和 duration 变小的状态的出边为起点运行 Dijkstra，
+       只有开始时间变小或需要重新确定的状态会被访问。
+    比较两图需要 O(V+E)，Dijkstra 的堆操作只发生在开始时间改变的状态上。
+    original 的 start_id 状态开始时间不为0（未按 start_id 计算过）时退回 change_states_time 全量计算。
+
+    参数:
+    - original: dict, 扩展前且已计算 start_time 的状态图数据，不会被修改。
+    - extended: dict, 扩展后的状态图数据，就地修改。
+    - start_id: str, 初始状态ID。
+
+    返回值:
+    - dict, 修改后的 extended。
+    """
+    old_states = {state["id"]: state for state in original["states"]}
+    if start_id not in old_states or old_states[start_id]["timing"].get("start_time") != 0:
+        return change_states_time(extended, start_id)
+    if all(state["id"] == start_id for state in extended["states"]):
+        return extended
+    setup_initial_state_and_duration(extended, start_id)
+
+    inf = float("inf")
+    duration = {state["id"]: state["timing"]["duration"] for state in extended["states"]}
+    old_duration = {state_id: state["timing"]["duration"] or DEFAULT_DURATION for state_id, state in old_states.items()}
+    old_dist = {}
+    for state_id, state in old_states.items():
+        start_time = state["timing"].get("start_time")
+        old_dist[state_id] = inf if start_time is UNREACHABLE_START_TIME else start_time
+    old_dist[start_id] = 0
+
+    old_edges = {(transition["from"], transition["to"]) for transition in original["transitions"]}
+    new_edges = {(transition["from"], transition["to"]) for transition in extended["transitions"]}
+    succ, pred = defaultdict(list), defaultdict(list)
+    for u, v in new_edges:
+        succ[u].append(v)
+        pred[v].append(u)
+
+    def was_tight(u, v):
+        return (u, v) in old_edges and old_dist.get(u, inf) < inf and old_dist[u] + old_duration[u] == old_dist.get(v)
+
+    def supports(u, v):
+        """u 仍然是 v 的有效紧前驱：变迁保留、u 未删除且 duration 没有变大"""
+        return (u, v) in new_edges and was_tight(u, v) and u in duration and duration[u] <= old_duration[u]
+
+    dist = {state_id: old_dist.get(state_id, inf) for state_id in duration}
+
+    # 1. 找出失去所有有效紧前驱的状态
+    candidates = deque(v for u, v in old_edges - new_edges if v in duration and was_tight(u, v))
+    # 删除的状态的出边可能仍保留在扩展图中（悬空变迁），这些变迁不可用，其紧后继同样失去支撑
+    removed = old_duration.keys() - duration.keys()
+    if removed:
+        candidates.extend(v for u, v in old_edges if u in removed and v in duration and was_tight(u, v))
+    for u in duration.keys() & old_duration.keys():
+        if duration[u] > old_duration[u]:
+            candidates.extend(v for v in succ[u] if was_tight(u, v))
+    affected = set()
+    while candidates:
+        v = candidates.popleft()
+        if v in affected or v == start_id:
+            continue
+        if any(supports(u, v) and u not in affected for u in pred[v]):
+            continue
+        affected.add(v)
+        dist[v] = inf
+        candidates.extend(w for w in succ[v] if supports(v, w))
+
+    # 2. 从受影响状态的入边、新增变迁和 duration 变小的状态出发重新计算
+    heap = []
+
+    def push(u, v):
+        if v in dist and u in duration and dist[u] < inf and dist[u] + duration[u] < dist[v]:
+            heapq.heappush(heap, (dist[u] + duration[u], v))
+
+    for v in affected:
+        for u in pred[v]:
+            if u not in affected:
+                push(u, v)
+    for u, v in new_edges - old_edges:
+        push(u, v)
+    for u in duration:
+        if u in old_duration and duration[u] < old_duration[u]:
+            for v in succ[u]:
+                push(u, v)
+
+    while heap:
+        d, v = heapq.heappop(heap)
+        if d >= dist[v]:
+            continue
+        dist[v] = d
+        for w in succ[v]:
+            push(v, w)
+
+    for state in extended["states"]:
+        if state["id"] != start_id:
+            d = dist[state["id"]]
+            state["timing"]["start_time"] = d if d < inf else UNREACHABLE_START_TIME
+    return extended
+
+
 # 示例用法
 if __name__ == "__main__":
     graph_data = {"name": "燃油系统状态图(安全扩展)", "func_desc": "管理飞机燃油存储、供给和应急处理", "states": [{"id": "S1", "name": "正常供油状态", "description": "燃油量充足，主副油箱正常工作", "level": 1, "out_action": "启动流量监控", "timing": {"duration": 3600, "start_time": 0}}, {"id": "S2", "name": "低油量警告状态", "description": "剩余燃油低于标准阈值", "level": 3, "out_action": "激活备用泵", "timing": {"duration": 600, "start_time": 3600}}, {"id": "S3", "name": "紧急储备状态", "description": "仅保留应急燃油供应", "level": 4, "out_action": "发送迫降信号", "timing": {"duration": 300, "start_time": 4200}}, {"id": "S4", "name": "系统故障状态", "description": "燃油泄漏或泵体失效", "level": 4, "out_action": "切断供油管路", "timing": {"duration": 0, "start_time": 0}}, {"id": "S5", "name": "低油量超时处理状态", "description": "处理S2超时后的燃油量检查，决定后续状态", "level": 3, "out_action": "检查剩余燃油量并执行相应操作", "timing": {"duration": 0, "start_time": 0}, "crition": "68. 工作状态运行超时,导致功能执行异常"}], "transitions": [{"id": "T1", "from": "S1", "to": "S2", "guard": "fuel_quantity <= 300", "description": "燃油量低于300升触发告警", "guard_type": {"fuel_quantity": "float"}, "timing": {"trigger_time": 3600}, "priority": 2, "crition": "74. 同一状态向多个状态的转移条件同时满足"}, {"id": "T2", "from": "S2", "to": "S3", "guard": "fuel_quantity <= 50", "description": "燃油量低于50升进入紧急模式", "guard_type": {"fuel_quantity": "float"}, "timing": {"trigger_time": 0}}, {"id": "T3", "from": "S1", "to": "S4", "guard": "leak_detected == true", "description": "检测到燃油泄漏立即隔离系统", "guard_type": {"leak_detected": "bool"}, "timing": {"trigger_time": 0}, "priority": 1, "crition": "74. 同一状态向多个状态的转移条件同时满足"}, {"id": "T4", "from": "S4", "to": "S1", "guard": "maintenance_done == true", "description": "完成维修后重置系统", "guard_type": {"maintenance_done": "bool"}, "timing": {"trigger_time": 0}}, {"id": "T5", "from": "S2", "to": "S5", "guard": "timeout == true", "description": "S2超时后强制进入处理状态", "guard_type": {"timeout": "bool"}, "timing": {"trigger_time": 4200}, "crition": "68. 工作状态运行超时,导致功能执行异常"}, {"id": "T6", "from": "S5", "to": "S3", "guard": "fuel_quantity <= 50", "description": "超时处理后燃油量仍低于50升，进入紧急模式", "guard_type": {"fuel_quantity": "float"}, "timing": {"trigger_time": 0}}, {"id": "T7", "from": "S5", "to": "S1", "guard": "fuel_quantity > 50", "description": "超时处理后燃油量恢复，返回正常供油", "guard_type": {"fuel_quantity": "float"}, "timing": {"trigger_time": 0}}, {"id": "T8", "from": "S3", "to": "S1", "guard": "fuel_quantity > 50 && leak_detected == false", "description": "燃油量恢复且无泄漏，返回正常供油状态", "guard_type": {"fuel_quantity": "float", "leak_detected": "bool"}, "timing": {"trigger_time": 0}, "crition": "43. 某个判定分支缺少相应的处理逻辑"}]}
@@ -0,0 +1,289 @@
+import os
+import re
+import sys
+import math
+from collections import deque
+
+# 守卫条件的析取范式解析与区间运算和 test_case_gen/path_var_exa.py 共用同一份实现；
+# 追加到 sys.path 末尾，本目录的同名模块（如 get_prompt）仍然优先
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_case_gen"))
+from path_var_exa import formula_boxes, full_intervals, intersect_intervals, subtract_intervals
+
+"""
+安全性准则的静态检查
+可以直接从状态图 JSON 判定的准则（转移条件重叠、判定分支不完整、转移条件恒不成立、状态不可达、超时无处理）
+由确定性的检查函数判定，不再交给大模型；守卫条件解析为析取范式，每个合取项表示为变量取值区间的区间盒
+"""
+
+# 判定分支覆盖检查中剩余未覆盖区间盒的最大数量，超过时放弃检查该状态
+MAX_BOXES = 256
+
+
+def guard_boxes(guard, guard_type):
+    """
+    将守卫条件转换为区间盒的列表。
+
+    每个区间盒对应析取范式中的一个可满足的合取项，键为 guard_type 中的变量，值为该变量的取值区间并集。
+    守卫条件满足当且仅当变量取值落在某个区间盒内；没有守卫条件的变迁恒可触发。
+
+    参数:
+    - guard: str, 状态变迁的守卫条件。
+    - guard_type: dict, 变量名到类型（bool/int/float）的映射。
+
+    返回值:
+    - list, 区间盒列表，[] 表示守卫条件恒不成立。
+
+    异常:
+    - ValueError: 守卫条件无法解析、变量未在 guard_type 中定义或包含无法按区间处理的结构。
+
+    示例:
+    >>> guard_boxes("voltage_value > 250 || voltage_value < 80", {"voltage_value": "int"})
+    [{'voltage_value': [(251, inf)]}, {'voltage_value': [(-inf, 79)]}]
+    """
+    if not guard or not guard.strip():
+        return [{var: full_intervals(type_) for var, type_ in guard_type.items()}]
+    return formula_boxes(guard, guard_type)
+
+
+def _extend_box(box, types):
+    """将区间盒补全到 types 中的全部变量，未出现的变量取 full_intervals"""
+    return {var: box.get(var, full_intervals(type_)) for var, type_ in types.items()}
+
+
+def intersect_boxes(a, b):
+    """两个区间盒的交集，为空时返回 None"""
+    box = {}
+    for var in a:
+        box[var] = intersect_intervals(a[var], b[var])
+        if not box[var]:
+            return None
+    return box
+
+
+def subtract_box(a, b, types):
+    """区间盒 a 中不属于 b 的部分，拆分为互不相交的区间盒列表"""
+    if intersect_boxes(a, b) is None:
+        return [a]
+    result = []
+    prefix = dict(a)
+    for var, type_ in types.items():
+        outside = subtract_intervals(a[var], b[var], type_)
+        if outside:
+            result.append({**prefix, var: outside})
+        prefix[var] = intersect_intervals(a[var], b[var])
+    return result
+
+
+def _pick(intervals, type_):
+    """在区间并集中取一个便于阅读的值：优先取0，其次取整数"""
+    lo, hi = intervals[0]
+    if lo <= 0 <= hi:
+        value = 0
+    elif not math.isinf(lo):
+        value = math.ceil(lo) if math.ceil(lo) <= hi else lo
+    else:
+        value = math.floor(hi)
+    if type_ == "bool":
+        return "true" if value else "false"
+    return value
+
+
+def format_witness(box, types):
+    """把区间盒中的一个取值格式化为 "变量=值" 的字符串"""
+    return ", ".join(f"{var}={_pick(box[var], types[var])}" for var in box)
+
+
+def analyze_guards(graph):
+    """
+    解析状态图中每个变迁的守卫条件。
+
+    返回值:
+    - dict, 变迁ID到 (guard_type, 区间盒列表) 的映射；无法静态分析的守卫条件对应 None。
+    """
+    guards = {}
+    for transition in graph["transitions"]:
+        guard_type = transition.get("guard_type") or {}
+        try:
+            guards[transition["id"]] = (guard_type, guard_boxes(transition.get("guard"), guard_type))
+        except (ValueError, KeyError, TypeError):
+            guards[transition["id"]] = None
+    return guards
+
+
+def _outgoing(graph):
+    outgoing = {state["id"]: [] for state in graph["states"]}
+    for transition in graph["transitions"]:
+        outgoing.setdefault(transition["from"], []).append(transition)
+    return outgoing
+
+
+def _merge_types(guard_types):
+    """合并多个变迁的变量类型，同名变量类型不一致时返回 None"""
+    types = {}
+    for guard_type in guard_types:
+        for var, type_ in guard_type.items():
+            if types.setdefault(var, type_) != type_:
+                return None
+    return types
+
+
+def _first_overlap(boxes_a, boxes_b, types):
+    """两组区间盒的第一个非空交集，没有时返回 None"""
+    for a in boxes_a:
+        for b in boxes_b:
+            box = intersect_boxes(_extend_box(a, types), _extend_box(b, types))
+            if box is not None:
+                return box
+    return None
+
+
+def check_overlapping_guards(graph, guards):
+    """74. 同一状态向多个状态的转移条件同时满足：两个去往不同状态的变迁的区间盒相交"""
+    reasons = []
+    for state_id, transitions in _outgoing(graph).items():
+        for i, first in enumerate(transitions):
+            for second in transitions[i + 1:]:
+                if first["to"] == second["to"] or guards[first["id"]] is None or guards[second["id"]] is None:
+                    continue
+                (type_a, boxes_a), (type_b, boxes_b) = guards[first["id"]], guards[second["id"]]
+                types = _merge_types([type_a, type_b])
+                if types is None:
+                    continue
+                overlap = _first_overlap(boxes_a, boxes_b, types)
+                if overlap is not None:
+                    reasons.append(
+                        f"状态{state_id}去往{first['to']}的变迁{first['id']}（{first.get('guard')}）与去往{second['to']}的"
+                        f"变迁{second['id']}（{second.get('guard')}）可以同时满足，例如 {format_witness(overlap, types)}"
+                    )
+    return reasons
+
+
+def check_branch_coverage(graph, guards):
+    """
+    43. 某个判定分支缺少相应的处理逻辑：有多个出边的状态，各出边的守卫条件没有覆盖变量的全部取值。
+    只有一个出边的状态视为等待该条件满足，不作为判定分支检查。
+    """
+    reasons = []
+    for state_id, transitions in _outgoing(graph).items():
+        if len(transitions) < 2 or any(guards[t["id"]] is None for t in transitions):
+            continue
+        types = _merge_types(guards[t["id"]][0] for t in transitions)
+        if not types:
+            continue
+        remaining = [{var: full_intervals(type_) for var, type_ in types.items()}]
+        for transition in transitions:
+            for box in guards[transition["id"]][1]:
+                box = _extend_box(box, types)
+                remaining = [piece for rest in remaining for piece in subtract_box(rest, box, types)]
+            if not remaining or len(remaining) > MAX_BOXES:
+                break
+        if remaining and len(remaining) <= MAX_BOXES:
+            reasons.append(
+                f"状态{state_id}各变迁的守卫条件没有覆盖全部取值，例如 {format_witness(remaining[0], types)} 时没有可以触发的变迁"
+            )
+    return reasons
+
+
+def check_unsatisfiable_guards(graph, guards):
+    """73. 状态间的转移条件无法满足：守卫条件的析取范式中没有可满足的合取项"""
+    reasons = []
+    for transition in graph["transitions"]:
+        if guards[transition["id"]] is not None and not guards[transition["id"]][1]:
+            reasons.append(
+                f"{transition['from']}到{transition['to']}的变迁{transition['id']}的守卫条件（{transition.get('guard')}）恒不成立"
+            )
+    return reasons
+
+
+def check_unreachable_states(graph, guards):
+    """45. 功能处理过程存在不可达分支：从初始状态（第一个状态）沿守卫条件可满足的变迁无法到达的状态"""
+    if not graph["states"]:
+        return []
+    start_id = graph["states"][0]["id"]
+    outgoing = _outgoing(graph)
+    reached = {start_id}
+    queue = deque([start_id])
+    while queue:
+        for transition in outgoing.get(queue.popleft(), ()):
+            if guards[transition["id"]] is not None and not guards[transition["id"]][1]:
+                continue
+            if transition["to"] not in reached:
+                reached.add(transition["to"])
+                queue.append(transition["to"])
+    return [f"状态{state['id']}（{state.get('name', '')}）从初始状态{start_id}不可达"
+            for state in graph["states"] if state["id"] not in reached]
+
+
+def check_timeout_transitions(graph, guards):
+    """68. 工作状态运行超时,导致功能执行异常：规定了停留时间的状态没有在超时时刻触发的出边"""
+    reasons = []
+    outgoing = _outgoing(graph)
+    for state in graph["states"]:
+        duration = (state.get("timing") or {}).get("duration")
+        if not isinstance(duration, (int, float)) or duration <= 0:
+            continue
+        transitions = outgoing.get(state["id"], [])
+        if not transitions:
+            reasons.append(f"状态{state['id']}停留时间为{duration}，超时后没有离开该状态的变迁")
+        elif not any((t.get("timing") or {}).get("trigger_time") for t in transitions):
+            reasons.append(f"状态{state['id']}停留时间为{duration}，但各出边都不是按时间触发的，超时后没有相应的处理")
+    return reasons
+
+
+# 准则编号到检查函数的映射，检查函数接受 (状态图, analyze_guards 的结果)，返回不满足该准则的原因列表；
+# 新增可静态判定的准则时在此注册，matching 不再把这些准则交给大模型
+CHECKERS = {
+    43: check_branch_coverage,
+    45: check_unreachable_states,
+    68: check_timeout_transitions,
+    73: check_unsatisfiable_guards,
+    74: check_overlapping_guards,
+}
+
+
+def criterion_number(crition):
+    """从 "74. 同一状态向..." 形式的准则中取出编号，没有编号时返回 None"""
+    match = re.match(r"\s*(\d+)\s*\.", crition)
+    return int(match.group(1)) if match else None
+
+
+def run_checkers(graph, safety_data, checkers=CHECKERS):
+    """
+    对状态图运行全部静态检查。
+
+    参数:
+    - graph: dict, 状态图数据。
+    - safety_data: list, 安全性准则列表，每项形如 "74. 同一状态向多个状态的转移条件同时满足"。
+    - checkers: dict, 准则编号到检查函数的映射。
+
+    返回值:
+    - dict, 与 matching_crition_prompt 的回答格式相同的 {"critions": [...], "reason": [...]}，
+      按准则编号排序，同一准则的多条原因以分号连接。
+    """
+    guards = analyze_guards(graph)
+    critions, reasons = [], []
+    for crition in safety_data:
+        checker = checkers.get(criterion_number(crition))
+        if checker is None:
+            continue
+        found = checker(graph, guards)
+        if found:
+            critions.append(crition)
+            reasons.append("；".join(found))
+    return {"critions": critions, "reason": reasons}
+
+
+if __name__ == "__main__":
+    import json
+    import time
+
+    with open("./safety_criterion_number.txt", "r") as read_safety:
+        safety_data = [line.strip() for line in read_safety if line.strip()]
+    with open("./graph_extention.jsonl", "r") as graph_file:
+        for line in graph_file:
+            graph = json.loads(line)
+            start = time.perf_counter()
+            result = run_checkers(graph, safety_data)
+            print(f"{graph.get('name')}: {(time.perf_counter() - start) * 1000:.2f} ms")
+            for crition, reason in zip(result["critions"], result["reason"]):
+                print(f"  {crition}：{reason}")
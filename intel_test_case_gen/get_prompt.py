@@ -23,6 +23,17 @@ def graph_extension_prompt(state_graph, crition):
     return template
 
 
+# matching_crition_prompt 回答的 JSON Schema，本地模型按此约束解码时回答总能解析
+MATCHING_CRITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "critions": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+        "reason": {"type": "array", "items": {"type": "string"}, "maxItems": 3},
+    },
+    "required": ["critions", "reason"],
+}
+
+
 def matching_crition_prompt(state_graph, crition):
     template = f"""
 你的任务是分析给定的状态图，找出它不满足安全性准则的地方，并取出最不满足的三条，同时给出不满足的原因，最终以json格式返回结果。
@@ -1,7 +1,7 @@
 import json
 from get_prompt import graph_extension_prompt
 from matching_crition import matching, clean_json, get_response
-from correction_time import change_states_time
+from correction_time import change_states_time, update_states_time
 
 """
 状态图扩展
@@ -44,30 +44,53 @@ def data_fileter():
     return graph_data
 
 
-def graph_extension(graph_extention_file_path):
+def extend_once(state_graph):
+    """
+    请求大模型对 JSON 格式的状态图做一轮扩展。
+
+    返回值:
+    - dict 或 None: 扩展后的状态图（尚未计算开始时间），MAX_RETRIES 次都失败时返回 None。
+    """
+    MAX_RETRIES = 3
+    for attempt in range(MAX_RETRIES):
+        crition_reason_dict = matching(state_graph)
+        if crition_reason_dict is None:
+            continue
+
+        crition_reason = merge_crition(crition_reason_dict)
+        extention_prompt = graph_extension_prompt(state_graph, crition_reason)
+        results = get_response(extention_prompt)
+        extention_graph = clean_json(results)
+        if extention_graph is not None:
+            return extention_graph
+    return None
+
+
+def graph_extension(graph_extention_file_path, rounds=1):
+        """
+        对状态图做 rounds 轮扩展，把最后一轮的结果写入文件。
+
+        第一轮对扩展图完整计算一次开始时间；之后每轮以上一轮已计算开始时间的状态图为原图，
+        用 update_states_time 只重新计算受新增状态和变迁影响的状态。
+        """
         state_graph = data_fileter()
-        state_graph = json.dumps(state_graph, ensure_ascii=False)
-        
-        MAX_RETRIES = 3
-        extention_graph = None
-        
-        for attempt in range(MAX_RETRIES):
-            crition_reason_dict = matching(state_graph)
-            if crition_reason_dict is None:
-                continue
-                
-            crition_reason = merge_crition(crition_reason_dict)
-            extention_prompt = graph_extension_prompt(state_graph, crition_reason)
-            results = get_response(extention_prompt)
-            extention_graph = clean_json(results)
-            if extention_graph is not None:
+        timed_graph = None
+        start_id = None
+
+        for round_index in range(rounds):
+            extention_graph = extend_once(json.dumps(state_graph, ensure_ascii=False))
+            if extention_graph is None:
                 break
-        
-        if extention_graph is not None:
-            start_id = extention_graph["states"][0]["id"]
-            extention_graph = change_states_time(extention_graph, start_id)
+            if timed_graph is None or extention_graph["states"][0]["id"] != start_id:
+                start_id = extention_graph["states"][0]["id"]
+                timed_graph = change_states_time(extention_graph, start_id)
+            else:
+                timed_graph = update_states_time(timed_graph, extention_graph, start_id)
+            state_graph = timed_graph
+
+        if timed_graph is not None:
             with open(graph_extention_file_path, "w") as extention_file:
-                extention_file.write(json.dumps(extention_graph, ensure_ascii=False) + "\n")
+                extention_file.write(json.dumps(timed_graph, ensure_ascii=False) + "\n")
         else:
             print("状态图生成失败")
 
@@ -1,29 +1,27 @@
+import os
+import sys
 import json
-from openai import OpenAI
 from get_prompt import matching_crition_prompt
+from crition_check import CHECKERS, criterion_number, run_checkers
+
+# 大模型请求与 test_case_gen 共用 my_utils 的连接复用、重试和 llm_router 路由；
+# 追加到 sys.path 末尾，本目录的同名模块（如 get_prompt）仍然优先
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_case_gen"))
+import my_utils
 
 """
 匹配安全性准则
 """
 
-def get_response(prompt):
-    
-    messages = [{"role": "user", "content": prompt}]
-    api_key = ""
-    base_url = "https://open.bigmodel.cn/api/paas/v4/"
-    model = "glm-4-flash"
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-    )
-
-    completion = client.chat.completions.create(
-        model=model,
-        messages=messages,
-    )
-    
-    return completion.choices[0].message.content
+# 请求大模型使用的 API 类型，"auto" 由 llm_router 在 my_utils.API_CONFIGS 已配置的服务中选择当前最快且健康的一个
+API_TYPE = "auto"
+# skip_llm_when_full 时静态检查找到该数量的不满足准则即不再请求大模型，与 matching_crition_prompt 要求的“最不满足的三条”一致
+MAX_CRITIONS = 3
+
+
+def get_response(prompt, api_type=None):
+    """向大模型发送提示并返回回答；api_type 为 None 时使用 API_TYPE，失败重试与后端选择由 my_utils.get_response 负责"""
+    return my_utils.get_response(prompt, api_type=api_type or API_TYPE)
 
 
 def clean_json(json_str):
@@ -36,17 +34,49 @@ def clean_json(json_str):
         return None
     
 
-def matching(state_graph):
+def matching(state_graph, skip_llm_when_full=False):
+    """
+    找出状态图不满足的安全性准则及原因。
+
+    crition_check.CHECKERS 中有检查函数的准则先静态检查，其余准则交给大模型，由大模型选出最不满足的若干条；
+    返回全部静态检查结果，其后是大模型的结果（跳过有检查函数的准则和重复的准则）。
+
+    参数:
+    - state_graph: str, JSON 格式的状态图。
+    - skip_llm_when_full: bool, 为True时静态检查已找到 MAX_CRITIONS 条就不再请求大模型，只返回其中前 MAX_CRITIONS 条，
+      此时没有检查函数的准则不会被评估。
+
+    返回值:
+    - dict 或 None: {"critions": [...], "reason": [...]}；静态检查没有结果且大模型的回答无法解析时返回 None。
+    """
     safety_data = []
     with open("./safety_criterion_number.txt", "r") as read_safety:
         for i, line in enumerate(read_safety):
             safety_data.append(line.strip())
 
+    try:
+        res = run_checkers(json.loads(state_graph), safety_data)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        res = {"critions": [], "reason": []}
+    if skip_llm_when_full and len(res["critions"]) >= MAX_CRITIONS:
+        return {"critions": res["critions"][:MAX_CRITIONS], "reason": res["reason"][:MAX_CRITIONS]}
+
+    unchecked = [crition for crition in safety_data if criterion_number(crition) not in CHECKERS]
+    if not unchecked:
+        return res if res["critions"] else None
     MAX_RETRIES = 3
-    res = None
+    llm_res = None
     for attempt in range(MAX_RETRIES):
-        matching_prompt = matching_crition_prompt(state_graph, safety_data)
-        res = clean_json(get_response(matching_prompt))
-        if res is not None:
+        matching_prompt = matching_crition_prompt(state_graph, unchecked)
+        llm_res = clean_json(get_response(matching_prompt))
+        if llm_res is not None:
             break
+    if llm_res is None:
+        return res if res["critions"] else None
+
+    for crition, reason in zip(llm_res.get("critions", []), llm_res.get("reason", [])):
+        if criterion_number(str(crition)) in CHECKERS or crition in res["critions"]:
+            continue
+        res["critions"].append(crition)
+        res["reason"].append(reason)
     return res
@@ -0,0 +1,388 @@
+import json
+from bisect import bisect_left
+
+import torch
+from transformers import LogitsProcessor
+
+"""
+JSON Schema 约束解码
+把不含递归的 JSON Schema 编译为按字节转移的有限自动机，生成时屏蔽会使输出偏离 Schema 的 token，
+输出为不含空白、属性按 Schema 顺序排列的紧凑 JSON，第一次生成即可解析
+"""
+
+# JSON 字符串中可以直接出现的字节：除双引号、反斜杠和控制字符外的所有字节（包括 UTF-8 多字节字符的各字节）
+STRING_BYTES = frozenset(b for b in range(0x20, 0x100) if b not in (0x22, 0x5C))
+ESCAPE_BYTES = frozenset(b'"\\/bfnrt')
+HEX_BYTES = frozenset(b"0123456789abcdefABCDEF")
+DIGITS = frozenset(b"0123456789")
+NONZERO_DIGITS = frozenset(b"123456789")
+# 整数部分与小数部分的最大位数，保证数字总能结束
+MAX_DIGITS = 16
+
+
+class _NFA:
+    """按字节转移的非确定有限自动机，每个构造函数返回 (起始状态, 结束状态) 片段"""
+
+    def __init__(self):
+        self.epsilon = []
+        self.edges = []
+
+    def state(self):
+        self.epsilon.append([])
+        self.edges.append({})
+        return len(self.epsilon) - 1
+
+    def byteset(self, byteset):
+        start, end = self.state(), self.state()
+        for b in byteset:
+            self.edges[start].setdefault(b, []).append(end)
+        return start, end
+
+    def literal(self, data):
+        start = end = self.state()
+        for b in data:
+            nxt = self.state()
+            self.edges[end].setdefault(b, []).append(nxt)
+            end = nxt
+        return start, end
+
+    def seq(self, *fragments):
+        start = end = self.state()
+        for frag_start, frag_end in fragments:
+            self.epsilon[end].append(frag_start)
+            end = frag_end
+        return start, end
+
+    def alt(self, *fragments):
+        start, end = self.state(), self.state()
+        for frag_start, frag_end in fragments:
+            self.epsilon[start].append(frag_start)
+            self.epsilon[frag_end].append(end)
+        return start, end
+
+    def star(self, fragment):
+        start, end = self.state(), self.state()
+        frag_start, frag_end = fragment
+        self.epsilon[start] += [frag_start, end]
+        self.epsilon[frag_end] += [frag_start, end]
+        return start, end
+
+    def opt(self, fragment):
+        start, end = self.state(), self.state()
+        self.epsilon[start] += [fragment[0], end]
+        self.epsilon[fragment[1]].append(end)
+        return start, end
+
+
+class JsonGrammar:
+    """
+    由 JSON Schema 编译得到的字节级自动机。
+
+    支持的关键字：type（string/integer/number/boolean/null/array/object 或其列表）、enum、const、
+    properties、required（不在 required 中的属性可以省略）、items、minItems、maxItems、anyOf、oneOf。
+    对象的属性按 properties 中的顺序输出，不允许额外属性；数字不含指数部分，整数部分和小数部分各最多 MAX_DIGITS 位。
+    不支持 $ref 等递归结构，遇到无法处理的 Schema 抛出 ValueError。
+
+    状态为整数，step 和 advance 在状态无法接受该字节时返回 None，转移结果会被缓存。
+
+    示例:
+    >>> grammar = JsonGrammar({"type": "object", "properties": {"x_T1": {"type": "integer"}}, "required": ["x_T1"]})
+    >>> grammar.is_accepting(grammar.advance(grammar.start, b'{"x_T1":-12}'))
+    True
+    """
+
+    def __init__(self, schema):
+        self._nfa = _NFA()
+        start, self._end = self._compile(schema)
+        self._sets = []
+        self._ids = {}
+        self._transitions = {}
+        self.start = self._intern(self._closure({start}))
+
+    def _compile(self, schema):
+        nfa = self._nfa
+        if not isinstance(schema, dict):
+            raise ValueError(f"Unsupported schema: {schema!r}")
+        if "const" in schema:
+            return nfa.literal(self._dumps(schema["const"]))
+        if "enum" in schema:
+            return nfa.alt(*(nfa.literal(self._dumps(value)) for value in schema["enum"]))
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                return nfa.alt(*(self._compile(option) for option in schema[key]))
+        type_ = schema.get("type")
+        if isinstance(type_, list):
+            return nfa.alt(*(self._compile({**schema, "type": option}) for option in type_))
+        if type_ == "string":
+            return self._string()
+        if type_ == "integer":
+            return self._integer()
+        if type_ == "number":
+            return nfa.seq(self._integer(), nfa.opt(nfa.seq(nfa.literal(b"."), self._digits(DIGITS))))
+        if type_ == "boolean":
+            return nfa.alt(nfa.literal(b"true"), nfa.literal(b"false"))
+        if type_ == "null":
+            return nfa.literal(b"null")
+        if type_ == "array":
+            return self._array(schema)
+        if type_ == "object" or "properties" in schema:
+            return self._object(schema)
+        raise ValueError(f"Unsupported schema: {schema!r}")
+
+    @staticmethod
+    def _dumps(value):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _string(self):
+        nfa = self._nfa
+        escape = nfa.seq(
+            nfa.literal(b"\\"),
+            nfa.alt(nfa.byteset(ESCAPE_BYTES), nfa.seq(nfa.literal(b"u"), *(nfa.byteset(HEX_BYTES) for _ in range(4)))),
+        )
+        return nfa.seq(nfa.literal(b'"'), nfa.star(nfa.alt(nfa.byteset(STRING_BYTES), escape)), nfa.literal(b'"'))
+
+    def _digits(self, first):
+        """首位属于 first、共 1 到 MAX_DIGITS 位的数字串"""
+        nfa = self._nfa
+        tail = None
+        for _ in range(MAX_DIGITS - 1):
+            digit = nfa.byteset(DIGITS)
+            tail = nfa.opt(digit if tail is None else nfa.seq(digit, tail))
+        return nfa.seq(nfa.byteset(first), tail)
+
+    def _integer(self):
+        nfa = self._nfa
+        return nfa.seq(nfa.opt(nfa.literal(b"-")), nfa.alt(nfa.literal(b"0"), self._digits(NONZERO_DIGITS)))
+
+    def _array(self, schema):
+        nfa = self._nfa
+        items = schema.get("items", {})
+        min_items = schema.get("minItems", 0)
+        max_items = schema.get("maxItems")
+
+        def item(first):
+            return self._compile(items) if first else nfa.seq(nfa.literal(b","), self._compile(items))
+
+        # 先展开必须的 min_items 个元素，之后的元素可选；没有 maxItems 时可以重复任意次
+        body = [item(i == 0) for i in range(min_items)]
+        if max_items is None:
+            if min_items == 0:
+                body.append(nfa.opt(nfa.seq(item(True), nfa.star(item(False)))))
+            else:
+                body.append(nfa.star(item(False)))
+        else:
+            tail = None
+            for i in range(max_items - 1, min_items - 1, -1):
+                current = item(i == 0) if tail is None else nfa.seq(item(i == 0), tail)
+                tail = nfa.opt(current)
+            if tail is not None:
+                body.append(tail)
+        return nfa.seq(nfa.literal(b"["), *body, nfa.literal(b"]"))
+
+    def _object(self, schema):
+        nfa = self._nfa
+        properties = list(schema.get("properties", {}).items())
+        required = set(schema.get("required", [name for name, _ in properties]))
+        start, end = nfa.literal(b"{")
+        # nodes[(i, first)]：已处理前 i 个属性，first 表示还没有输出任何属性（下一个属性前不加逗号）
+        nodes = {}
+
+        def node(i, first):
+            if (i, first) not in nodes:
+                nodes[(i, first)] = nfa.state()
+            return nodes[(i, first)]
+
+        nfa.epsilon[end].append(node(0, True))
+        close_start, close_end = nfa.literal(b"}")
+        for i in range(len(properties) + 1):
+            for first in (True, False):
+                if (i, first) not in nodes:
+                    continue
+                current = node(i, first)
+                if i == len(properties):
+                    nfa.epsilon[current].append(close_start)
+                    continue
+                name, subschema = properties[i]
+                key = (b"" if first else b",") + self._dumps(name) + b":"
+                frag_start, frag_end = nfa.seq(nfa.literal(key), self._compile(subschema))
+                nfa.epsilon[current].append(frag_start)
+                nfa.epsilon[frag_end].append(node(i + 1, False))
+                if name not in required:
+                    nfa.epsilon[current].append(node(i + 1, first))
+        return start, close_end
+
+    def _closure(self, states):
+        stack = list(states)
+        closure = set(states)
+        while stack:
+            for nxt in self._nfa.epsilon[stack.pop()]:
+                if nxt not in closure:
+                    closure.add(nxt)
+                    stack.append(nxt)
+        return frozenset(closure)
+
+    def _intern(self, states):
+        if states not in self._ids:
+            self._ids[states] = len(self._sets)
+            self._sets.append(states)
+        return self._ids[states]
+
+    def step(self, state, byte):
+        key = (state, byte)
+        if key not in self._transitions:
+            targets = set()
+            for nfa_state in self._sets[state]:
+                targets.update(self._nfa.edges[nfa_state].get(byte, ()))
+            self._transitions[key] = self._intern(self._closure(targets)) if targets else None
+        return self._transitions[key]
+
+    def advance(self, state, data):
+        for byte in data:
+            state = self.step(state, byte)
+            if state is None:
+                return None
+        return state
+
+    def is_accepting(self, state):
+        return self._end in self._sets[state]
+
+
+def bytes_to_unicode():
+    """字节级 BPE（GPT-2、Qwen 等）词表中可见字符与字节的对应关系"""
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+class TokenIndex:
+    """
+    分词器词表中每个普通 token 对应的字节串，按字节串排序以便按前缀批量剪枝。
+    特殊 token 和添加的 token（如 </think>、<|im_end|>）不参与约束，EOS 单独处理。
+    """
+
+    def __init__(self, tokenizer):
+        byte_decoder = {c: b for b, c in bytes_to_unicode().items()}
+        excluded = set(tokenizer.all_special_ids) | set(tokenizer.get_added_vocab().values())
+        self.token_bytes = {}
+        for token, token_id in tokenizer.get_vocab().items():
+            if token_id in excluded:
+                continue
+            if all(c in byte_decoder for c in token):
+                self.token_bytes[token_id] = bytes(byte_decoder[c] for c in token)
+            else:
+                self.token_bytes[token_id] = tokenizer.convert_tokens_to_string([token]).encode("utf-8")
+        ordered = sorted((data, token_id) for token_id, data in self.token_bytes.items() if data)
+        self.sorted_bytes = [data for data, _ in ordered]
+        self.sorted_ids = [token_id for _, token_id in ordered]
+        self.eos_token_id = tokenizer.eos_token_id
+
+
+def _prefix_upper_bound(prefix):
+    """按字节序大于所有以 prefix 开头的字节串的最小字节串"""
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+class SchemaGuide:
+    """
+    把 JsonGrammar 与分词器的词表结合，给出每个状态下允许的 token。
+
+    allowed 按排序后的词表顺序遍历，复用与上一个 token 的公共前缀所到达的状态，
+    某个前缀无法被接受时用二分查找跳过以它开头的所有 token，效果等同于在词表前缀树上搜索。结果按状态缓存。
+    """
+
+    def __init__(self, grammar, index):
+        self.grammar = grammar
+        self.index = index
+        self._allowed = {}
+
+    def allowed(self, state):
+        if state in self._allowed:
+            return self._allowed[state]
+        grammar = self.grammar
+        tokens, ids = self.index.sorted_bytes, self.index.sorted_ids
+        allowed = []
+        stack = [(b"", state)]
+        i = 0
+        while i < len(tokens):
+            data = tokens[i]
+            while not data.startswith(stack[-1][0]):
+                stack.pop()
+            prefix, current = stack[-1]
+            for k in range(len(prefix), len(data)):
+                current = grammar.step(current, data[k])
+                if current is None:
+                    upper = _prefix_upper_bound(data[:k + 1])
+                    i = len(tokens) if upper is None else bisect_left(tokens, upper, i + 1)
+                    break
+                stack.append((data[:k + 1], current))
+            else:
+                allowed.append(ids[i])
+                i += 1
+        if grammar.is_accepting(state) or not allowed:
+            allowed.append(self.index.eos_token_id)
+        self._allowed[state] = allowed
+        return allowed
+
+    def advance(self, state, token_id):
+        """返回接受 token 后的状态，token 为 EOS 或不被接受时返回 None"""
+        data = self.index.token_bytes.get(token_id)
+        if data is None:
+            return None
+        return self.grammar.advance(state, data)
+
+
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """
+    generate 的 logits 处理器，每一步把不被 SchemaGuide 允许的 token 的分数置为 -inf。
+
+    start_after 不为 None 时（如开启思考时的 </think>），各行生成该 token 之前不受约束。
+    某行的 JSON 结束并生成 EOS 后只允许 EOS，即使模型的生成配置中没有该 EOS，输出也不会在 JSON 之后继续。
+    """
+
+    FREE = -1
+    DONE = -2
+
+    def __init__(self, guide, start_after=None):
+        self.guide = guide
+        self.start_after = start_after
+        self.states = None
+        self._tensors = {}
+
+    def _allowed_tensor(self, state, device):
+        key = (state, device)
+        if key not in self._tensors:
+            allowed = [self.guide.index.eos_token_id] if state == self.DONE else self.guide.allowed(state)
+            self._tensors[key] = torch.tensor(allowed, device=device)
+        return self._tensors[key]
+
+    def __call__(self, input_ids, scores):
+        if self.states is None:
+            initial = self.guide.grammar.start if self.start_after is None else self.FREE
+            self.states = [initial] * input_ids.shape[0]
+        else:
+            for row, token_id in enumerate(input_ids[:, -1].tolist()):
+                state = self.states[row]
+                if state == self.FREE:
+                    if token_id == self.start_after:
+                        self.states[row] = self.guide.grammar.start
+                elif state != self.DONE:
+                    state = self.guide.advance(state, token_id)
+                    self.states[row] = self.DONE if state is None else state
+
+        for row, state in enumerate(self.states):
+            if state == self.FREE:
+                continue
+            allowed = self._allowed_tensor(state, scores.device)
+            masked = torch.full_like(scores[row], -float("inf"))
+            masked[allowed] = scores[row, allowed]
+            scores[row] = masked
+        return scores
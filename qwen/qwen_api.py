@@ -1,6 +1,15 @@
+import copy
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 import torch
-from flask import Flask, request, jsonify
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from flask import Flask, Response, request, jsonify, stream_with_context
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from transformers import LogitsProcessorList
+from json_grammar import JsonGrammar, JsonSchemaLogitsProcessor, SchemaGuide, TokenIndex
 
 # 初始化 Flask 应用
 app = Flask(__name__)
@@ -8,6 +17,17 @@ app = Flask(__name__)
 # 模型路径
 model_name = "../../../model/Qwen/Qwen3-8B"
 
+# 动态批处理：收到第一个请求后最多等待 MAX_WAIT_MS 毫秒，凑够 MAX_BATCH_SIZE 个请求即合并为一次 generate
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 10
+REQUEST_TIMEOUT = 600
+# </think> 的 token id
+THINK_END_ID = 151668
+# 前缀 KV 缓存占用的显存上限（字节）；AUTO_PREFIX_CACHE 为True时单条生成的提示词也自动缓存
+PREFIX_CACHE_MAX_BYTES = 2 * 1024 ** 3
+AUTO_PREFIX_CACHE = True
+PREFIX_END = "<<<PREFIX_END>>>"
+
 tokenizer = AutoTokenizer.from_pretrained(model_name)
 model = AutoModelForCausalLM.from_pretrained(
     model_name,
@@ -17,6 +37,375 @@ model = AutoModelForCausalLM.from_pretrained(
 model.eval()
 print("模型加载完成")
 
+class BatchScheduler:
+    """
+    动态批处理调度器。
+
+    各请求线程把提示词放入队列后等待结果，后台线程从队列中取出第一个请求后，
+    在 max_wait_ms 毫秒内继续收集，最多 max_batch_size 个，按生成参数分组后每组调用一次 generate_fn，
+    再把每个提示词的结果分别交还给对应的请求线程。模型只在后台线程中调用，不会被多个请求同时调用。
+
+    参数:
+    - generate_fn: callable, generate_fn(texts, params) 返回与 texts 一一对应的结果列表。
+    - max_batch_size: int, 一批的最大请求数。
+    - max_wait_ms: float, 收到第一个请求后等待更多请求的最长时间（毫秒）。
+    """
+
+    def __init__(self, generate_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._batches = 0
+        self._max_batch = 0
+        self._batch_sizes = {}
+        self._busy_time = 0.0
+        self._last_batch_time = 0.0
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, params):
+        """提交一个提示词，返回 Future，结果为 generate_fn 对该提示词的返回值"""
+        future = Future()
+        self._queue.put((text, params, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups = {}
+            for item in batch:
+                # 参数无法作为分组键时只让该请求失败，调度线程继续处理其他请求
+                try:
+                    groups.setdefault(item[1], []).append(item)
+                except Exception as e:
+                    item[2].set_exception(e)
+            for params, items in groups.items():
+                start = time.monotonic()
+                try:
+                    results = self.generate_fn([text for text, _, _ in items], params)
+                except Exception as e:
+                    for _, _, future in items:
+                        future.set_exception(e)
+                else:
+                    for (_, _, future), result in zip(items, results):
+                        future.set_result(result)
+                self._record(len(items), time.monotonic() - start)
+
+    def _record(self, size, elapsed):
+        with self._lock:
+            self._requests += size
+            self._batches += 1
+            self._max_batch = max(self._max_batch, size)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._busy_time += elapsed
+            self._last_batch_time = elapsed
+
+    def metrics(self):
+        """返回队列长度与批大小等统计信息"""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": self._batches,
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "max_batch_size": self._max_batch,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "busy_seconds": self._busy_time,
+                "last_batch_seconds": self._last_batch_time,
+                "config": {"max_batch_size": self.max_batch_size, "max_wait_ms": self.max_wait * 1000},
+            }
+
+
+class PrefixCache:
+    """
+    提示词前缀的 KV 缓存。
+
+    以前缀的 token id 元组为键保存其 past_key_values，请求的 token id 以某个已缓存的前缀开头时，
+    generate 只需计算前缀之后的部分。多个前缀都匹配时使用最长的一个。
+    显式注册的前缀（pinned）优先保留；总占用超过 max_bytes 时先按最近最少使用淘汰自动缓存的前缀。
+
+    参数:
+    - max_bytes: int, 缓存占用的上限（字节）。
+    - bytes_per_token: int, 每个 token 的 KV 占用（字节）。
+    """
+
+    def __init__(self, max_bytes, bytes_per_token):
+        self.max_bytes = max_bytes
+        self.bytes_per_token = bytes_per_token
+        self._entries = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_tokens = 0
+        self.evictions = 0
+
+    def __contains__(self, prefix_ids):
+        with self._lock:
+            return tuple(prefix_ids) in self._entries
+
+    def add(self, prefix_ids, past_key_values, pinned=False):
+        """缓存前缀的 past_key_values，超出上限时淘汰，单个前缀超过上限时不缓存"""
+        key = tuple(prefix_ids)
+        size = len(key) * self.bytes_per_token
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                self._entries[key] = past_key_values
+                self._bytes += size
+            if pinned:
+                self._pinned.add(key)
+            while self._bytes > self.max_bytes:
+                victim = next((k for k in self._entries if k not in self._pinned), next(iter(self._entries)))
+                del self._entries[victim]
+                self._pinned.discard(victim)
+                self._bytes -= len(victim) * self.bytes_per_token
+                self.evictions += 1
+
+    def match(self, ids):
+        """
+        返回 ids 开头的最长已缓存前缀 (prefix_ids, past_key_values)，没有时返回 None。
+        前缀之后至少还要有一个 token 留给 generate 计算。
+        """
+        ids = tuple(ids)
+        with self._lock:
+            best = None
+            for key in self._entries:
+                if len(key) < len(ids) and (best is None or len(key) > len(best)) and ids[:len(key)] == key:
+                    best = key
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            self.hit_tokens += len(best)
+            return best, self._entries[best]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "prefixes": len(self._entries),
+                "pinned": len(self._pinned),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "hit_tokens": self.hit_tokens,
+                "evictions": self.evictions,
+            }
+
+
+def register_prefix(prefix):
+    """
+    注册用户提示词的固定开头部分，计算其套用对话模板后的 KV 并缓存，返回前缀的 token 数。
+
+    最后一个 token 不缓存：分词时它可能与后续文本合并为别的 token，去掉后请求的 token id 总能以前缀开头。
+    """
+    text = tokenizer.apply_chat_template([{'role': 'user', 'content': prefix + PREFIX_END}], tokenize=False)
+    prefix_ids = tokenizer(text[:text.index(PREFIX_END)]).input_ids[:-1]
+    if prefix_ids and prefix_ids not in prefix_cache:
+        with model_lock, torch.no_grad():
+            past_key_values = model(torch.tensor([prefix_ids], device=model.device), use_cache=True).past_key_values
+        prefix_cache.add(prefix_ids, past_key_values, pinned=True)
+    return len(prefix_ids)
+
+
+def build_inputs(rows, prefix_length=0):
+    """
+    把一组 token id 填充为等长的 input_ids 和 attention_mask。
+
+    各行共享长度为 prefix_length 的已缓存前缀，填充放在前缀与其余部分之间，前缀在各行中位置相同，可以共用同一份 KV；
+    prefix_length 为0时即左填充。位置编码由 attention_mask 推出，填充不占位置。
+    """
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    width = max(len(ids) for ids in rows)
+    input_ids, attention_mask = [], []
+    for ids in rows:
+        pad = width - len(ids)
+        input_ids.append(ids[:prefix_length] + [pad_id] * pad + ids[prefix_length:])
+        attention_mask.append([1] * prefix_length + [0] * pad + [1] * (len(ids) - prefix_length))
+    return torch.tensor(input_ids, device=model.device), torch.tensor(attention_mask, device=model.device)
+
+
+def model_generate(rows, params, prefix=None, **kwargs):
+    """
+    对一组 token id 调用一次 model.generate，prefix 为各行共同匹配的缓存前缀 (prefix_ids, past_key_values)，不为 None 时复用其 KV。
+
+    只有一行时，生成结束后把该提示词（去掉最后一个 token）的 KV 加入前缀缓存，相同提示词再次请求时几乎不需要预填充。
+
+    params 的最后一项为 (schema_key, enable_thinking) 或 None，不为 None 时按 JSON Schema 约束解码，
+    开启思考时 </think> 之后才开始约束。
+
+    返回值:
+    - tuple, (输入的宽度, generated_ids)。
+    """
+    max_new_tokens, temperature, do_sample, top_k, repetition_penalty, constraint = params
+    if constraint is not None:
+        schema_key, enable_thinking = constraint
+        processor = JsonSchemaLogitsProcessor(schema_guide(schema_key), THINK_END_ID if enable_thinking else None)
+        kwargs["logits_processor"] = LogitsProcessorList([processor])
+    prefix_length = 0
+    past_key_values = DynamicCache()
+    if prefix is not None:
+        prefix_length = len(prefix[0])
+        past_key_values = copy.deepcopy(prefix[1])
+        if len(rows) > 1:
+            past_key_values.batch_repeat_interleave(len(rows))
+    input_ids, attention_mask = build_inputs(rows, prefix_length)
+
+    with model_lock, torch.no_grad():
+        generated_ids = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+            temperature=temperature,
+            do_sample=do_sample,
+            top_k=top_k,
+            repetition_penalty=repetition_penalty,
+            **kwargs,
+        )
+
+    if AUTO_PREFIX_CACHE and len(rows) == 1 and len(rows[0]) > 1 and rows[0][:-1] not in prefix_cache:
+        # 去掉生成部分的 KV（负数表示去掉的 token 数），只保留提示词前 len - 1 个 token
+        generated_length = past_key_values.get_seq_length() - (len(rows[0]) - 1)
+        if generated_length > 0:
+            past_key_values.crop(-generated_length)
+        prefix_cache.add(rows[0][:-1], past_key_values)
+    return input_ids.shape[1], generated_ids
+
+
+def generate_batch(texts, params):
+    """
+    对一组已套用对话模板的提示词批量生成。
+
+    匹配同一缓存前缀的提示词合为一组复用前缀的 KV，其余提示词左填充为一组，每组调用一次 model.generate。
+
+    参数:
+    - texts: list, 提示词列表。
+    - params: tuple, (max_new_tokens, temperature, do_sample, top_k, repetition_penalty, constraint)。
+
+    返回值:
+    - list, 每个提示词的 (thinking_content, content)。
+    """
+    rows = tokenizer(texts).input_ids
+    groups = {}
+    for i, ids in enumerate(rows):
+        prefix = prefix_cache.match(ids)
+        groups.setdefault(prefix[0] if prefix is not None else None, (prefix, []))[1].append(i)
+
+    results = [None] * len(texts)
+    for prefix, indices in groups.values():
+        input_length, generated_ids = model_generate([rows[i] for i in indices], params, prefix)
+
+        # 各行输入等宽，生成部分从同一位置开始
+        for i, ids in zip(indices, generated_ids):
+            output_ids = ids[input_length:].tolist()
+
+            try:
+                index = len(output_ids) - output_ids[::-1].index(THINK_END_ID)
+            except ValueError:
+                index = 0
+
+            thinking_content = tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
+            content = tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
+            results[i] = (thinking_content, content)
+    return results
+
+
+class CancelCriteria(StoppingCriteria):
+    """cancelled 被设置（客户端断开连接）后停止生成"""
+
+    def __init__(self, cancelled):
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def stream_generate(text, params):
+    """
+    流式生成单个提示词，以 SSE 格式逐段返回生成的文本。
+
+    每个事件为 data: {"text": "..."}，生成结束后发送 data: [DONE]。
+    思考内容和 </think> 原样包含在文本中，由客户端拆分。
+    客户端提前断开连接时设置 cancelled，CancelCriteria 在下一个 token 处停止生成，不再浪费解码。
+    """
+    ids = tokenizer(text).input_ids
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=REQUEST_TIMEOUT)
+    cancelled = threading.Event()
+
+    def run():
+        try:
+            model_generate([ids], params, prefix_cache.match(ids), streamer=streamer,
+                           stopping_criteria=StoppingCriteriaList([CancelCriteria(cancelled)]))
+        except Exception as e:
+            print(f"Error during text generation: {e}")
+            streamer.end()
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        for piece in streamer:
+            if piece:
+                yield f"data: {json.dumps({'text': piece}, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        cancelled.set()
+
+
+_token_index = None
+_schema_guides = {}
+_schema_lock = threading.Lock()
+
+
+def schema_guide(schema_key):
+    """
+    按 Schema 的规范 JSON 字符串返回缓存的 SchemaGuide，同一 Schema 的自动机和各状态允许的 token 在请求之间复用。
+    Schema 不受支持时抛出 ValueError。
+    """
+    global _token_index
+    with _schema_lock:
+        if schema_key not in _schema_guides:
+            if _token_index is None:
+                _token_index = TokenIndex(tokenizer)
+            _schema_guides[schema_key] = SchemaGuide(JsonGrammar(json.loads(schema_key)), _token_index)
+        return _schema_guides[schema_key]
+
+
+# 批处理与流式生成共用模型，同一时刻只允许一个 generate 调用
+model_lock = threading.Lock()
+scheduler = BatchScheduler(generate_batch)
+
+head_dim = getattr(model.config, "head_dim", None) or model.config.hidden_size // model.config.num_attention_heads
+prefix_cache = PrefixCache(
+    PREFIX_CACHE_MAX_BYTES,
+    2 * model.config.num_hidden_layers * model.config.num_key_value_heads * head_dim * model.dtype.itemsize,
+)
+
+
 # 定义API端点
 @app.route('/generate', methods=['POST'])
 def generate_text():
@@ -28,18 +417,26 @@ def generate_text():
     if not data or 'prompt' not in data:
         return jsonify({"error": "Invalid request. 'prompt' key is required."}), 400
     
-    enable_thinking = data.get('enable_thinking', False)
-    max_new_tokens = data.get('max_new_tokens', 512)
-    temperature = data.get('temperature', 0.7)
-    do_sample = data.get('do_sample', True)
-    top_p = data.get('top_p', 0.95)
-    top_k = data.get('top_k', 50)
-    repetition_penalty = data.get('repetition_penalty', 1.0)
+    # 生成参数转换为标量类型，后续作为批处理分组的键，必须可哈希
+    try:
+        enable_thinking = bool(data.get('enable_thinking', False))
+        max_new_tokens = int(data.get('max_new_tokens', 512))
+        temperature = float(data.get('temperature', 0.7))
+        do_sample = bool(data.get('do_sample', True))
+        top_p = float(data.get('top_p', 0.95))
+        top_k = int(data.get('top_k', 50))
+        repetition_penalty = float(data.get('repetition_penalty', 1.0))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid generation parameter: {e}"}), 400
 
     user_prompt = data.get('prompt')
     messages = [{'role': 'user', 'content': user_prompt}]
 
     try:
+        # 请求可以附带提示词的固定开头部分，首次出现时注册到前缀缓存
+        if data.get('prefix'):
+            register_prefix(data['prefix'])
+
         text = tokenizer.apply_chat_template(
             messages,
             tokenize=False,
@@ -47,31 +444,21 @@ def generate_text():
             enable_thinking=enable_thinking
         )
 
-        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+        # 请求可以附带 JSON Schema，输出按 Schema 约束为紧凑 JSON
+        constraint = None
+        if data.get('schema'):
+            schema_key = json.dumps(data['schema'], ensure_ascii=False)
+            try:
+                schema_guide(schema_key)
+            except ValueError as e:
+                return jsonify({"error": f"Unsupported schema: {e}"}), 400
+            constraint = (schema_key, enable_thinking)
 
-        with torch.no_grad():
-            generated_ids = model.generate(
-                **model_inputs,
-                max_new_tokens=max_new_tokens,
-                pad_token_id=tokenizer.eos_token_id,
-                temperature=temperature,
-                do_sample=do_sample,
-                top_k=top_k,
-                repetition_penalty=repetition_penalty,
-            )
-        
-        print(model_inputs.input_ids.shape)
-        print(generated_ids.shape)
-
-        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist() 
-
-        try:
-            index = len(output_ids) - output_ids[::-1].index(151668)
-        except ValueError:
-            index = 0
-
-        thinking_content = tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
-        content = tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
+        # 生成参数相同的请求才能合并到同一次 generate 中
+        params = (max_new_tokens, temperature, do_sample, top_k, repetition_penalty, constraint)
+        if data.get('stream', False):
+            return Response(stream_with_context(stream_generate(text, params)), mimetype="text/event-stream")
+        thinking_content, content = scheduler.submit(text, params).result(timeout=REQUEST_TIMEOUT)
 
         return jsonify({"thinking_content": thinking_content, "content": content})
 
@@ -80,6 +467,19 @@ def generate_text():
         return jsonify({"error": "An error occurred during text generation."}), 500
 
 
+@app.route('/prefixes', methods=['POST'])
+def add_prefix():
+    data = request.get_json()
+    if not data or 'prefix' not in data:
+        return jsonify({"error": "Invalid request. 'prefix' key is required."}), 400
+    return jsonify({"tokens": register_prefix(data['prefix']), **prefix_cache.stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({**scheduler.metrics(), "prefix_cache": prefix_cache.stats()})
+
+
 if __name__ == '__main__':
 
-    app.run(host='0.0.0.0', port=10062)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=10062, threaded=True)
\ No newline at end of file
@@ -1,29 +1,190 @@
 import requests
 import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
-def request(prompt, enable_thinking=False):
-    api_url = "http://127.0.0.1:10062/generate"
+# 结果中的 JSON 代码块，出现结束的 ``` 后即可停止读取
+JSON_BLOCK = re.compile(r"```json.*?```", re.DOTALL)
 
-    payload_simple = {
-        "prompt": prompt,
-        "enable_thinking": enable_thinking,
-    }
+# 连接与重试配置
+BASE_URL = "http://127.0.0.1:10062"
+TIMEOUT = 300.0
+CONNECT_TIMEOUT = 5.0
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+POOL_SIZE = 16
+# 默认并发数，与服务端每批的最大请求数 MAX_BATCH_SIZE 相同
+CONCURRENCY = 8
+# 限流、服务端错误以及模型尚未加载完成时重试
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
 
+# 退避抖动使用独立的随机数生成器
+_backoff_random = random.Random()
+
+
+def split_thoughts(text):
+    """按 </think> 拆分思考内容与回答，没有 </think> 时思考内容为空"""
+    if "</think>" not in text:
+        return "", text.strip()
+    thinking_content, content = text.split("</think>", 1)
+    return thinking_content.replace("<think>", "").strip(), content.strip()
+
+
+def read_stream(response):
+    """
+    逐个读取 /generate 的 SSE 事件并拼接文本，回答中的 JSON 代码块结束后立即停止读取并关闭连接，
+    服务端随之停止生成。返回 (thinking_content, content)。
+    """
+    text = ""
     try:
-        response_simple = requests.post(api_url, json=payload_simple)
-        response_data_simple = response_simple.json()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            text += json.loads(data)["text"]
+            if JSON_BLOCK.search(split_thoughts(text)[1]):
+                break
+    finally:
+        response.close()
+    return split_thoughts(text)
+
+
+class QwenClient:
+    """
+    qwen_api 服务的客户端。
+
+    所有请求共用一个 requests.Session，连接池中保持至多 pool_size 个长连接，不再每次请求新建 TCP 连接；
+    每次请求带连接超时与读取超时，服务端挂起时不会无限等待。
+    连接失败、超时以及 429/5xx 响应按带抖动的指数退避重试，超过 max_retries 次后抛出异常。
+    request_many 在线程池中并发发出多个请求，服务端把同时到达的请求合并成批生成。
 
-        if enable_thinking:
-            thinking_content = response_data_simple["thinking_content"]
-            content = response_data_simple["content"]
-            return thinking_content, content
+    示例:
+    >>> with QwenClient() as client:
+    ...     contents = client.request_many(prompts, concurrency=8)
+    """
+
+    def __init__(self, base_url=BASE_URL, timeout=TIMEOUT, connect_timeout=CONNECT_TIMEOUT,
+                 max_retries=MAX_RETRIES, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, path, payload, stream=False):
+        """发送 POST 请求，可重试的错误按带抖动的指数退避重试，返回状态码正常的响应"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(self.base_url + path, json=payload, stream=stream, timeout=self.timeout)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response
+                response.close()
+                error = requests.exceptions.HTTPError(f"{response.status_code} Error for url: {response.url}", response=response)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            time.sleep(_backoff_random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+    def request(self, prompt, enable_thinking=False, stream=False, prefix=None, schema=None):
+        """
+        请求 /generate 生成回答。
+
+        参数:
+        - prompt: str, 提示词。
+        - enable_thinking: bool, 是否开启思考模式。
+        - stream: bool, 是否流式读取，回答中的 JSON 代码块结束后立即停止读取。
+        - prefix: str, 提示词中固定不变的开头部分，服务端首次收到时缓存其 KV，之后相同开头的请求跳过这部分的预填充。
+        - schema: dict, 回答的 JSON Schema，服务端按 Schema 约束解码，回答为不带代码块标记的紧凑 JSON。
+
+        返回值:
+        - enable_thinking 为True时返回 (thinking_content, content)，否则返回 content。重试后仍失败时抛出异常。
+        """
+        payload = {
+            "prompt": prompt,
+            "enable_thinking": enable_thinking,
+            "stream": stream,
+        }
+        if prefix:
+            payload["prefix"] = prefix
+        if schema:
+            payload["schema"] = schema
+
+        response = self._post("/generate", payload, stream=stream)
+        if stream:
+            thinking_content, content = read_stream(response)
         else:
-            content = response_data_simple["content"]
-            return content
+            data = response.json()
+            thinking_content, content = data["thinking_content"], data["content"]
+        return (thinking_content, content) if enable_thinking else content
+
+    def request_many(self, prompts, concurrency=CONCURRENCY, **kwargs):
+        """
+        并发请求多个提示词，返回结果的顺序与 prompts 一致。
 
+        参数:
+        - prompts: list, 提示词列表。
+        - concurrency: int, 同时进行的最大请求数，与服务端的 MAX_BATCH_SIZE 相同时每批正好填满。
+        - kwargs: 传给 request 的其他参数，所有提示词相同。
+
+        返回值:
+        - list, 每个提示词的结果，格式与 request 相同；重试后仍失败的提示词对应位置为 None，不影响其他提示词。
+        """
+        def call(prompt):
+            try:
+                return self.request(prompt, **kwargs)
+            except requests.exceptions.RequestException as e:
+                print(f"请求发生错误: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(prompts)))) as executor:
+            return list(executor.map(call, prompts))
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_client = None
+
+
+def default_client():
+    """返回进程内共享的默认客户端"""
+    global _default_client
+    if _default_client is None:
+        _default_client = QwenClient()
+    return _default_client
+
+
+def request(prompt, enable_thinking=False, stream=False, prefix=None, schema=None):
+    """
+    使用默认客户端请求 /generate，参数与 QwenClient.request 相同。
+    重试后仍失败时打印错误并返回 None。
+    """
+    try:
+        return default_client().request(prompt, enable_thinking=enable_thinking, stream=stream, prefix=prefix, schema=schema)
     except requests.exceptions.RequestException as e:
         print(f"请求发生错误: {e}")
 
+
+def request_many(prompts, concurrency=CONCURRENCY, **kwargs):
+    """使用默认客户端并发请求多个提示词，参数与返回值同 QwenClient.request_many"""
+    return default_client().request_many(prompts, concurrency=concurrency, **kwargs)
+
 if __name__ == "__main__":
     print(request("请写一首关于秋天的五言绝句。"))
 
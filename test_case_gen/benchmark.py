@@ -0,0 +1,448 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from openai import OpenAI
+import genetic
+import my_utils
+import response_cache
+from my_utils import get_client, with_retries
+from mock_llm import MockLLMServer
+from response_cache import ResponseCache
+from path_var_exa import path_var_exa
+from graph_run import convert_to_networkx, evaluate_guard, graph_cover
+from genetic_mutate import run_mutation, run_mutation_array
+from genetic import (
+    create_individual_random,
+    calculate_fitness,
+    calculate_fitness_batch,
+    genetic_algorithm,
+    solve_test_case,
+    crossover,
+    crossover_array,
+    population_to_array,
+    GRAPH_FILE_PATH,
+)
+
+"""
+适应度计算性能测试
+运行: python benchmark.py
+"""
+
+
+def load_graphs(graph_file_path=GRAPH_FILE_PATH):
+    """读取状态图数据，返回 (graph_json, graph, variables) 列表"""
+    graphs = []
+    with open(graph_file_path, "r") as graphs_file:
+        for graph_line in graphs_file:
+            graph_line = graph_line.strip()
+            if not graph_line:
+                continue
+            graph_json = json.loads(graph_line)
+            try:
+                variables = path_var_exa(graph_json)
+            except ValueError:
+                continue
+            graph = convert_to_networkx(graph_json, add_id=True)
+            graphs.append((graph_json, graph, variables))
+    return graphs
+
+
+def legacy_dfs(graph, vars, current_state, visited_edges, covered_edges):
+    """改造前的覆盖计算：每次访问变迁都对守卫字符串做替换并 eval"""
+    for _, next_state, edge_data in graph.edges(current_state, data=True):
+        guard = edge_data["guard"]
+        edge_id = edge_data["id"]
+
+        if edge_id not in visited_edges and evaluate_guard(guard, vars):
+            covered_edges.add(edge_id)
+            new_visited = visited_edges.copy()
+            new_visited.add(edge_id)
+            legacy_dfs(graph, vars, next_state, new_visited, covered_edges)
+
+
+def legacy_graph_cover(graph, vars):
+    covered_edges = set()
+    initial_state = list(graph.nodes())[0]
+    legacy_dfs(graph, vars, initial_state, set(), covered_edges)
+    return covered_edges, len(covered_edges)
+
+
+def time_cover(cover, graphs, individuals):
+    start = time.perf_counter()
+    results = []
+    for (_, graph, _), inds in zip(graphs, individuals):
+        results.append([cover(graph, ind)[1] for ind in inds])
+    return time.perf_counter() - start, results
+
+
+def bench_guard(graphs, num_individuals=200, seed=0):
+    """
+    对比字符串替换+eval 与预编译守卫函数两种覆盖计算方式的耗时。
+
+    参数:
+    - graphs: list, load_graphs 的返回值。
+    - num_individuals: int, 每个状态图随机生成的个体数量。
+    - seed: int, 随机种子。
+    """
+    random.seed(seed)
+    individuals = [[create_individual_random(variables) for _ in range(num_individuals)] for _, _, variables in graphs]
+
+    legacy_time, legacy_results = time_cover(legacy_graph_cover, graphs, individuals)
+    compiled_time, compiled_results = time_cover(graph_cover, graphs, individuals)
+
+    assert legacy_results == compiled_results, "覆盖结果不一致"
+    print(f"graphs:{len(graphs)} individuals/graph:{num_individuals}")
+    print(f"eval guard:     {legacy_time:.4f}s")
+    print(f"compiled guard: {compiled_time:.4f}s")
+    print(f"speedup:        {legacy_time / compiled_time:.2f}x")
+
+
+def synthetic_graph(num_states, out_degree=2, seed=0):
+    """
+    生成带环的随机状态图，用于测试覆盖计算在大图上的耗时。
+    每个状态有 out_degree 条出边，守卫条件为 "x > c" 或 "flag == true" 的形式。
+    """
+    rng = random.Random(seed)
+    states = [
+        {
+            "id": f"S{i}",
+            "name": f"S{i}",
+            "description": "",
+            "level": 1,
+            "out_action": "None",
+            "timing": {"duration": rng.randint(1, 100), "start_time": 0},
+        }
+        for i in range(1, num_states + 1)
+    ]
+    transitions = []
+    for i in range(1, num_states + 1):
+        targets = {i % num_states + 1}
+        while len(targets) < min(out_degree, num_states):
+            targets.add(rng.randint(1, num_states))
+        for j in targets:
+            t_id = f"T{len(transitions) + 1}"
+            if rng.random() < 0.5:
+                guard, guard_type = f"x > {rng.randint(-900, 900)}", {"x": "int"}
+            else:
+                guard, guard_type = "flag == true", {"flag": "bool"}
+            transitions.append(
+                {
+                    "id": t_id,
+                    "from": f"S{i}",
+                    "to": f"S{j}",
+                    "guard": guard,
+                    "description": "",
+                    "guard_type": guard_type,
+                    "timing": {"trigger_time": 0},
+                }
+            )
+    return {"name": "synthetic", "func_desc": "", "states": states, "transitions": transitions, "graph_id": f"synthetic_{num_states}"}
+
+
+def bench_cover(graphs, sizes=(8, 12, 16, 5000), num_individuals=20, seed=0):
+    """
+    对比逐条枚举变迁路径的深度优先搜索与线性时间的覆盖计算。
+
+    除 graphs 中的状态图外，再按 sizes 生成带环的随机状态图；
+    状态数超过 100 的图只测试线性时间的覆盖计算，旧方法在这种规模下耗时呈指数增长。
+    """
+    random.seed(seed)
+    graphs = list(graphs)
+    for i, size in enumerate(sizes):
+        graph_json = synthetic_graph(size, out_degree=3, seed=seed + i)
+        graphs.append((graph_json, convert_to_networkx(graph_json, add_id=True), path_var_exa(graph_json)))
+
+    print(f"{'graph':<20}{'states':>8}{'edges':>8}{'dfs(s)':>12}{'bfs(s)':>12}")
+    for graph_json, graph, variables in graphs:
+        inds = [create_individual_random(variables) for _ in range(num_individuals)]
+        start = time.perf_counter()
+        new_results = [graph_cover(graph, ind) for ind in inds]
+        new_time = time.perf_counter() - start
+        if graph.number_of_nodes() <= 100:
+            start = time.perf_counter()
+            legacy_results = [legacy_graph_cover(graph, ind) for ind in inds]
+            legacy_time = f"{time.perf_counter() - start:.4f}"
+            assert legacy_results == new_results, "覆盖结果不一致"
+        else:
+            legacy_time = "-"
+        print(f"{graph_json['graph_id']:<20}{graph.number_of_nodes():>8}{graph.number_of_edges():>8}{legacy_time:>12}{new_time:>12.4f}")
+
+
+def bench_batch(graphs, pop_sizes=(3, 100, 1000, 10000), seed=0):
+    """对比逐个体计算适应度与 NumPy 批量计算适应度在不同种群规模下的耗时"""
+    random.seed(seed)
+    print(f"{'pop_size':>10}{'per-individual(s)':>20}{'batch(s)':>12}")
+    for pop_size in pop_sizes:
+        populations = [[create_individual_random(variables) for _ in range(pop_size)] for _, _, variables in graphs]
+
+        start = time.perf_counter()
+        single = [[calculate_fitness(ind, graph) for ind in pop] for (_, graph, _), pop in zip(graphs, populations)]
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = [calculate_fitness_batch(pop, variables, graph) for (_, graph, variables), pop in zip(graphs, populations)]
+        batch_time = time.perf_counter() - start
+
+        assert single == batch, "适应度结果不一致"
+        print(f"{pop_size:>10}{single_time:>20.4f}{batch_time:>12.4f}")
+
+
+# check_dirty_parity 使用的守卫条件，覆盖 ==/!=、链式比较、取反以及与或的短路组合
+DIRTY_GUARDS = [
+    ("flag == true || x > 11", {"flag": "bool", "x": "int"}),
+    ("x != 3 && y < 0.5", {"x": "int", "y": "float"}),
+    ("!(flag == false) || y >= 2", {"flag": "bool", "y": "float"}),
+    ("0 < x < 50 && flag != true", {"x": "int", "flag": "bool"}),
+    ("y > 0.5 || x == 7", {"y": "float", "x": "int"}),
+]
+
+# 大模型变异可能返回的无效取值
+DIRTY_VALUES = [None, "True", "abc", 2, 0.5, True]
+
+
+def check_dirty_parity(num_graphs=50, num_individuals=50, dirty_rate=0.3, seed=0):
+    """
+    随机生成状态图和含无效取值的种群，检查 calculate_fitness_batch 与 calculate_fitness 的结果是否一致。
+
+    个体中的变量以 dirty_rate 的概率被替换为 DIRTY_VALUES 中的值或被删除；
+    每个状态图还随机去掉一个变量，使批量评估时守卫条件引用 columns 中没有的变量。
+    """
+    rng = random.Random(seed)
+    mismatches = 0
+    for g in range(num_graphs):
+        graph_json = synthetic_graph(rng.randint(2, 8), out_degree=2, seed=seed + g)
+        for transition in graph_json["transitions"]:
+            transition["guard"], transition["guard_type"] = rng.choice(DIRTY_GUARDS)
+        graph = convert_to_networkx(graph_json, add_id=True)
+        variables = path_var_exa(graph_json)
+        dropped = rng.choice(variables)["name"]
+        population = []
+        for _ in range(num_individuals):
+            individual = create_individual_random(variables)
+            for name in list(individual):
+                if name == dropped or rng.random() < dirty_rate / 4:
+                    del individual[name]
+                elif rng.random() < dirty_rate:
+                    individual[name] = rng.choice(DIRTY_VALUES)
+            population.append(individual)
+        kept = [var for var in variables if var["name"] != dropped]
+        single = [calculate_fitness(ind, graph) for ind in population]
+        batch = calculate_fitness_batch(population, kept, graph)
+        mismatches += sum(a != b for a, b in zip(single, batch))
+    print(f"dirty parity: {num_graphs} graphs, {num_individuals} individuals/graph, {mismatches} mismatches")
+    assert mismatches == 0, "含无效取值时批量适应度与逐个体适应度不一致"
+
+
+def bench_solve(graphs, rounds=10, seed=0):
+    """
+    对比遗传算法（锦标赛选择 + 位变异）与解析求解构造覆盖所有变迁的测试用例的耗时。
+
+    平均进化次数只统计解析求解能覆盖全部变迁的状态图；存在不可满足的守卫条件或不可达变迁的状态图
+    两种方式都返回 max_gens，计入均值会掩盖差异，单独计数。
+    """
+    random.seed(seed)
+    print(f"{'graph':<20}{'edges':>8}{'ga(s)':>12}{'ga cover':>10}{'solve(s)':>12}{'solve cover':>13}")
+    gens = {"ga": 0, "solve": 0}
+    covered_graphs = 0
+    for graph_json, graph, variables in graphs:
+        start = time.perf_counter()
+        ga_cover, ga_gen = 0, 0
+        for _ in range(rounds):
+            best, gen = genetic_algorithm(variables, 3, 50, 0.8, 0.1, graph, select="tournament", mutation="bit_flip")
+            ga_cover += graph_cover(graph, best)[1]
+            ga_gen += gen
+        ga_time = (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        solve_cover, solve_gen = 0, 0
+        for _ in range(rounds):
+            individual, gen = solve_test_case(variables, graph, select="tournament", mutation="bit_flip")
+            solve_cover += graph_cover(graph, individual)[1]
+            solve_gen += gen
+        solve_time = (time.perf_counter() - start) / rounds
+
+        if solve_cover == graph.number_of_edges() * rounds:
+            covered_graphs += 1
+            gens["ga"] += ga_gen / rounds
+            gens["solve"] += solve_gen / rounds
+        print(f"{graph_json['graph_id']:<20}{graph.number_of_edges():>8}{ga_time:>12.6f}{ga_cover / rounds:>10.1f}"
+              f"{solve_time:>12.6f}{solve_cover / rounds:>13.1f}")
+    if covered_graphs:
+        print(f"avg gen over {covered_graphs} fully covered graphs: ga {gens['ga'] / covered_graphs:.1f}, "
+              f"solve {gens['solve'] / covered_graphs:.1f} ({len(graphs) - covered_graphs} graphs excluded)")
+
+
+def bench_fitness_mode(graphs, selections=("tournament", "rank"), mutations=("bit_flip", "uniform", "gaussian"),
+                       rounds=10, seed=0):
+    """对比 coverage 与 branch_distance 两种适应度下达到全覆盖所需的平均进化次数"""
+    print(f"{'graph':<20}{'selection':<12}{'mutation':<10}{'coverage':>10}{'branch_distance':>17}")
+    totals = {"coverage": 0, "branch_distance": 0}
+    for graph_json, graph, variables in graphs:
+        for selection in selections:
+            for mutation in mutations:
+                avg_gen = {}
+                for fitness in totals:
+                    random.seed(seed)
+                    gens = [
+                        genetic_algorithm(variables, 3, 50, 0.8, 0.1, graph, select=selection, mutation=mutation, fitness=fitness)[1]
+                        for _ in range(rounds)
+                    ]
+                    avg_gen[fitness] = sum(gens) / rounds
+                    totals[fitness] += avg_gen[fitness]
+                print(f"{graph_json['graph_id']:<20}{selection:<12}{mutation:<10}{avg_gen['coverage']:>10.1f}{avg_gen['branch_distance']:>17.1f}")
+    configs = len(graphs) * len(selections) * len(mutations)
+    print(f"{'mean':<42}{totals['coverage'] / configs:>10.1f}{totals['branch_distance'] / configs:>17.1f}")
+
+
+def bench_operators(num_vars=(10, 100, 1000), pop_size=100, mutations=("bit_flip", "uniform", "gaussian", "swap"),
+                    generations=20, seed=0):
+    """对比字典版本与数组版本的交叉+变异在不同变量数量下每代的耗时"""
+    random.seed(seed)
+    rng = np.random.default_rng(seed)
+    print(f"{'vars':>6}{'mutation':>10}{'dict(ms/gen)':>14}{'array(ms/gen)':>15}")
+    for m in num_vars:
+        vars = [{"name": f"v{j}_T{j}", "type": random.choice(["bool", "int", "float"])} for j in range(m)]
+        types = np.array([var["type"] for var in vars], dtype=object)
+        population = [create_individual_random(vars) for _ in range(pop_size)]
+        array = population_to_array(population, vars)
+        for mutation in mutations:
+            start = time.perf_counter()
+            for _ in range(generations):
+                new_pop = []
+                for i in range(0, pop_size, 2):
+                    c1, c2 = crossover(population[i], population[i + 1], vars, 0.8)
+                    new_pop.extend([run_mutation(c1, vars, None, mutation, 0.1), run_mutation(c2, vars, None, mutation, 0.1)])
+            dict_time = (time.perf_counter() - start) / generations * 1000
+
+            start = time.perf_counter()
+            for _ in range(generations):
+                run_mutation_array(crossover_array(array, rng, 0.8), vars, types, None, mutation, rng, 0.1)
+            array_time = (time.perf_counter() - start) / generations * 1000
+            print(f"{m:>6}{mutation:>10}{dict_time:>14.3f}{array_time:>15.3f}")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """本地替身服务：对任意 POST 请求返回固定的 chat.completions 响应，支持长连接"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    body = json.dumps({
+        "id": "chatcmpl-local",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "stand-in",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "{}"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }).encode("utf-8")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_client(calls=200):
+    """对比每次请求新建 OpenAI 客户端与复用 get_client 连接池时，向本地替身服务发送请求的平均耗时"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    messages = [{"role": "user", "content": "ping"}]
+
+    def fresh_call():
+        client = OpenAI(api_key="EMPTY", base_url=base_url)
+        return client.chat.completions.create(model="stand-in", messages=messages)
+
+    def pooled_call():
+        client = get_client(base_url, "EMPTY")
+        return with_retries(lambda: client.chat.completions.create(model="stand-in", messages=messages))
+
+    try:
+        print(f"{'client':<10}{'ms/call':>10}")
+        for name, call in (("fresh", fresh_call), ("pooled", pooled_call)):
+            call()
+            start = time.perf_counter()
+            for _ in range(calls):
+                call()
+            print(f"{name:<10}{(time.perf_counter() - start) / calls * 1000:>10.3f}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# 在 intel_test_case_gen 目录下的子进程中运行 graph_extension：该目录的 get_prompt 与本目录同名，不能在同一进程中导入
+GRAPH_EXTENSION_SCRIPT = """
+import sys
+import matching_crition
+matching_crition.my_utils.API_CONFIGS["zhipu"].update(base_url=sys.argv[1], api_key="EMPTY")
+matching_crition.API_TYPE = "zhipu"
+from graph_ext import graph_extension
+graph_extension(sys.argv[2])
+"""
+INTEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "intel_test_case_gen")
+
+
+def bench_pipeline(graph_file_path=GRAPH_FILE_PATH, selections=("tournament", "rank"), rounds=2,
+                   latency=0.05, jitter=0.02, failure_rate=0.05, seed=0):
+    """
+    用本地大模型替身服务（mock_llm.MockLLMServer）端到端运行 model 变异的 run_gentic 与 graph_extension，
+    统计耗时、请求数与注入的失败次数，不需要远程 API 或 GPU。
+
+    运行期间 my_utils 的 zhipu 配置指向替身服务，响应缓存与实验结果写入临时目录，结束后恢复。
+    """
+    saved_config = dict(my_utils.API_CONFIGS["zhipu"])
+    saved_globals = (genetic.GRAPH_FILE_PATH, genetic.ROUNDS, response_cache._default_cache)
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockLLMServer(port=0, latency=latency, jitter=jitter, failure_rate=failure_rate, seed=seed) as server:
+        my_utils.API_CONFIGS["zhipu"].update(base_url=server.base_url + "/v1", api_key="EMPTY")
+        genetic.GRAPH_FILE_PATH, genetic.ROUNDS = graph_file_path, rounds
+        response_cache._default_cache = ResponseCache(os.path.join(tmp, "responses.sqlite"))
+        try:
+            print(f"{'stage':<18}{'seconds':>10}{'requests':>10}{'failures':>10}")
+            start = time.perf_counter()
+            summary = genetic.run_gentic(list(selections), ["model"], exp_file_path=os.path.join(tmp, "exp.jsonl"))
+            stats = server.stats()
+            print(f"{'run_gentic':<18}{time.perf_counter() - start:>10.3f}{stats['chat']:>10}{stats['failures']:>10}")
+            print(f"{'':<18}{summary} response cache:{response_cache._default_cache.stats()}")
+
+            extension_path = os.path.join(tmp, "graph_extention.jsonl")
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", GRAPH_EXTENSION_SCRIPT, server.base_url + "/v1", extension_path],
+                           cwd=INTEL_DIR, check=True)
+            extended = server.stats()
+            print(f"{'graph_extension':<18}{time.perf_counter() - start:>10.3f}"
+                  f"{extended['chat'] - stats['chat']:>10}{extended['failures'] - stats['failures']:>10}")
+            with open(extension_path, "r") as extension_file:
+                graph = json.loads(extension_file.readline())
+            print(f"{'':<18}extended states:{len(graph['states'])} transitions:{len(graph['transitions'])}")
+        finally:
+            my_utils.API_CONFIGS["zhipu"].clear()
+            my_utils.API_CONFIGS["zhipu"].update(saved_config)
+            response_cache._default_cache.close()
+            genetic.GRAPH_FILE_PATH, genetic.ROUNDS, response_cache._default_cache = saved_globals
+
+
+if __name__ == "__main__":
+
+    graphs = load_graphs()
+    bench_guard(graphs)
+    bench_cover(graphs)
+    bench_batch(graphs)
+    check_dirty_parity()
+    bench_solve(graphs)
+    bench_fitness_mode(graphs)
+    bench_operators()
+    bench_client()
+    bench_pipeline()
@@ -0,0 +1,85 @@
+import math
+from path_var_exa import parse_guard
+
+"""
+分支距离
+衡量个体离满足某个守卫条件还有多远，为覆盖率相同的个体提供区分
+"""
+
+# 严格比较不满足时额外加上的常数
+K = 1
+
+
+def atom_distance(value, op, constant):
+    """
+    单个比较 value op constant 的分支距离，满足时为0。
+
+    示例:
+    >>> atom_distance(80.0, "<=", 50)
+    30.0
+    >>> atom_distance(True, "==", False)
+    1
+    """
+    if isinstance(value, bool) or isinstance(constant, bool):
+        value, constant = int(value), int(constant)
+    if op == "==":
+        return abs(value - constant)
+    if op == "!=":
+        return 0 if value != constant else K
+    if op == "<":
+        return 0 if value < constant else value - constant + K
+    if op == "<=":
+        return 0 if value <= constant else value - constant
+    if op == ">":
+        return 0 if value > constant else constant - value + K
+    return 0 if value >= constant else constant - value
+
+
+def guard_distance(dnf, vars):
+    """
+    守卫条件的分支距离：合取项内各比较的距离求和，合取项之间取最小值。
+    变量缺失或取值不是数值时距离为无穷大。
+
+    参数:
+    - dnf: list, parse_guard 返回的析取范式
+    - vars: dict, 个体
+    """
+    best = math.inf
+    for conjunct in dnf:
+        distance = 0
+        for var, op, constant in conjunct:
+            value = vars.get(var)
+            if not isinstance(value, (bool, int, float)):
+                distance = math.inf
+                break
+            distance += atom_distance(value, op, constant)
+        best = min(best, distance)
+    return best
+
+
+def edge_dnf(edge_data):
+    """返回变迁守卫条件的析取范式，解析结果缓存在边属性 dnf 中；无法解析时为 None"""
+    if "dnf" not in edge_data:
+        try:
+            edge_data["dnf"] = parse_guard(edge_data["guard"])
+        except ValueError:
+            edge_data["dnf"] = None
+    return edge_data["dnf"]
+
+
+def frontier_bonus(frontier, vars):
+    """
+    覆盖边界上各变迁的归一化接近程度之和，缩放到 [0, 1)。
+
+    每条变迁的接近程度为 1 / (1 + 分支距离)，距离为0（满足）时为1，越远越接近0；
+    无法解析的守卫条件接近程度为0。总和除以 (边界变迁数 + 1)，
+    保证加上后不会超过多覆盖一条变迁带来的适应度增量。
+    """
+    if not frontier:
+        return 0.0
+    closeness = 0.0
+    for edge_data in frontier:
+        dnf = edge_dnf(edge_data)
+        if dnf is not None:
+            closeness += 1.0 / (1.0 + guard_distance(dnf, vars))
+    return closeness / (len(frontier) + 1)
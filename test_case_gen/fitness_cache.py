@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+
+"""
+适应度缓存
+同一状态图上，相同取值的个体适应度相同，缓存后跨代、跨轮次、跨选择/变异配置复用
+"""
+
+DEFAULT_CACHE_SIZE = 100000
+
+
+def individual_key(individual, namespace=""):
+    """
+    计算个体取值的规范哈希，作为适应度缓存的键。
+
+    按变量名排序后对 (变量名, 取值) 的 repr 做 blake2b 摘要，与字典插入顺序无关，
+    且在不同进程中结果一致（不依赖随进程变化的内置 hash）。True 与 1 的 repr 不同，视为不同的键。
+
+    参数:
+    - individual: dict, 测试用例，键为变量名，值为变量值。
+    - namespace: str, 区分不同适应度计算方式的前缀，同一个体在不同方式下得到不同的键。
+
+    返回值:
+    - bytes, 16字节的摘要。
+    """
+    canonical = namespace + repr(sorted(individual.items(), key=lambda item: item[0]))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+
+class FitnessCache:
+    """
+    单个状态图的适应度缓存，容量有限，按最近最少使用（LRU）淘汰，并统计命中与未命中次数。
+
+    get_many/put_many 以批量方式读写，整个种群只需一次调用，
+    通过 FitnessCacheManager 在多进程间共享时可以减少进程间通信次数。
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_many(self, keys):
+        """返回与 keys 一一对应的适应度列表，未命中的位置为 None"""
+        results = []
+        with self._lock:
+            for key in keys:
+                fitness = self._data.get(key)
+                if fitness is None:
+                    self._misses += 1
+                else:
+                    self._data.move_to_end(key)
+                    self._hits += 1
+                results.append(fitness)
+        return results
+
+    def put_many(self, items):
+        """写入 {key: fitness}，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            for key, fitness in items.items():
+                self._data[key] = fitness
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._hits = self._misses = self._evictions = 0
+
+
+_graph_caches = {}
+_graph_caches_lock = threading.Lock()
+
+
+def _graph_cache(graph_id, maxsize=DEFAULT_CACHE_SIZE):
+    """在管理进程中按状态图ID返回同一个缓存对象"""
+    with _graph_caches_lock:
+        if graph_id not in _graph_caches:
+            _graph_caches[graph_id] = FitnessCache(maxsize)
+        return _graph_caches[graph_id]
+
+
+class FitnessCacheManager(BaseManager):
+    """
+    跨进程共享适应度缓存的管理器。
+
+    缓存保存在管理器进程中，manager.graph_cache(graph_id) 返回该状态图缓存的代理对象，
+    代理对象可以传给进程池中的工作进程，所有选择/变异配置与轮次共用同一状态图上已计算的结果。
+
+    示例:
+    >>> with FitnessCacheManager() as manager:
+    ...     cache = manager.graph_cache("8121f8fd")
+    ...     cache.put_many({individual_key({"x_T1": 1}): 2})
+    """
+
+
+FitnessCacheManager.register("graph_cache", callable=_graph_cache, exposed=("get_many", "put_many", "stats", "clear"))
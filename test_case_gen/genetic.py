@@ -1,15 +1,31 @@
-from pdb import run
-from path_var_exa import path_var_exa
-from graph_run import graph_cover, convert_to_networkx, guard_extra
-from genetic_mutate import run_mutation
-from genetic_select import run_selection
+from path_var_exa import path_var_exa, finite_interval
+from graph_run import graph_cover, graph_frontier, batch_graph_cover, convert_to_networkx
+from branch_distance import frontier_bonus
+from genetic_mutate import run_mutation, run_mutation_batch, run_mutation_array
+from genetic_select import run_selection, run_selection_indices
+from fitness_cache import FitnessCache, individual_key
+from result_writer import ResultWriter
 import random
 import json
+import numpy as np
 
 """
 遗传算法生成测试用例
 """
 
+# 遗传算法参数
+POP_SIZE = 3
+MAX_GENERATIONS = 50
+CROSSOVER_RATE = 0.8
+MUTATION_RATE = 0.1
+ROUNDS = 10
+
+GRAPH_FILE_PATH = "../data/graph_data/graph_time_id.jsonl"
+EXP_FILE_PATH = "../data/genetic_exp_data/mutation_data.jsonl"
+
+# 个体缺少变量时的占位值，与取值为 None 区分
+MISSING = object()
+
 def create_individual_rule(vars):
     """
     初始化单个个体（测试用例）。
@@ -78,14 +94,176 @@ def create_individual_random(vars):
             individual[name] = random.uniform(-1000.0, 1000.0)
     return individual
 
+def sample_intervals(intervals, type_):
+    """
+    在区间并集内随机取值。
+
+    先等概率选取一个区间（使析取的每个分支被选中的机会相同），再在区间内均匀取值，
+    无穷端点由 finite_interval 截断。
+
+    参数:
+    - intervals: list, 闭区间 (lo, hi) 的列表，不能为空。
+    - type_: str, 变量类型，bool/int/float。
+
+    返回值:
+    - 区间内的一个取值，类型与 type_ 对应。
+    """
+    lo, hi = finite_interval(*random.choice(intervals))
+    if type_ == "bool":
+        return bool(random.randint(int(lo), int(hi)))
+    elif type_ == "int":
+        return random.randint(int(lo), int(hi))
+    return random.uniform(lo, hi)
+
+
+def create_individual_interval(vars):
+    """
+    初始化单个个体（测试用例），取值落在守卫条件的满足区域内。
+
+    同一变迁的变量一起取值：先随机选取守卫条件析取范式中的一个合取项（path_var_exa 给出的 boxes），
+    再在该合取项中各变量的区间内取值，因此 "a > 5 || b == true" 这类跨变量的析取也能得到满足的取值。
+    守卫条件无法按区间处理或不可满足时，该变迁的变量退化为 create_individual_random 的随机取值。
+
+    参数:
+    - vars: list, path_var_exa 返回的变量信息列表。
+
+    返回值:
+    - individual: dict, 生成的测试用例，键为变量名，值为变量值。
+    """
+    transitions = {}
+    for var in vars:
+        transitions.setdefault(var.get("transition"), []).append(var)
+
+    individual = {}
+    for transition_vars in transitions.values():
+        boxes_len = {len(var["boxes"]) if var.get("boxes") else 0 for var in transition_vars}
+        if len(boxes_len) != 1 or 0 in boxes_len:
+            individual.update(create_individual_random(transition_vars))
+            continue
+        k = random.randrange(boxes_len.pop())
+        for var in transition_vars:
+            individual[var["name"]] = sample_intervals(var["boxes"][k], var["type"])
+    return individual
+
+
+def init_population(vars, pop_size, init="random", random_ratio=0.2):
+    """
+    初始化种群。
+
+    参数:
+    - vars: list, 变量信息列表
+    - pop_size: int, 种群大小
+    - init: str, 初始化方法，random 为 create_individual_random，rule 为 create_individual_rule，
+      interval 为 create_individual_interval
+    - random_ratio: float, init 不为 random 时，用 create_individual_random 生成的个体比例，保持种群多样性
+
+    返回值:
+    - list, 个体字典列表
+    """
+    if init == "random":
+        return [create_individual_random(vars) for _ in range(pop_size)]
+    creators = {"rule": create_individual_rule, "interval": create_individual_interval}
+    create_individual = creators[init]
+    num_random = int(round(pop_size * random_ratio))
+    population = [create_individual(vars) for _ in range(pop_size - num_random)]
+    population += [create_individual_random(vars) for _ in range(num_random)]
+    return population
+
+
 # 适应度函数应该和路径的执行结果相适应，这里需要改进
-def calculate_fitness(individual, graph):
-    
+def calculate_fitness(individual, graph, fitness="coverage"):
+    """
+    计算个体的适应度。
+
+    fitness 为 coverage 时适应度为覆盖的变迁数加一；
+    为 branch_distance 时再加上覆盖边界上各守卫条件的归一化分支距离（见 branch_distance.frontier_bonus），
+    取值在 [0, 1) 之间，覆盖数相同的个体按离满足下一批守卫条件的远近区分，全覆盖时两种方式的适应度相同。
+    """
+    if fitness == "branch_distance":
+        covered_edges, frontier = graph_frontier(graph, individual)
+        return len(covered_edges) + 1 + frontier_bonus(frontier, individual)
     _, covered_len = graph_cover(graph, individual)
     #  加一避免除以0
     return covered_len + 1
 
 
+def population_to_columns(population, vars):
+    """
+    将个体字典组成的种群转换为列存储。
+
+    每个别名变量一列：bool 类型且取值都为0/1时为bool数组，其余统一为float64数组。
+    个体缺少某个变量或取值不是数值（如大模型变异返回的 None 或字符串）时，该位置以掩码表示，
+    缺少变量的位置数据为 NaN、取值无效的位置数据为0，批量评估时据此区分两种情况（见 vectorize_guard），
+    与逐个体评估时的行为一致。
+
+    参数:
+    - population: list, 个体字典列表
+    - vars: list, path_var_exa 返回的变量信息列表
+
+    返回值:
+    - columns: dict, 键为变量名，值为长度为种群大小的NumPy数组或掩码数组
+    """
+    columns = {}
+    for var in vars:
+        name = var["name"]
+        values = [ind.get(name, MISSING) for ind in population]
+        valid = [isinstance(v, (bool, int, float)) for v in values]
+        if var["type"] == "bool" and all(ok and v in (0, 1) for v, ok in zip(values, valid)):
+            column = np.array(values, dtype=bool)
+        else:
+            column = np.array([v if ok else (np.nan if v is MISSING else 0.0) for v, ok in zip(values, valid)],
+                              dtype=np.float64)
+        if all(valid):
+            columns[name] = column
+        else:
+            columns[name] = np.ma.masked_array(column, mask=np.logical_not(valid))
+    return columns
+
+
+def calculate_fitness_batch(population, vars, graph):
+    """calculate_fitness 的种群批量版本，返回与 population 一一对应的适应度列表"""
+    columns = population_to_columns(population, vars)
+    _, covered_len = batch_graph_cover(graph, columns, len(population))
+    return (covered_len + 1).tolist()
+
+
+def evaluate_population(population, vars, graph, batch=False, cache=None, fitness="coverage"):
+    """
+    计算整个种群的适应度。
+
+    给定 cache（FitnessCache 或其跨进程代理）时，先按个体取值的规范哈希批量查询缓存，
+    只对未命中的个体计算适应度，再把新结果批量写回缓存。
+
+    参数:
+    - population: list, 个体字典列表
+    - vars: list, 变量信息列表
+    - graph: nx.DiGraph, 状态图
+    - batch: bool, 是否使用 calculate_fitness_batch 批量计算，只支持 coverage 适应度
+    - cache: FitnessCache, 当前状态图的适应度缓存，为 None 时不使用缓存
+    - fitness: str, 适应度计算方式，见 calculate_fitness
+
+    返回值:
+    - list, 与 population 一一对应的适应度
+    """
+    if cache is None:
+        if batch and fitness == "coverage":
+            return calculate_fitness_batch(population, vars, graph)
+        return [calculate_fitness(ind, graph, fitness) for ind in population]
+
+    namespace = "" if fitness == "coverage" else fitness
+    keys = [individual_key(ind, namespace) for ind in population]
+    fitnesses = cache.get_many(keys)
+    missing = [i for i, value in enumerate(fitnesses) if value is None]
+    if missing:
+        computed = evaluate_population([population[i] for i in missing], vars, graph, batch, fitness=fitness)
+        new_items = {}
+        for i, value in zip(missing, computed):
+            fitnesses[i] = value
+            new_items[keys[i]] = value
+        cache.put_many(new_items)
+    return fitnesses
+
+
 def crossover(parent1, parent2, vars, crossover_rate):
     
     # 不进行交叉操作
@@ -106,16 +284,27 @@ def crossover(parent1, parent2, vars, crossover_rate):
     return child1, child2
 
 
-def genetic_algorithm(vars, pop_size, max_gens, cross_rate, mut_rate, graph, select="tournament", mutation="model"):
-    """主遗传算法"""
+def genetic_algorithm(vars, pop_size, max_gens, cross_rate, mut_rate, graph, select="tournament", mutation="model", batch=False, cache=None,
+                      init="random", random_ratio=0.2, population=None, fitness="coverage", candidates=1):
+    """
+    主遗传算法
+
+    batch 为True时使用 calculate_fitness_batch 对整个种群批量计算适应度；
+    cache 为当前状态图的 FitnessCache，跨代、跨轮次复用相同个体的适应度；
+    init 和 random_ratio 为种群初始化方法及其中随机个体的比例，见 init_population；
+    population 为给定的初始种群，不为 None 时忽略 init；
+    fitness 为适应度计算方式，coverage 或 branch_distance，见 calculate_fitness；
+    candidates 为 model 变异每次请求大模型采样的候选数，见 mutate_model_batch。
+    """
     # 初始化种群
-    population = [create_individual_random(vars) for _ in range(pop_size)]
+    if population is None:
+        population = init_population(vars, pop_size, init, random_ratio)
     best_ever = None
     best_fitness = -float("inf")
 
     for gen in range(max_gens):
         # 计算适应度
-        fitnesses = [calculate_fitness(ind, graph) for ind in population]
+        fitnesses = evaluate_population(population, vars, graph, batch, cache, fitness)
 
         # 更新历史最佳
         current_best = max(fitnesses)
@@ -138,7 +327,13 @@ def genetic_algorithm(vars, pop_size, max_gens, cross_rate, mut_rate, graph, sel
             p2 = parents[i + 1] if (i + 1) < len(parents) else parents[0]
             c1, c2 = crossover(p1, p2, vars, cross_rate)
             # new_pop.extend([mutate(c1, vars, mut_rate), mutate(c2, vars, mut_rate)])
-            new_pop.extend([run_mutation(c1, vars, graph, mutation), run_mutation(c2, vars, graph, mutation)])
+            if mutation == "model":
+                new_pop.extend([c1, c2])
+            else:
+                new_pop.extend([run_mutation(c1, vars, graph, mutation), run_mutation(c2, vars, graph, mutation)])
+        if mutation == "model":
+            # 大模型变异在整代子代生成后并发请求
+            new_pop = run_mutation_batch(new_pop, vars, graph, mutation, candidates=candidates)
 
         # 精英保留（确保不丢失最佳个体）
         if best_ever is not None:
@@ -149,54 +344,261 @@ def genetic_algorithm(vars, pop_size, max_gens, cross_rate, mut_rate, graph, sel
     # 返回最佳个体和进化次数
     return best_ever, max_gens
 
-def run_gentic(selections, mutations):
-    
-    # 遗传算法参数
-    POP_SIZE = 3
-    MAX_GENERATIONS = 50
-    CROSSOVER_RATE = 0.8
-    MUTATION_RATE = 0.1
-    rounds = 10
+def population_to_array(population, vars):
+    """
+    将个体字典组成的种群转换为 (个体数, 变量数) 的float64矩阵，列顺序同 vars。
+    bool 存为0/1；缺失或类型不符的取值为 NaN，评估时视为守卫条件不满足。
+    """
+    names = [var["name"] for var in vars]
+    array = np.full((len(population), len(names)), np.nan)
+    for i, individual in enumerate(population):
+        for j, name in enumerate(names):
+            value = individual.get(name)
+            if isinstance(value, (bool, int, float)):
+                array[i, j] = value
+    return array
+
+
+def array_to_population(array, vars):
+    """population_to_array 的逆变换，按变量类型还原为 bool/int/float，NaN 对应的变量不写入个体"""
+    casts = {"bool": bool, "int": int, "float": float}
+    population = []
+    for row in array.tolist():
+        individual = {}
+        for var, value in zip(vars, row):
+            if value == value:
+                individual[var["name"]] = casts[var["type"]](value)
+        population.append(individual)
+    return population
+
+
+def array_to_columns(array, vars):
+    """将种群矩阵转换为 batch_graph_cover 使用的列存储，NaN 以掩码表示"""
+    missing = np.isnan(array)
+    columns = {}
+    for j, var in enumerate(vars):
+        column = array[:, j] > 0.5 if var["type"] == "bool" else array[:, j]
+        columns[var["name"]] = np.ma.masked_array(column, mask=missing[:, j]) if missing[:, j].any() else column
+    return columns
+
+
+def random_array(types, pop_size, rng):
+    """create_individual_random 的数组版本，一次生成整个种群"""
+    shape = (pop_size, len(types))
+    return np.where(
+        types == "bool",
+        rng.integers(0, 2, shape),
+        np.where(types == "int", rng.integers(-1000, 1001, shape), rng.uniform(-1000.0, 1000.0, shape)),
+    ).astype(np.float64)
+
+
+def crossover_array(parents, rng, crossover_rate):
+    """
+    crossover 的数组版本：第 2k 与第 2k+1 行配对（个体数为奇数时最后一行与第0行配对），
+    每对以 crossover_rate 的概率进行均匀交叉，每个变量以0.5的概率交换，返回与 parents 行数相同的子代矩阵。
+    """
+    pop_size = parents.shape[0]
+    first = np.arange(0, pop_size, 2)
+    second = np.where(first + 1 < pop_size, first + 1, 0)
+    child1, child2 = parents[first].copy(), parents[second].copy()
+    swap = (rng.random(child1.shape) < 0.5) & (rng.random((first.size, 1)) < crossover_rate)
+    child1[swap], child2[swap] = parents[second][swap], parents[first][swap]
+    children = np.empty((first.size * 2, parents.shape[1]))
+    children[0::2], children[1::2] = child1, child2
+    return children[:pop_size]
+
+
+def genetic_algorithm_array(vars, pop_size, max_gens, cross_rate, mut_rate, graph, select="tournament", mutation="bit_flip",
+                            rng=None, init="random", random_ratio=0.2, candidates=1):
+    """
+    以数组存储种群的遗传算法。
+
+    种群始终是 (个体数, 变量数) 的矩阵，适应度用 batch_graph_cover 批量计算，交叉和变异由
+    crossover_array 和 run_mutation_array 用 NumPy 掩码对整个种群一次完成，每代的Python开销与变量数量基本无关。
+    只有返回的最佳个体转换回字典。选择仍使用 random 模块（run_selection_indices），
+    rng 为 None 时由 random 派生，因此设置 random 的种子即可复现整个过程。
+
+    参数与返回值同 genetic_algorithm；rng 为 numpy.random.Generator。
+    """
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+    types = np.array([var["type"] for var in vars], dtype=object)
+    if init == "random":
+        population = random_array(types, pop_size, rng)
+    else:
+        population = population_to_array(init_population(vars, pop_size, init, random_ratio), vars)
+    best_ever = None
+    best_fitness = -float("inf")
+
+    for gen in range(max_gens):
+        _, covered_len = batch_graph_cover(graph, array_to_columns(population, vars), pop_size)
+        fitnesses = (covered_len + 1).tolist()
+
+        current_best = max(fitnesses)
+        if current_best > best_fitness:
+            best_ever = population[fitnesses.index(current_best)].copy()
+            best_fitness = current_best
+
+        if current_best == graph.number_of_edges() + 1:
+            return array_to_population(best_ever[None, :], vars)[0], gen+1
+
+        parents = population[run_selection_indices(fitnesses, select)]
+        population = run_mutation_array(crossover_array(parents, rng, cross_rate), vars, types, graph, mutation, rng, candidates=candidates)
+
+        # 精英保留
+        population[0] = best_ever
+
+    return array_to_population(best_ever[None, :], vars)[0], max_gens
+
+
+def representative_value(intervals, type_):
+    """
+    在区间并集中确定性地选取一个取值：取第一个区间截断后的中点，避免选取边界值。
+    """
+    lo, hi = finite_interval(*intervals[0])
+    if type_ == "bool":
+        return bool((int(lo) + int(hi)) // 2)
+    elif type_ == "int":
+        return (int(lo) + int(hi)) // 2
+    return (lo + hi) / 2
+
+
+def solve_guards(vars, graph=None):
+    """
+    按区间推理直接为每个变迁的守卫条件构造满足的取值。
+
+    每个变迁取其析取范式中的第一个可满足合取项（path_var_exa 给出的 boxes[0]），
+    各变量取该合取项区间内的 representative_value。给定 graph 时再用边上编译好的守卫条件校验，
+    校验不通过的变迁视为无法判定。
+
+    参数:
+    - vars: list, path_var_exa 返回的变量信息列表
+    - graph: nx.DiGraph, convert_to_networkx(add_id=True) 构建的状态图，可选
+
+    返回值:
+    - tuple:
+      - 第一个元素为 dict，已求解的变量取值（不可满足的守卫条件不包含在内）
+      - 第二个元素为 list，无法按区间判定的变量信息
+    """
+    transitions = {}
+    for var in vars:
+        transitions.setdefault(var.get("transition"), []).append(var)
+
+    solved = {}
+    undecided = []
+    for transition_vars in transitions.values():
+        boxes = [var.get("boxes") for var in transition_vars]
+        if any(box is None for box in boxes):
+            undecided.extend(transition_vars)
+        elif all(boxes):
+            for var in transition_vars:
+                solved[var["name"]] = representative_value(var["boxes"][0], var["type"])
+
+    if graph is not None:
+        failed = {
+            transition_id
+            for _, _, edge_data in graph.edges(data=True)
+            if (transition_id := edge_data["id"]) in transitions
+            and transition_id not in {var.get("transition") for var in undecided}
+            and all(var["name"] in solved for var in transitions[transition_id])
+            and not edge_data["predicate"](solved)
+        }
+        for transition_id in failed:
+            for var in transitions[transition_id]:
+                solved.pop(var["name"])
+                undecided.append(var)
+    return solved, undecided
+
+
+def solve_test_case(vars, graph, pop_size=3, max_gens=50, cross_rate=0.8, mut_rate=0.1, **ga_kwargs):
+    """
+    解析求解模式：不经过遗传算法，直接构造覆盖所有变迁的测试用例。
+
+    先由 solve_guards 求出所有能按区间判定的守卫条件的取值；全部可判定时直接返回，
+    覆盖全部变迁时进化次数为0，存在不可满足的守卫条件或不可达的变迁时与 genetic_algorithm 未能全覆盖时一样返回 max_gens。
+    存在无法判定的守卫条件时，以已求解的取值为基础、其余变量随机取值构造初始种群，
+    回退到 genetic_algorithm 只搜索这部分变量。不可满足的守卫条件两种方式都无法覆盖，不触发回退。
+
+    参数:
+    - vars: list, path_var_exa 返回的变量信息列表
+    - graph: nx.DiGraph, convert_to_networkx(add_id=True) 构建的状态图
+    - pop_size, max_gens, cross_rate, mut_rate: 回退时遗传算法的参数
+    - ga_kwargs: 回退时传给 genetic_algorithm 的其他参数，如 select、mutation
+
+    返回值:
+    - tuple, 与 genetic_algorithm 相同：(测试用例字典, 进化次数)
+    """
+    solved, undecided = solve_guards(vars, graph)
+    individual = {**create_individual_random(vars), **solved}
+    if not undecided:
+        full = graph_cover(graph, individual)[1] == graph.number_of_edges()
+        return individual, (0 if full else max_gens)
+
+    population = [{**create_individual_random(vars), **solved} for _ in range(pop_size)]
+    return genetic_algorithm(vars, pop_size, max_gens, cross_rate, mut_rate, graph, population=population, **ga_kwargs)
+
+
+def run_gentic(selections, mutations, exp_file_path=EXP_FILE_PATH):
+    """
+    在所有状态图上运行各选择/变异组合的实验，结果追加写入 exp_file_path。
+
+    结果经 ResultWriter 按批写入，已记录在结果文件中的组合直接跳过，中断后重新运行即可续跑。
+    单个组合出错只跳过该组合并记录错误，无法解析的状态图的全部组合都记为失败，运行结束时打印写入、跳过和失败的组合数量。
+    """
+    rounds = ROUNDS
     
-    with open("../data/graph_data/graph_time_id.jsonl", "r") as graphs_file:
-        for graph_line in graphs_file:
-            try :
+    with open(GRAPH_FILE_PATH, "r") as graphs_file, ResultWriter(exp_file_path) as writer:
+        for line_number, graph_line in enumerate(graphs_file, 1):
+            graph_id = f"line:{line_number}"
+            try:
                 graph_line = graph_line.strip()
                 graph_json = json.loads(graph_line)
+                graph_id = graph_json["graph_id"]
                 
                 variables = path_var_exa(graph_json)
                 graph = convert_to_networkx(graph_json, add_id=True)
-                
-                with open("../data/genetic_exp_data/mutation_data.jsonl", "a") as exp_file:
-                    for selection in selections:
-                        try:
-                            for mutation in mutations:
-                                gen_avg = 0
-                                for _ in range(rounds):
-                                    _, gen_num = genetic_algorithm(
-                                        vars=variables,
-                                        pop_size=POP_SIZE,
-                                        max_gens=MAX_GENERATIONS,
-                                        cross_rate=CROSSOVER_RATE,
-                                        mut_rate=MUTATION_RATE,
-                                        graph=graph,
-                                        select=selection,
-                                        mutation=mutation
-                                    )
-                                    gen_avg += gen_num
-                                exp_data = {
-                                    "graph_id": graph_json["graph_id"],
-                                    "selection": selection,
-                                    "mutation": mutation,
-                                    "avg_gen": gen_avg/rounds
-                                }
-                                exp_file.write(json.dumps(exp_data, ensure_ascii=False) + "\n")
-                                print(exp_data)
-                        except:
-                            continue
-            except:
+                cache = FitnessCache()
+            except Exception as e:
+                print(f"error: 状态图解析失败 {e!r}")
+                writer.fail_graph(graph_id, selections, mutations, repr(e))
                 continue
-                    
+
+            for selection in selections:
+                for mutation in mutations:
+                    if writer.is_done(graph_id, selection, mutation):
+                        writer.skip(graph_id, selection, mutation)
+                        continue
+                    try:
+                        gen_avg = 0
+                        for _ in range(rounds):
+                            _, gen_num = genetic_algorithm(
+                                vars=variables,
+                                pop_size=POP_SIZE,
+                                max_gens=MAX_GENERATIONS,
+                                cross_rate=CROSSOVER_RATE,
+                                mut_rate=MUTATION_RATE,
+                                graph=graph,
+                                select=selection,
+                                mutation=mutation,
+                                cache=cache
+                            )
+                            gen_avg += gen_num
+                    except Exception as e:
+                        writer.fail(graph_id, selection, mutation, repr(e))
+                        continue
+                    exp_data = {
+                        "graph_id": graph_id,
+                        "selection": selection,
+                        "mutation": mutation,
+                        "avg_gen": gen_avg/rounds
+                    }
+                    writer.write(exp_data)
+                    print(exp_data)
+            print(f"graph:{graph_id} fitness cache:{cache.stats()}")
+
+    print(writer.summary())
+    return writer.summary()
+
 if __name__ == "__main__":
     
     selections = ["roulette_wheel", "tournament", "stochastic_universal_sampling", "elitism", "rank", "truncation"]
@@ -1,7 +1,11 @@
+import asyncio
+import json
 import random
+import numpy as np
 from get_prompt import variables_prompt
-from my_utils import get_response, clean_json, replace_bool
-from graph_run import guard_extra
+from my_utils import get_response, async_get_response, run_async, clean_json, replace_bool, model_name, CONCURRENCY
+from response_cache import default_response_cache
+from graph_run import graph_cover, guard_extra, guard_schema
 
 def mutate_bit_flip(individual, vars, mutation_rate):
     """基本位变异 - 随机翻转变量值"""
@@ -52,19 +56,152 @@ def mutate_swap(individual, vars, mutation_rate):
             individual[name1], individual[name2] = individual[name2], individual[name1]
     return individual
 
-def mutate_model(individual, mutation_rate, graph):
-    """变异操作"""
+def rank_candidates(answers, graph, k=1):
+    """
+    用 graph_cover 在本地为大模型给出的候选取值打分，返回覆盖变迁数最多的 k 个不同候选。
+
+    参数:
+    - answers: list, clean_json 解析后的候选取值，解析失败的 None 会被跳过。
+    - graph: networkx.DiGraph, 状态图。
+    - k: int, 返回的候选数。
+
+    返回值:
+    - list, 按覆盖变迁数从多到少排列的候选（已经过 replace_bool），覆盖数相同时保持模型给出的顺序；不同候选少于 k 个时全部返回。
+    """
+    candidates = {}
+    for answer in answers:
+        if answer is None:
+            continue
+        candidate = replace_bool(answer)
+        candidates.setdefault(json.dumps(candidate, sort_keys=True, default=str), candidate)
+    ranked = sorted(candidates.values(), key=lambda candidate: graph_cover(graph, candidate)[1], reverse=True)
+    return ranked[:k]
+
+def mutate_model(individual, mutation_rate, graph, cache=None, api_type="zhipu", n=1):
+    """
+    变异操作 - 由大模型根据守卫条件给出变量取值
+
+    提示词只取决于状态图，解析后的答案保存在 ResponseCache 中，同一状态图重复变异时从答案池中复用，
+    cache 为 None 时使用默认缓存，为 False 时每次都请求大模型。
+    请求附带 guard_schema 生成的 JSON Schema，api_type 为 "vllm" 等支持约束解码的本地服务时回答总能解析。
+    n 大于1时一次请求采样 n 个候选，全部写入答案池，取 graph_cover 覆盖最多的一个作为变异结果。
+    """
     mutated = individual.copy()
     if random.random() < mutation_rate:
         guards = guard_extra(graph)
         mutition_promt = variables_prompt(guards)
-        response = get_response(mutition_promt, api_type="zhipu")
-        res = clean_json(response)
+        model = model_name(api_type)
+
+        fallback, refresh = None, True
+        if cache is not False:
+            cache = cache or default_response_cache()
+            fallback, refresh = cache.sample(mutition_promt, model)
+
+        if refresh:
+            answers = get_response(mutition_promt, api_type=api_type, schema=guard_schema(graph), n=n)
+            answers = [clean_json(answer) for answer in (answers if n > 1 else [answers])]
+            if cache is not False:
+                for answer in answers:
+                    if answer is not None:
+                        cache.store(mutition_promt, model, answer)
+            ranked = rank_candidates(answers, graph)
+            res = ranked[0] if ranked else fallback
+        else:
+            res = fallback
         if res is None:
             return mutated
         mutated = replace_bool(res)
     return mutated
 
+def mutate_model_batch(individuals, mutation_rate, graph, cache=None, api_type="zhipu", concurrency=CONCURRENCY, n=1):
+    """
+    对一代的全部子代进行大模型变异，需要请求大模型的个体并发请求。
+
+    先按 mutation_rate 决定哪些个体变异，能从 ResponseCache 答案池中复用的直接替换，
+    其余个体所需的候选通过异步客户端请求，每次请求采样 n 个候选，共发出 ceil(个体数 / n) 次请求，
+    最多 concurrency 个同时进行。每个请求返回时立即处理：其候选用 rank_candidates 按 graph_cover 排序，
+    与之前已分配的候选不重复的依次分给尚未得到候选的个体。单个请求失败时只是没有候选，不影响其他请求；
+    全部请求结束后仍没有候选的个体退回答案池中最新的答案，答案池为空时重复使用已有候选。
+    一代的耗时约为一次请求的往返时间，n 个候选共用一次预填充与网络往返。
+
+    参数:
+    - individuals: list, 子代个体列表。
+    - mutation_rate: float, 每个个体发生变异的概率。
+    - graph: networkx.DiGraph, 状态图。
+    - cache: ResponseCache, 为 None 时使用默认缓存，为 False 时不使用缓存。
+    - api_type: str, API 类型。
+    - concurrency: int, 最大并发请求数。
+    - n: int, 每次请求采样的候选数。
+
+    返回值:
+    - list, 变异后的个体列表，与 individuals 一一对应。
+    """
+    mutated = [individual.copy() for individual in individuals]
+    chosen = [i for i in range(len(mutated)) if random.random() < mutation_rate]
+    if not chosen:
+        return mutated
+
+    mutition_promt = variables_prompt(guard_extra(graph))
+    schema = guard_schema(graph)
+    model = model_name(api_type)
+    if cache is not False:
+        cache = cache or default_response_cache()
+
+    pending = {}
+    for i in chosen:
+        if cache is False:
+            pending[i] = None
+            continue
+        answer, refresh = cache.sample(mutition_promt, model)
+        if refresh:
+            pending[i] = answer
+        else:
+            mutated[i] = replace_bool(answer)
+    if not pending:
+        return mutated
+
+    async def fetch(semaphore):
+        # 单次请求失败（不可重试的错误或重试耗尽）只让这次请求没有候选，不影响同一代的其他请求
+        try:
+            answers = await async_get_response(mutition_promt, api_type=api_type, semaphore=semaphore, schema=schema, n=n)
+        except Exception:
+            return []
+        return [clean_json(answer) for answer in (answers if n > 1 else [answers])]
+
+    waiting = list(pending)
+    received = []
+
+    async def fetch_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.ensure_future(fetch(semaphore)) for _ in range(-(-len(pending) // n))]
+        seen = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                answers = await next_done
+                if cache is not False:
+                    for res in answers:
+                        if res is not None:
+                            cache.store(mutition_promt, model, res)
+                for candidate in rank_candidates(answers, graph, len(answers)):
+                    key = json.dumps(candidate, sort_keys=True, default=str)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    received.append(candidate)
+                    if waiting:
+                        mutated[waiting.pop(0)] = dict(candidate)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    run_async(fetch_all())
+    for j, i in enumerate(waiting):
+        if pending[i] is not None:
+            mutated[i] = replace_bool(pending[i])
+        elif received:
+            mutated[i] = dict(received[j % len(received)])
+    return mutated
+
 def adaptive_directed_mutation(individual, vars, prev_fitness, prev_prev_fitness, 
                               prev_individual, prev_prev_individual, mutation_rate):
     """
@@ -155,3 +292,80 @@ def run_mutation(individual, vars, graph, mutation_type, mutation_rate=0.01):
     #     return adaptive_directed_mutation(individual, vars, prev_fitness, 
     #                                 prev_prev_fitness, prev_individual,
     #                                 prev_prev_individual, mutation_rate)
+
+def run_mutation_batch(individuals, vars, graph, mutation_type, mutation_rate=0.01, candidates=1):
+    """对一代的全部子代运行变异，model 变异并发请求大模型（每次请求采样 candidates 个候选），其余方法逐个调用 run_mutation"""
+    if mutation_type == "model":
+        return mutate_model_batch(individuals, mutation_rate, graph, n=candidates)
+    return [run_mutation(individual, vars, graph, mutation_type, mutation_rate) for individual in individuals]
+
+
+# 以下为数组版本的变异操作：种群为 (个体数, 变量数) 的float64矩阵，每列对应 vars 中的一个变量，
+# bool 变量存为0/1，int 变量存为整数值；types 为各列类型组成的数组，如 np.array(["bool", "int", "float"])。
+# 每个函数对整个种群一次完成变异，就地修改并返回矩阵。
+
+def mutate_bit_flip_array(population, types, rng, mutation_rate):
+    """基本位变异 - 布尔值取反，数值取反"""
+    mask = rng.random(population.shape) < mutation_rate
+    is_bool = types == "bool"
+    population[mask & is_bool] = 1.0 - population[mask & is_bool]
+    population[mask & ~is_bool] = -population[mask & ~is_bool]
+    return population
+
+def mutate_uniform_array(population, types, rng, mutation_rate):
+    """均匀变异 - 随机重置变量值"""
+    mask = rng.random(population.shape) < mutation_rate
+    values = np.where(
+        types == "bool",
+        rng.integers(0, 2, population.shape),
+        np.where(types == "int", rng.integers(-1000, 1001, population.shape), rng.uniform(-1000.0, 1000.0, population.shape)),
+    )
+    population[mask] = values[mask]
+    return population
+
+def mutate_gaussian_array(population, types, rng, mutation_rate, sigma=0.1):
+    """高斯变异 - 对数值变量添加高斯噪声"""
+    mask = rng.random(population.shape) < mutation_rate
+    noise = rng.normal(0.0, sigma, population.shape)
+    noise = np.where(types == "int", np.trunc(noise * 100), noise)
+    noise[:, types == "bool"] = 0.0
+    population[mask] += noise[mask]
+    return population
+
+def mutate_swap_array(population, types, rng, mutation_rate):
+    """交换变异 - 每个个体以 mutation_rate 的概率随机交换两个同类型变量的值"""
+    num_vars = population.shape[1]
+    if num_vars < 2:
+        return population
+    rows = np.flatnonzero(rng.random(population.shape[0]) < mutation_rate)
+    first = rng.integers(0, num_vars, rows.size)
+    second = (first + rng.integers(1, num_vars, rows.size)) % num_vars
+    same_type = types[first] == types[second]
+    rows, first, second = rows[same_type], first[same_type], second[same_type]
+    population[rows, first], population[rows, second] = population[rows, second], population[rows, first]
+    return population
+
+def run_mutation_array(population, vars, types, graph, mutation_type, rng, mutation_rate=0.01, candidates=1):
+    """
+    运行不同的数组版本变异方法。
+
+    model 变异需要调用大模型，按行转换为个体字典后调用 mutate_model_batch 并发请求（每次请求采样 candidates 个候选），再把结果写回矩阵。
+    """
+    if mutation_type == "bit_flip":
+        return mutate_bit_flip_array(population, types, rng, mutation_rate)
+    elif mutation_type == "uniform":
+        return mutate_uniform_array(population, types, rng, mutation_rate)
+    elif mutation_type == "gaussian":
+        return mutate_gaussian_array(population, types, rng, mutation_rate)
+    elif mutation_type == "swap":
+        return mutate_swap_array(population, types, rng, mutation_rate)
+    elif mutation_type == "model":
+        names = [var["name"] for var in vars]
+        individuals = [dict(zip(names, row)) for row in population.tolist()]
+        for row, mutated in zip(population, mutate_model_batch(individuals, mutation_rate, graph, n=candidates)):
+            for j, name in enumerate(names):
+                value = mutated.get(name)
+                if isinstance(value, (bool, int, float)):
+                    row[j] = float(value)
+        return population
+    raise ValueError(f"Unknown mutation: {mutation_type}")
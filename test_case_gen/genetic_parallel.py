@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import random
+from multiprocessing import Pool
+from path_var_exa import path_var_exa
+from graph_run import convert_to_networkx
+from fitness_cache import FitnessCache, FitnessCacheManager
+from result_writer import ResultWriter
+from genetic import (
+    genetic_algorithm,
+    POP_SIZE,
+    MAX_GENERATIONS,
+    CROSSOVER_RATE,
+    MUTATION_RATE,
+    ROUNDS,
+    GRAPH_FILE_PATH,
+    EXP_FILE_PATH,
+)
+
+"""
+遗传算法实验并行运行
+状态图 × 选择方法 × 变异方法 × 轮次 的每个任务相互独立，分发到进程池中运行
+"""
+
+
+def task_seed(graph_id, selection, mutation, round_):
+    """
+    由 (graph_id, selection, mutation, round) 派生任务的随机种子。
+
+    使用 sha256 而不是内置 hash，保证不同进程、不同运行之间种子一致，
+    任务的随机数序列与其由哪个工作进程、以什么顺序执行无关。
+    种子只决定本地的随机数，mutation="model" 的任务还依赖响应缓存和大模型的输出，不能逐字节复现。
+    """
+    key = f"{graph_id}|{selection}|{mutation}|{round_}".encode("utf-8")
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
+
+
+# 工作进程内的状态：graph_id -> (graph, variables, cache)
+_worker_graphs = {}
+_worker_manager = None
+
+
+def _init_worker(cache_address):
+    """进程池初始化：连接共享适应度缓存的管理器"""
+    global _worker_manager
+    _worker_graphs.clear()
+    _worker_manager = None
+    if cache_address is not None:
+        _worker_manager = FitnessCacheManager(address=cache_address)
+        _worker_manager.connect()
+
+
+def _load_graph(graph_json):
+    """按 graph_id 在工作进程内缓存构建好的状态图、变量和适应度缓存"""
+    graph_id = graph_json["graph_id"]
+    if graph_id not in _worker_graphs:
+        variables = path_var_exa(graph_json)
+        graph = convert_to_networkx(graph_json, add_id=True)
+        if _worker_manager is not None:
+            cache = _worker_manager.graph_cache(graph_id)
+        else:
+            cache = FitnessCache()
+        _worker_graphs[graph_id] = (graph, variables, cache)
+    return _worker_graphs[graph_id]
+
+
+def run_task(task):
+    """
+    运行单个任务（一轮遗传算法）。
+
+    参数:
+    - task: tuple, (graph_json, selection, mutation, round_)
+
+    返回值:
+    - tuple, (graph_id, selection, mutation, round_, gen_num, error)，出错时 gen_num 为 None，error 为错误信息
+    """
+    graph_json, selection, mutation, round_ = task
+    graph_id = graph_json["graph_id"]
+    try:
+        graph, variables, cache = _load_graph(graph_json)
+        random.seed(task_seed(graph_id, selection, mutation, round_))
+        _, gen_num = genetic_algorithm(
+            vars=variables,
+            pop_size=POP_SIZE,
+            max_gens=MAX_GENERATIONS,
+            cross_rate=CROSSOVER_RATE,
+            mut_rate=MUTATION_RATE,
+            graph=graph,
+            select=selection,
+            mutation=mutation,
+            cache=cache,
+        )
+        return graph_id, selection, mutation, round_, gen_num, None
+    except Exception as e:
+        return graph_id, selection, mutation, round_, None, repr(e)
+
+
+def load_graph_jsons(graph_file_path=GRAPH_FILE_PATH, errors=None):
+    """
+    读取状态图数据，跳过无法解析或变量提取失败的状态图。
+
+    参数:
+    - graph_file_path: str, 状态图数据文件。
+    - errors: list, 不为 None 时追加被跳过的状态图的 (graph_id, 错误信息)，无法读取 graph_id 时以 "line:行号" 代替。
+    """
+    graph_jsons = []
+    with open(graph_file_path, "r") as graphs_file:
+        for line_number, graph_line in enumerate(graphs_file, 1):
+            graph_id = f"line:{line_number}"
+            try:
+                graph_json = json.loads(graph_line.strip())
+                graph_id = graph_json["graph_id"]
+                path_var_exa(graph_json)
+            except Exception as e:
+                if errors is not None:
+                    errors.append((graph_id, repr(e)))
+                continue
+            graph_jsons.append(graph_json)
+    return graph_jsons
+
+
+def iter_tasks(graph_jsons, selections, mutations, rounds=ROUNDS):
+    for graph_json in graph_jsons:
+        for selection in selections:
+            for mutation in mutations:
+                for round_ in range(rounds):
+                    yield graph_json, selection, mutation, round_
+
+
+def run_gentic_parallel(selections, mutations, workers=None, rounds=ROUNDS, shared_cache=False,
+                        graph_file_path=GRAPH_FILE_PATH, exp_file_path=EXP_FILE_PATH):
+    """
+    run_gentic 的并行版本。
+
+    每个 (状态图, 选择方法, 变异方法, 轮次) 作为一个任务分发到进程池，任务开始前用 task_seed 重置随机数种子，
+    因此 avg_gen 与工作进程数量和完成顺序无关，workers=1 与 workers=N 的结果逐字节一致。
+    该保证不包括 mutation="model"：大模型变异的结果取决于共享的响应缓存（ResponseCache）中已有的答案和大模型的输出，
+    两者都不受任务种子控制，重复运行的结果可能不同。
+    同一组合的全部轮次完成后把结果交给 ResultWriter 按批追加写入 exp_file_path；任一轮出错则该组合不写入并记为失败。
+    结果文件中已有的组合不再生成任务，中断后重新运行即可续跑。
+    shared_cache 为True时所有工作进程通过 FitnessCacheManager 共享每个状态图的适应度缓存，
+    否则每个工作进程各自缓存。每代查询共享缓存需要一次进程间通信，
+    在小状态图上比直接计算覆盖还慢，适合守卫条件多、适应度计算耗时的大状态图。
+
+    参数:
+    - selections: list, 选择方法列表
+    - mutations: list, 变异方法列表
+    - workers: int, 进程数，默认为CPU核数；为1时在当前进程中顺序运行
+    - rounds: int, 每个组合运行的轮数
+    - shared_cache: bool, 是否在工作进程间共享适应度缓存
+    - graph_file_path: str, 状态图数据文件
+    - exp_file_path: str, 实验结果文件
+
+    返回值:
+    - dict, {(graph_id, selection, mutation): avg_gen}，只包含本次运行写入的组合
+    """
+    workers = workers or os.cpu_count()
+    graph_errors = []
+    graph_jsons = load_graph_jsons(graph_file_path, graph_errors)
+
+    gen_sums = {}
+    finished = {}
+    failed = {}
+    results = {}
+
+    with ResultWriter(exp_file_path) as writer:
+        for graph_id, error in graph_errors:
+            print(f"error: 状态图解析失败 {graph_id} {error}")
+            writer.fail_graph(graph_id, selections, mutations, error)
+
+        def pending_tasks():
+            for task in iter_tasks(graph_jsons, selections, mutations, rounds):
+                graph_json, selection, mutation, round_ = task
+                if writer.is_done(graph_json["graph_id"], selection, mutation):
+                    if round_ == 0:
+                        writer.skip(graph_json["graph_id"], selection, mutation)
+                    continue
+                yield task
+
+        def collect(result):
+            graph_id, selection, mutation, _, gen_num, error = result
+            combo = (graph_id, selection, mutation)
+            if error is not None:
+                failed.setdefault(combo, error)
+            else:
+                gen_sums[combo] = gen_sums.get(combo, 0) + gen_num
+            finished[combo] = finished.get(combo, 0) + 1
+            if finished[combo] < rounds:
+                return
+            if combo in failed:
+                writer.fail(graph_id, selection, mutation, failed[combo])
+                print(f"error:{combo} {failed[combo]}")
+                return
+            exp_data = {
+                "graph_id": graph_id,
+                "selection": selection,
+                "mutation": mutation,
+                "avg_gen": gen_sums[combo] / rounds,
+            }
+            results[combo] = exp_data["avg_gen"]
+            writer.write(exp_data)
+            print(exp_data)
+
+        tasks = pending_tasks()
+
+        if workers == 1:
+            _init_worker(None)
+            for task in tasks:
+                collect(run_task(task))
+        elif shared_cache:
+            with FitnessCacheManager() as manager:
+                with Pool(workers, initializer=_init_worker, initargs=(manager.address,)) as pool:
+                    for result in pool.imap_unordered(run_task, tasks, chunksize=rounds):
+                        collect(result)
+        else:
+            with Pool(workers, initializer=_init_worker, initargs=(None,)) as pool:
+                for result in pool.imap_unordered(run_task, tasks, chunksize=rounds):
+                    collect(result)
+
+    print(writer.summary())
+    return results
+
+
+if __name__ == "__main__":
+
+    selections = ["roulette_wheel", "tournament", "stochastic_universal_sampling", "elitism", "rank", "truncation"]
+    mutations = ["bit_flip", "uniform", "gaussian", "swap", "model"]
+
+    run_gentic_parallel(selections, mutations)
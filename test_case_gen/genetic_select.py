@@ -1,27 +1,49 @@
 import random
+from itertools import accumulate
+
+"""
+遗传算法选择操作
+*_indices 函数只处理适应度列表，返回被选中个体的下标，复杂度不超过 O(n log n)；
+同名的不带 _indices 的函数返回被选中的个体，供按个体列表调用
+"""
+
+def roulette_wheel_indices(fitnesses):
+    """轮盘赌选择：在适应度前缀和上二分查找，每次选择 O(log n)"""
+    cum_fitness = list(accumulate(fitnesses))
+    return random.choices(range(len(fitnesses)), cum_weights=cum_fitness, k=len(fitnesses))
 
 def roulette_wheel_selection(population, fitnesses):
     """轮盘赌选择"""
-    total_fitness = sum(fitnesses)
-    probs = [f/total_fitness for f in fitnesses]
+    return [population[i] for i in roulette_wheel_indices(fitnesses)]
+
+def tournament_indices(fitnesses, tournament_size=2):
+    """锦标赛选择：每次随机抽取 tournament_size 个下标，取适应度最高者"""
+    n = len(fitnesses)
     selected = []
-    for _ in range(len(population)):
-        r = random.random()
-        cumulative_prob = 0
-        for i, prob in enumerate(probs):
-            cumulative_prob += prob
-            if r <= cumulative_prob:
-                selected.append(population[i])
-                break
+    for _ in range(n):
+        candidates = random.choices(range(n), k=tournament_size)
+        selected.append(max(candidates, key=fitnesses.__getitem__))
     return selected
 
 def tournament_selection(population, fitnesses, tournament_size=2):
     """锦标赛选择"""
+    return [population[i] for i in tournament_indices(fitnesses, tournament_size)]
+
+def stochastic_universal_sampling_indices(fitnesses):
+    """
+    随机通用抽样(SUS)：指针按升序排列，与适应度前缀和一起单次扫描，O(n)。
+    """
+    n = len(fitnesses)
+    cum_fitness = list(accumulate(fitnesses))
+    point_distance = cum_fitness[-1] / n
+    start_point = random.uniform(0, point_distance)
     selected = []
-    for _ in range(len(population)):
-        candidates = random.choices(list(zip(population, fitnesses)), k=tournament_size)
-        best = max(candidates, key=lambda x: x[1])[0]
-        selected.append(best)
+    i = 0
+    for k in range(n):
+        pointer = start_point + k * point_distance
+        while i < n - 1 and cum_fitness[i] < pointer:
+            i += 1
+        selected.append(i)
     return selected
 
 def stochastic_universal_sampling(population, fitnesses):
@@ -42,21 +64,13 @@ def stochastic_universal_sampling(population, fitnesses):
         4. 遍历每个指针，累积适应度值直到超过指针位置
         5. 选择当前对应的个体
     """
-    total_fitness = sum(fitnesses)
-    point_distance = total_fitness / len(population)
-    start_point = random.uniform(0, point_distance)
-    pointers = [start_point + i*point_distance for i in range(len(population))]
-    
-    cumulative_fitness = 0
-    selected = []
-    for p in pointers:
-        i = 0
-        cumulative_fitness += fitnesses[i]
-        while cumulative_fitness < p:
-            i += 1
-            cumulative_fitness += fitnesses[i]
-        selected.append(population[i])
-    return selected
+    return [population[i] for i in stochastic_universal_sampling_indices(fitnesses)]
+
+def elitism_indices(fitnesses, elite_size=1):
+    """精英选择：按适应度降序的前 elite_size 个下标，加上随机抽取的下标"""
+    n = len(fitnesses)
+    order = sorted(range(n), key=fitnesses.__getitem__, reverse=True)
+    return order[:elite_size] + random.choices(range(n), k=n - elite_size)
 
 def elitism_selection(population, fitnesses, elite_size=1):
     """
@@ -76,10 +90,13 @@ def elitism_selection(population, fitnesses, elite_size=1):
         3. 从整个种群中随机选择剩余个体
         4. 组合精英个体和随机个体形成新种群
     """
-    combined = list(zip(population, fitnesses))
-    combined.sort(key=lambda x: x[1], reverse=True)
-    elites = [ind for ind, fit in combined[:elite_size]]
-    return elites + random.choices(population, k=len(population)-elite_size)
+    return [population[i] for i in elitism_indices(fitnesses, elite_size)]
+
+def rank_indices(fitnesses):
+    """排序选择：按适应度升序排列后，以排名为权重在前缀和上二分抽样"""
+    n = len(fitnesses)
+    order = sorted(range(n), key=fitnesses.__getitem__)
+    return random.choices(order, cum_weights=list(accumulate(range(1, n + 1))), k=n)
 
 
 def rank_selection(population, fitnesses):
@@ -100,12 +117,14 @@ def rank_selection(population, fitnesses):
         4. 根据排名概率进行加权随机选择
         
     """
-    ranked = sorted(zip(population, fitnesses), key=lambda x: x[1])
-    ranks = [i+1 for i in range(len(ranked))]  # 1为最差，N为最好
-    total_rank = sum(ranks)
-    probs = [r/total_rank for r in ranks]
-    selected = random.choices([ind for ind, fit in ranked], weights=probs, k=len(population))
-    return selected
+    return [population[i] for i in rank_indices(fitnesses)]
+
+def truncation_indices(fitnesses, threshold=0.3):
+    """截断选择：从适应度最高的前 threshold 比例下标中有放回地抽样"""
+    n = len(fitnesses)
+    order = sorted(range(n), key=fitnesses.__getitem__, reverse=True)
+    cutoff = max(1, int(n * threshold))
+    return random.choices(order[:cutoff], k=n)
 
 
 def truncation_selection(population, fitnesses, threshold=0.3):
@@ -125,27 +144,25 @@ def truncation_selection(population, fitnesses, threshold=0.3):
         2. 计算截断点，保留前threshold比例的个体
         3. 从保留的个体中有放回地随机抽样，直到填满原始种群大小
     """
-    combined = list(zip(population, fitnesses))
-    combined.sort(key=lambda x: x[1], reverse=True)
-    
-    # 确保至少选择1个个体
-    cutoff = max(1, int(len(population) * threshold))
-    
-    # random.choices函数能够实现有放回的随机抽样，也就是在抽样时，同一个个体可以被多次选中
-    selected = random.choices([ind for ind, fit in combined[:cutoff]], k=len(population))
-    return selected
+    # 确保至少选择1个个体，random.choices 有放回抽样，同一个体可以被多次选中
+    return [population[i] for i in truncation_indices(fitnesses, threshold)]
 
-def run_selection(population, fitnesses, select):
+def run_selection_indices(fitnesses, select):
+    """运行不同的选择方法，返回被选中个体在种群中的下标"""
     if select == "roulette_wheel":
-        selected = roulette_wheel_selection(population, fitnesses)
+        return roulette_wheel_indices(fitnesses)
     elif select == "tournament":
-        selected = tournament_selection(population, fitnesses)
+        return tournament_indices(fitnesses)
     elif select == "stochastic_universal_sampling":
-        selected = stochastic_universal_sampling(population, fitnesses)
+        return stochastic_universal_sampling_indices(fitnesses)
     elif select == "elitism":
-        selected = elitism_selection(population, fitnesses)
+        return elitism_indices(fitnesses)
     elif select == "rank":
-        selected = rank_selection(population, fitnesses)
+        return rank_indices(fitnesses)
     elif select == "truncation":
-        selected = truncation_selection(population, fitnesses)
-    return selected
\ No newline at end of file
+        return truncation_indices(fitnesses)
+    raise ValueError(f"Unknown selection: {select}")
+
+def run_selection(population, fitnesses, select):
+    """运行不同的选择方法，返回被选中的个体"""
+    return [population[i] for i in run_selection_indices(fitnesses, select)]
\ No newline at end of file
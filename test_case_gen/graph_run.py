@@ -1,5 +1,9 @@
 import networkx as nx
+import numpy as np
 import re
+import ast
+from collections import deque
+from functools import reduce
 
 """
 状态图运行
@@ -25,7 +29,7 @@ def change_guard(guard, transition_id):
     "engine_start_T1 == true"
     """
     
-    matches = re.findall(r"(\w+)\s*(==|>=|<=|>|<)\s*([\w.]+)", guard)
+    matches = re.findall(r"(\w+)\s*(==|>=|<=|>|<)\s*(-?[\w.]+)", guard)
     alias_dict = {}
     for var, _, _ in matches:
         alias = var + "_" + transition_id
@@ -34,6 +38,192 @@ def change_guard(guard, transition_id):
         guard = guard.replace(var, alias)
     return guard
 
+def translate_guard(guard):
+    """
+    将守卫条件从状态图的书写形式转换为Python表达式。
+
+    true/false 转为 True/False，&&/|| 转为 and/or，! 转为 not。
+    只替换完整的单词，变量名中包含 true/false 的部分（如 is_true_T1）保持不变。
+
+    参数:
+    - guard: str, 状态变迁的守卫条件。
+
+    返回值:
+    - str, 可被Python解析的表达式。
+
+    示例:
+    >>> translate_guard("voltage_stable == true && frequency_error < 0.5")
+    "voltage_stable == True and frequency_error < 0.5"
+    """
+    guard = re.sub(r"\btrue\b", "True", guard)
+    guard = re.sub(r"\bfalse\b", "False", guard)
+    guard = guard.replace("&&", " and ").replace("||", " or ")
+    guard = re.sub(r"!(?!=)", " not ", guard)
+    return " ".join(guard.split())
+
+
+def compile_guard(guard):
+    """
+    将守卫条件编译为可直接调用的判定函数。
+
+    守卫条件只在构图时转换和编译一次，返回的函数直接以个体字典作为命名空间求值，
+    不再做字符串替换，也不复制变量字典。求值出错（变量缺失、类型不匹配等）时返回False，
+    与 evaluate_guard 的行为一致；无法编译的守卫条件恒为False。
+
+    参数:
+    - guard: str, 状态变迁的守卫条件。
+
+    返回值:
+    - function, 接受变量字典并返回bool的判定函数。
+
+    示例:
+    >>> predicate = compile_guard("voltage_value > 250 || voltage_value < 80")
+    >>> predicate({"voltage_value": 300})
+    True
+    """
+    try:
+        code = compile(translate_guard(guard), "<guard>", "eval")
+    except SyntaxError:
+        return lambda vars: False
+    namespace = {"__builtins__": None}
+
+    def predicate(vars):
+        try:
+            return bool(eval(code, namespace, vars))
+        except Exception:
+            return False
+
+    return predicate
+
+
+class _VectorizeGuard(ast.NodeTransformer):
+    """将 and/or/not 与链式比较改写为逐元素的逻辑运算函数调用"""
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = "_and" if isinstance(node.op, ast.And) else "_or"
+        return ast.Call(func=ast.Name(id=func, ctx=ast.Load()), args=node.values, keywords=[])
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.Call(func=ast.Name(id="_not", ctx=ast.Load()), args=[node.operand], keywords=[])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        lefts = [node.left] + node.comparators[:-1]
+        parts = [self._compare(left, op, right) for left, op, right in zip(lefts, node.ops, node.comparators)]
+        if len(parts) == 1:
+            return parts[0]
+        return ast.Call(func=ast.Name(id="_and", ctx=ast.Load()), args=parts, keywords=[])
+
+    @staticmethod
+    def _compare(left, op, right):
+        # ==/!= 对无效取值不出错，改写为 _eq/_ne，其余比较保持掩码即出错
+        if isinstance(op, (ast.Eq, ast.NotEq)):
+            func = "_eq" if isinstance(op, ast.Eq) else "_ne"
+            return ast.Call(func=ast.Name(id=func, ctx=ast.Load()), args=[left, right], keywords=[])
+        return ast.Compare(left=left, ops=[op], comparators=[right])
+
+
+def _value_error(x):
+    """把比较结果拆成 (取值, 出错)，掩码位置（变量缺失或类型不符）视为求值出错"""
+    return np.ma.filled(x, False).astype(bool, copy=False), np.ma.getmaskarray(x)
+
+
+def _and2(x, y):
+    # 与 Python 的短路求值一致：x 为False时不再求值 y，y 出错不影响结果
+    xv, xe = _value_error(x)
+    yv, ye = _value_error(y)
+    return np.ma.masked_array(xv & yv, mask=xe | (xv & ye))
+
+
+def _or2(x, y):
+    # x 为True时不再求值 y；x 出错时整个守卫条件出错
+    xv, xe = _value_error(x)
+    yv, ye = _value_error(y)
+    return np.ma.masked_array(xv | yv, mask=xe | (~xv & ye))
+
+
+def _not(x):
+    xv, xe = _value_error(x)
+    return np.ma.masked_array(~xv, mask=xe)
+
+
+def _missing(x):
+    """掩码位置中变量缺失的部分：缺失的位置数据为 NaN，取值无效（None、字符串等）的位置数据为0"""
+    if not np.ma.isMaskedArray(x) or not np.issubdtype(x.dtype, np.floating):
+        return np.False_
+    return np.ma.getmaskarray(x) & np.isnan(x.data)
+
+
+def _equality(result, x, y, invalid):
+    # 与 Python 一致：None、字符串等无效取值与数值比较相等性不出错，只有变量缺失（NameError）才出错
+    return np.ma.masked_array(np.ma.filled(result, invalid), mask=_missing(x) | _missing(y))
+
+
+_VECTOR_NAMESPACE = {
+    "__builtins__": None,
+    "_and": lambda *xs: reduce(_and2, xs),
+    "_or": lambda *xs: reduce(_or2, xs),
+    "_not": _not,
+    "_eq": lambda x, y: _equality(x == y, x, y, False),
+    "_ne": lambda x, y: _equality(x != y, x, y, True),
+}
+
+
+def missing_column(size):
+    """长度为 size 的全掩码列，表示所有个体都缺少该变量"""
+    return np.ma.masked_array(np.full(size, np.nan), mask=np.ones(size, dtype=bool))
+
+
+def vectorize_guard(guard):
+    """
+    将守卫条件编译为对整个种群逐元素求值的判定函数。
+
+    守卫条件经 translate_guard 转换后解析为语法树，and/or/not 改写为 NumPy 的逐元素逻辑运算，
+    链式比较拆分为多个比较的与。返回的函数以列存储的种群（变量名 -> NumPy 数组）为命名空间，
+    一次比较得到所有个体的判定结果。缺失或无效的变量值用掩码数组（np.ma）表示：
+    == 与 != 对无效取值（None、字符串等）分别得到False和True，其余比较以及变量缺失视为求值出错，
+    守卫条件中出现而 columns 中没有的变量按全部缺失处理。与/或按 Python 的短路规则组合，
+    只有实际会被求值的比较出错时个体才判定为False，与 compile_guard 逐个体求值、出错时返回False的行为一致
+    （如 a > 5 || b < 3 在 a=6 时 b 缺失也为True）。
+
+    参数:
+    - guard: str, 状态变迁的守卫条件。
+
+    返回值:
+    - function, 接受 (columns, size) 并返回长度为 size 的bool数组的判定函数。
+
+    示例:
+    >>> predicate = vectorize_guard("voltage_value > 250 || voltage_value < 80")
+    >>> predicate({"voltage_value": np.array([300.0, 100.0])}, 2)
+    array([ True, False])
+    """
+    try:
+        tree = ast.parse(translate_guard(guard), mode="eval")
+        tree = ast.fix_missing_locations(_VectorizeGuard().visit(tree))
+        code = compile(tree, "<guard>", "eval")
+    except SyntaxError:
+        return lambda columns, size: np.zeros(size, dtype=bool)
+    names = [name for name in code.co_names if name not in _VECTOR_NAMESPACE]
+
+    def predicate(columns, size):
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            columns = dict(columns, **{name: missing_column(size) for name in unknown})
+        try:
+            result = eval(code, _VECTOR_NAMESPACE, columns)
+        except Exception:
+            return np.zeros(size, dtype=bool)
+        if np.ndim(result) == 0:
+            return np.full(size, bool(result))
+        return np.ma.filled(result, False).astype(bool, copy=False)
+
+    return predicate
+
+
 def convert_to_networkx(data, add_id=False):
     """
     将给定的状态图数据转换为NetworkX有向图（DiGraph）对象。
@@ -47,7 +237,9 @@ def convert_to_networkx(data, add_id=False):
         - "transitions": list, 状态变迁列表，每个变迁是一个包含"from", "to", "id", "guard", "description", "guard_type", "timing"等键的字典。
     - add_id: bool, 如果为True，则将状态变迁的id添加到节点的属性中。默认为False。
     返回值:
-    - graph: nx.DiGraph, 表示状态图的NetworkX有向图对象。图中的节点和边包含从原始数据中提取的附加信息。
+    - graph: nx.DiGraph, 表示状态图的NetworkX有向图对象。图中的节点和边包含从原始数据中提取的附加信息，
+      每条边的 predicate 属性为 compile_guard 编译后的守卫判定函数，
+      batch_predicate 属性为 vectorize_guard 编译后的整个种群的判定函数。
 
     """
 
@@ -78,6 +270,8 @@ def convert_to_networkx(data, add_id=False):
             to_node,
             id=transition["id"],
             guard=guard,
+            predicate=compile_guard(guard),
+            batch_predicate=vectorize_guard(guard),
             description=transition["description"],
             guard_type=transition["guard_type"],
             timing=transition["timing"],
@@ -177,34 +371,51 @@ def evaluate_guard(guard, vars):
 #     print(max_path)
 #     return max_path[0], len(max_path[0])
 
-def dfs(graph, vars, current_state, visited_edges, covered_edges):
+def graph_frontier(graph, vars):
     """
-    使用深度优先搜索(DFS)遍历状态图，统计能够满足守卫条件的变迁数量。
+    从初始状态出发做广度优先搜索，返回被覆盖的变迁和覆盖边界上的变迁。
+
+    覆盖边界上的变迁指起点可达、但守卫条件不满足的变迁，是继续提高覆盖需要满足的下一批守卫条件。
 
     参数:
     - graph: nx.DiGraph, 表示状态图的NetworkX有向图对象
     - vars: dict, 包含变量及其值的字典，用于评估守卫条件
-    - current_state: str, 当前状态的ID
-    - visited_edges: set, 已访问的状态变迁ID集合
-    - covered_edges: set, 已覆盖的状态变迁ID集合(会被修改)
 
     返回值:
-    - 无返回值。函数通过修改covered_edges集合来记录覆盖的变迁
+    - tuple:
+      - 第一个元素为集合，表示被覆盖的变迁ID集合
+      - 第二个元素为列表，表示覆盖边界上变迁的属性字典
     """
-    for _, next_state, edge_data in graph.edges(current_state, data=True):
-        guard = edge_data["guard"]
-        edge_id = edge_data["id"]
+    covered_edges = set()
+    frontier = []
+    if graph.number_of_nodes() == 0:
+        return covered_edges, frontier
+    initial_state = next(iter(graph))
+    succ = graph.succ
+    visited_states = {initial_state}
+    queue = deque([initial_state])
+    while queue:
+        current_state = queue.popleft()
+        for next_state, edge_data in succ[current_state].items():
+            if edge_data["predicate"](vars):
+                covered_edges.add(edge_data["id"])
+                if next_state not in visited_states:
+                    visited_states.add(next_state)
+                    queue.append(next_state)
+            else:
+                frontier.append(edge_data)
+    return covered_edges, frontier
 
-        if edge_id not in visited_edges and evaluate_guard(guard, vars):
-            covered_edges.add(edge_id)
-            new_visited = visited_edges.copy()
-            new_visited.add(edge_id)
-            dfs(graph, vars, next_state, new_visited, covered_edges)
 
 def graph_cover(graph, vars):
     """
     计算状态图中从初始状态出发能够满足守卫条件的变迁覆盖数量。
 
+    变迁的变量按 change_guard 以变迁ID做了别名，守卫条件是否满足与到达该变迁的路径无关，
+    因此被覆盖的变迁就是：守卫条件满足，且起点可以经由满足守卫条件的变迁从初始状态到达。
+    这里用一次广度优先搜索（graph_frontier）求出可达状态，每条变迁的守卫条件至多判定一次，
+    复杂度为O(V+E)，结果与逐条枚举变迁路径的深度优先搜索相同。
+
     参数:
     - graph: nx.DiGraph, 表示状态图的NetworkX有向图对象
     - vars: dict, 包含变量及其值的字典，用于评估守卫条件
@@ -214,11 +425,89 @@ def graph_cover(graph, vars):
       - 第一个元素为集合，表示被覆盖的变迁ID集合
       - 第二个元素为整数，表示被覆盖的变迁数量
     """
-    covered_edges = set()
-    initial_state = list(graph.nodes())[0]
-    dfs(graph, vars, initial_state, set(), covered_edges)
+    covered_edges, _ = graph_frontier(graph, vars)
     return covered_edges, len(covered_edges)
 
+
+def _edge_order(graph):
+    """
+    按从初始状态出发的广度优先顺序列出可达的变迁。
+
+    返回值:
+    - list of tuple, (变迁在 graph.edges() 中的序号, 起点序号, 终点序号)，状态序号为其在 graph.nodes() 中的位置。
+    """
+    if graph.number_of_nodes() == 0:
+        return []
+    node_index = {node: i for i, node in enumerate(graph)}
+    edge_index = {edge: k for k, edge in enumerate(graph.edges())}
+    initial_state = next(iter(graph))
+    visited_states = {initial_state}
+    queue = deque([initial_state])
+    order = []
+    while queue:
+        current_state = queue.popleft()
+        for next_state in graph.succ[current_state]:
+            order.append((edge_index[(current_state, next_state)], node_index[current_state], node_index[next_state]))
+            if next_state not in visited_states:
+                visited_states.add(next_state)
+                queue.append(next_state)
+    return order
+
+
+def batch_guard_matrix(graph, columns, size):
+    """
+    对整个种群评估状态图中所有变迁的守卫条件。
+
+    参数:
+    - graph: nx.DiGraph, convert_to_networkx 构建的状态图
+    - columns: dict, 列存储的种群，键为变量名，值为长度为 size 的NumPy数组（缺失值用 np.ma 掩码）
+    - size: int, 个体数量
+
+    返回值:
+    - np.ndarray, 形状为 (size, 变迁数) 的bool矩阵，第 j 列对应 graph.edges() 中的第 j 条变迁
+    """
+    satisfied = np.empty((graph.number_of_edges(), size), dtype=bool)
+    for k, (_, _, batch_predicate) in enumerate(graph.edges(data="batch_predicate")):
+        satisfied[k] = batch_predicate(columns, size)
+    return satisfied.T
+
+
+def batch_graph_cover(graph, columns, size):
+    """
+    graph_cover 的种群批量版本，对所有个体同时计算变迁覆盖。
+
+    先用 batch_guard_matrix 一次得到所有个体对所有变迁的判定结果，
+    再按广度优先顺序对变迁逐条做向量化的可达性传播，直到可达状态不再变化。
+    每个个体的覆盖结果与 graph_cover 相同。
+
+    参数:
+    - graph: nx.DiGraph, convert_to_networkx 构建的状态图
+    - columns: dict, 列存储的种群，键为变量名，值为长度为 size 的NumPy数组
+    - size: int, 个体数量
+
+    返回值:
+    - tuple:
+      - 第一个元素为形状 (size, 变迁数) 的bool矩阵，表示每个个体覆盖的变迁，列顺序同 graph.edges()
+      - 第二个元素为长度为 size 的整数数组，表示每个个体覆盖的变迁数量
+    """
+    satisfied = np.ascontiguousarray(batch_guard_matrix(graph, columns, size).T)
+    covered = np.zeros_like(satisfied)
+    reached = np.zeros((graph.number_of_nodes(), size), dtype=bool)
+    if graph.number_of_nodes():
+        reached[0] = True
+    order = _edge_order(graph)
+
+    changed = True
+    while changed:
+        changed = False
+        for k, src, dst in order:
+            np.logical_and(satisfied[k], reached[src], out=covered[k])
+            if not changed and (covered[k] & ~reached[dst]).any():
+                changed = True
+            reached[dst] |= covered[k]
+    return covered.T, covered.sum(axis=0)
+
+
 def guard_extra(graph):
     """
     提取状态图中所有的守卫条件，并将其组合成一个字符串。
@@ -239,6 +528,31 @@ def guard_extra(graph):
     return "\n".join(guards)
 
 
+# 守卫条件变量类型到 JSON Schema 类型的映射
+SCHEMA_TYPES = {"bool": "boolean", "int": "integer", "float": "number"}
+
+
+def guard_schema(graph):
+    """
+    由状态图的守卫条件变量生成 variables_prompt 回答的 JSON Schema。
+
+    属性名与 guard_extra 中的变量别名一致（变量名_迁移ID），类型按 SCHEMA_TYPES 映射，全部为必需属性。
+    本地模型以该 Schema 约束解码时，回答只能是包含全部变量、类型正确的 JSON 对象。
+
+    参数:
+    - graph: networkx.DiGraph, 状态图。
+
+    返回值:
+    - dict, JSON Schema。
+    """
+    properties = {}
+    for _, _, edge_data in graph.edges(data=True):
+        transition_id = edge_data["id"]
+        for k, v in (edge_data["guard_type"] or {}).items():
+            properties[f"{k}_{transition_id}"] = {"type": SCHEMA_TYPES.get(v, "number")}
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+
 
 if __name__ == "__main__":
 
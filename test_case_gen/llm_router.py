@@ -0,0 +1,226 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from my_utils import API_CONFIGS, call_backend
+
+"""
+多服务大模型路由
+把 API_CONFIGS 中已配置的服务（火山、智谱、本地 vLLM、本地 qwen_api）视为可以互相替代的后端，
+按最近的耗时与错误率把每个请求发给当前最快且健康的服务，失败时换下一个服务；
+可选对冲请求：首选服务超过其 p95 耗时仍未返回时向次选服务再发一次，取先返回的结果，削减长尾延迟
+"""
+
+# 每个服务统计最近多少次请求
+WINDOW = 50
+# 样本少于该数量时不按错误率判定健康状况，也不按分位数计算对冲等待时间
+MIN_SAMPLES = 5
+# 错误率超过该值的服务视为不健康，冷却 COOLDOWN 秒后再放行一次请求探测
+MAX_ERROR_RATE = 0.5
+COOLDOWN = 30.0
+# 对冲等待时间取首选服务耗时的该分位数，样本不足时使用 DEFAULT_HEDGE_DELAY
+HEDGE = True
+HEDGE_QUANTILE = 0.95
+MIN_HEDGE_DELAY = 0.05
+DEFAULT_HEDGE_DELAY = 2.0
+# 同时进行的请求（含对冲请求和落败后仍在进行的请求）的最大数量
+MAX_WORKERS = 32
+
+
+class BackendStats:
+    """单个服务最近 window 次请求的成败与成功请求的耗时"""
+
+    def __init__(self, window=WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.last_failure = None
+
+    def record(self, latency, ok):
+        self.requests += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+        else:
+            self.last_failure = time.monotonic()
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def expected_latency(self):
+        """
+        期望耗时：成功耗时的中位数除以成功率，约等于失败后换服务重发的平均代价。
+        没有任何请求时为0（优先测量），只有失败时为无穷大。
+        """
+        if not self.outcomes:
+            return 0.0
+        error_rate = self.error_rate()
+        if not self.latencies or error_rate >= 1.0:
+            return float("inf")
+        return self.quantile(0.5) / (1.0 - error_rate)
+
+    def quantile(self, q):
+        """成功请求耗时的 q 分位数，没有样本时返回 None"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LLMRouter:
+    """
+    在多个大模型服务之间路由请求。
+
+    每个请求按 ranking 的顺序选择服务：还没有耗时样本的服务排在最前，保证每个服务都会被测量；
+    其余按 BackendStats.expected_latency（耗时中位数除以成功率）从小到大排列。错误率超过 max_error_rate 的服务被跳过，
+    距上次失败超过 cooldown 秒后放行一次请求探测是否恢复。
+    每个服务只请求一次、不在同一服务上重试，失败时立即换排序中的下一个服务，全部失败时抛出最后一次的错误。
+
+    hedge 为True时，首选服务在其耗时的 hedge_quantile 分位数内没有返回，就向下一个服务再发一次相同的请求，
+    返回先成功的结果。落败的请求在后台继续完成，其耗时同样计入统计。
+
+    参数:
+    - backends: list, 参与路由的 API 类型，默认为 API_CONFIGS 中的全部服务；api_key 为空（未配置）的服务被忽略。
+    - hedge: bool, 是否发送对冲请求。
+    - hedge_quantile: float, 对冲等待时间所取的耗时分位数。
+    - window: int, 每个服务统计最近多少次请求。
+    - max_error_rate: float, 视为健康的最大错误率。
+    - cooldown: float, 不健康的服务重新探测前等待的秒数。
+
+    示例:
+    >>> router = LLMRouter(["zhipu", "vllm", "qwen"], hedge=True)
+    >>> answer = clean_json(router.get_response(variables_prompt(guard_extra(graph)), schema=guard_schema(graph)))
+    """
+
+    def __init__(self, backends=None, hedge=HEDGE, hedge_quantile=HEDGE_QUANTILE, window=WINDOW,
+                 max_error_rate=MAX_ERROR_RATE, cooldown=COOLDOWN):
+        self.backends = [name for name in (backends or API_CONFIGS) if API_CONFIGS[name].get("api_key")]
+        if not self.backends:
+            raise ValueError("没有已配置 api_key 的大模型服务")
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.stats = {name: BackendStats(window) for name in self.backends}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="llm-router")
+
+    def _healthy(self, stats):
+        return len(stats.outcomes) < MIN_SAMPLES or stats.error_rate() <= self.max_error_rate
+
+    def ranking(self):
+        """
+        返回本次请求尝试服务的顺序。
+
+        冷却期已过的不健康服务排在最前，作为探测请求，每个冷却期只放行一次；
+        其余健康的服务按期望耗时排列；没有可用的服务时按错误率从低到高全部尝试。
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy, probes = [], []
+            for name in self.backends:
+                stats = self.stats[name]
+                if self._healthy(stats):
+                    healthy.append(name)
+                elif now - stats.last_failure >= self.cooldown:
+                    stats.last_failure = now
+                    probes.append(name)
+            if not healthy and not probes:
+                return sorted(self.backends, key=lambda name: self.stats[name].error_rate())
+            return probes + sorted(healthy, key=lambda name: self.stats[name].expected_latency())
+
+    def hedge_delay(self, name):
+        """向 name 发出请求后，等待多久仍未返回时发送对冲请求"""
+        with self._lock:
+            stats = self.stats[name]
+            if len(stats.latencies) < MIN_SAMPLES:
+                return DEFAULT_HEDGE_DELAY
+            return max(MIN_HEDGE_DELAY, stats.quantile(self.hedge_quantile))
+
+    def _call(self, name, prompt, schema, n):
+        start = time.perf_counter()
+        try:
+            result = call_backend(name, prompt, schema=schema, n=n)
+        except Exception:
+            with self._lock:
+                self.stats[name].record(time.perf_counter() - start, False)
+            raise
+        with self._lock:
+            self.stats[name].record(time.perf_counter() - start, True)
+        return result
+
+    def get_response(self, prompt, schema=None, n=1):
+        """
+        把请求发给当前最快且健康的服务，参数与返回值同 my_utils.get_response。
+
+        返回值:
+        - str, 模型生成的响应内容；n 大于1时为响应内容的列表。
+        """
+        queue = self.ranking()
+        pending = {}
+        hedged = False
+        error = None
+
+        def launch():
+            name = queue.pop(0)
+            pending[self._executor.submit(self._call, name, prompt, schema, n)] = name
+
+        launch()
+        primary = next(iter(pending.values()))
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and queue and len(pending) == 1:
+                timeout = self.hedge_delay(primary)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                with self._lock:
+                    self.hedges += 1
+                launch()
+                continue
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if hedged and name != primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return result
+            if not pending and queue:
+                launch()
+        raise error
+
+    def report(self):
+        """返回各服务的请求数、错误率、耗时中位数与 p95，以及对冲请求的次数和胜出次数"""
+        with self._lock:
+            backends = {
+                name: {
+                    "requests": stats.requests,
+                    "error_rate": stats.error_rate(),
+                    "p50": stats.quantile(0.5),
+                    "p95": stats.quantile(0.95),
+                }
+                for name, stats in self.stats.items()
+            }
+            return {"backends": backends, "hedges": self.hedges, "hedge_wins": self.hedge_wins}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def default_router():
+    """返回进程内共享的路由，首次调用时按当时的 API_CONFIGS 创建，get_response(api_type="auto") 使用该路由"""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = LLMRouter()
+        return _default_router
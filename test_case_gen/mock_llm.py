@@ -0,0 +1,354 @@
+import ast
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from path_var_exa import path_var_exa
+from genetic import solve_guards
+
+"""
+本地大模型替身服务
+同时提供 OpenAI 兼容的 /v1/chat/completions 接口与 qwen_api 的 /generate 接口，不需要远程 API 或 GPU：
+variables_prompt 按区间推理求解守卫条件后给出变量取值，安全性准则匹配与状态图扩展给出固定但合法的 JSON，
+并可以注入延迟、抖动和失败，用于在 CPU 机器上测量整条流水线的吞吐量
+运行: python mock_llm.py，监听 qwen/request.py 与 vllm/request.py 默认使用的 10062 端口
+"""
+
+HOST = "127.0.0.1"
+PORT = 10062
+# 每个请求的固定延迟与均匀分布抖动的上限（秒）
+LATENCY = 0.2
+JITTER = 0.1
+# 请求以该概率返回 503，客户端应当重试
+FAILURE_RATE = 0.0
+# 请求以该概率再额外等待 STRAGGLER_DELAY 秒，模拟长尾延迟
+STRAGGLER_RATE = 0.0
+STRAGGLER_DELAY = 2.0
+# 流式响应每段的字符数
+STREAM_CHUNK = 8
+
+CONDITION_BLOCK = re.compile(r"<condition>\n(.*?)\n</condition>", re.DOTALL)
+CRITION_BLOCK = re.compile(r"<安全性准则>\n(.*?)\n</安全性准则>", re.DOTALL)
+STATE_GRAPH = re.compile(r"原始状态图的json数据如下：\n(.*?)\n不匹配的安全性准则和原因如下", re.DOTALL)
+CRITION_REASON_BLOCK = re.compile(r"<crition_reason>\n(.*?)\n</crition_reason>", re.DOTALL)
+
+
+def parse_conditions(prompt):
+    """
+    从 variables_prompt 中解析守卫条件，构造 path_var_exa 所需的变迁列表。
+
+    提示词中第一个 <condition> 块为实际的条件（第二个为示例），每行为 guard_extra 给出的
+    "守卫条件 变量类型为：{别名: 类型}"，别名为 变量名_迁移ID，守卫条件中的变量可以是变量名或别名。
+
+    返回值:
+    - list, 变迁字典列表，包含 id、guard 和 guard_type。
+    """
+    block = CONDITION_BLOCK.search(prompt)
+    if block is None:
+        return []
+    transitions = []
+    for line in block.group(1).splitlines():
+        guard, _, types = line.partition(" 变量类型为：")
+        try:
+            guard_type = ast.literal_eval(types)
+        except (ValueError, SyntaxError):
+            continue
+        if not guard_type:
+            continue
+        transition_id = next(iter(guard_type)).rsplit("_", 1)[1]
+        names = {alias: alias.rsplit("_", 1)[0] for alias in guard_type}
+        # convert_to_networkx(add_id=True) 的守卫条件中变量已是别名，还原为变量名后由 path_var_exa 重新加上迁移ID
+        for alias, name in names.items():
+            guard = re.sub(rf"\b{re.escape(alias)}\b", name, guard)
+        transitions.append({
+            "id": transition_id,
+            "guard": guard,
+            "guard_type": {names[alias]: type_ for alias, type_ in guard_type.items()},
+        })
+    return transitions
+
+
+def solve_variables(prompt, rng, schema=False):
+    """
+    回答 variables_prompt：能按区间推理判定的守卫条件取 solve_guards 的解，其余变量在取值范围内随机取值。
+
+    参数:
+    - prompt: str, variables_prompt 生成的提示词。
+    - rng: random.Random, 随机取值使用的随机数生成器。
+    - schema: bool, 请求是否附带 JSON Schema。为False时布尔值按提示词要求写成 "True"/"False" 字符串。
+
+    返回值:
+    - dict, 变量别名到取值的字典。
+    """
+    variables = []
+    for transition in parse_conditions(prompt):
+        try:
+            variables.extend(path_var_exa({"transitions": [transition]}))
+        except ValueError:
+            continue
+    solved, _ = solve_guards(variables)
+    answer = {}
+    for var in variables:
+        if var["name"] in solved:
+            value = solved[var["name"]]
+        elif var["type"] == "bool":
+            value = rng.random() < 0.5
+        elif var["type"] == "int":
+            value = rng.randint(int(var["min"]), int(var["max"]))
+        else:
+            value = round(rng.uniform(var["min"], var["max"]), 2)
+        answer[var["name"]] = value if schema or not isinstance(value, bool) else str(value)
+    return answer
+
+
+def match_critions(prompt):
+    """回答 matching_crition_prompt：取准则列表中的前三条作为不满足的准则"""
+    critions = []
+    block = CRITION_BLOCK.search(prompt)
+    if block is not None:
+        try:
+            critions = [str(crition) for crition in ast.literal_eval(block.group(1))][:3]
+        except (ValueError, SyntaxError):
+            critions = []
+    return {"critions": critions, "reason": [f"状态图中缺少对“{crition}”的处理" for crition in critions]}
+
+
+def extend_graph(prompt):
+    """
+    回答 graph_extension_prompt：在原状态图上为第一条准则增加一个安全保护状态，以及从初始状态到该状态的变迁。
+    """
+    graph = json.loads(STATE_GRAPH.search(prompt).group(1))
+    block = CRITION_REASON_BLOCK.search(prompt)
+    crition = block.group(1).splitlines()[0].split("：")[0] if block and block.group(1) else ""
+    states, transitions = graph.setdefault("states", []), graph.setdefault("transitions", [])
+    state_id = f"S{len(states) + 1}"
+    states.append({
+        "id": state_id,
+        "name": "安全保护状态",
+        "description": "检测到异常时进入的保护状态",
+        "level": 4,
+        "out_action": "切断输出并告警",
+        "timing": {"duration": 10, "start_time": 0},
+        "crition": crition,
+    })
+    if states[:-1]:
+        transitions.append({
+            "id": f"T{len(transitions) + 1}",
+            "from": states[0]["id"],
+            "to": state_id,
+            "guard": "safety_fault == true",
+            "description": "检测到安全性故障",
+            "guard_type": {"safety_fault": "bool"},
+            "timing": {"trigger_time": 0},
+        })
+    return graph
+
+
+def answer_prompt(prompt, rng, schema=False):
+    """
+    按提示词的类型构造回答文本。
+
+    参数:
+    - prompt: str, 提示词。
+    - rng: random.Random, 随机数生成器。
+    - schema: bool, 请求是否附带 JSON Schema。附带时回答为紧凑 JSON，与约束解码的输出一致；否则为 ```json 代码块。
+
+    返回值:
+    - str, 回答文本；无法识别的提示词返回固定的文本。
+    """
+    if "<condition>" in prompt:
+        answer = solve_variables(prompt, rng, schema)
+    elif "<安全性准则>" in prompt:
+        answer = match_critions(prompt)
+    elif "<crition_reason>" in prompt:
+        answer = extend_graph(prompt)
+    else:
+        return "好的。"
+    if schema:
+        return json.dumps(answer, ensure_ascii=False, separators=(",", ":"))
+    return "```json\n" + json.dumps(answer, ensure_ascii=False) + "\n```"
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """替身服务的请求处理：按路径区分 OpenAI 兼容接口与 /generate 接口，支持长连接与流式响应"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        delay, fail = server.plan()
+        time.sleep(delay)
+        if fail:
+            server.count("failures")
+            return self._send_json(503, {"error": {"message": "injected failure", "type": "server_error"}})
+
+        if self.path.endswith("/chat/completions"):
+            server.count("chat")
+            return self._chat(data)
+        if self.path.endswith("/generate"):
+            server.count("generate")
+            return self._generate(data)
+        if self.path.endswith("/prefixes"):
+            return self._send_json(200, {"tokens": 0})
+        self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_GET(self):
+        if self.path.endswith("/metrics"):
+            return self._send_json(200, self.server.stats())
+        self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _chat(self, data):
+        prompt = data["messages"][-1]["content"]
+        schema = bool(data.get("guided_json"))
+        thinking = data.get("chat_template_kwargs", {}).get("enable_thinking", False)
+        contents = []
+        for _ in range(data.get("n") or 1):
+            content = answer_prompt(prompt, self.server.rng(), schema)
+            contents.append(("<think>\n模拟思考\n</think>\n\n" if thinking else "") + content)
+
+        if data.get("stream"):
+            events = [
+                {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": data.get("model", "mock"),
+                 "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                for piece in self._chunks(contents[0])
+            ]
+            events.append({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": data.get("model", "mock"),
+                           "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            return self._send_events(events)
+
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": 0,
+            "model": data.get("model", "mock"),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                for i, content in enumerate(contents)
+            ],
+            "usage": {"prompt_tokens": len(prompt), "completion_tokens": sum(map(len, contents)), "total_tokens": 0},
+        })
+
+    def _generate(self, data):
+        if not data.get("prompt"):
+            return self._send_json(400, {"error": "Invalid request. 'prompt' key is required."})
+        content = answer_prompt(data["prompt"], self.server.rng(), bool(data.get("schema")))
+        thinking = "模拟思考" if data.get("enable_thinking") else ""
+        if data.get("stream"):
+            text = f"<think>\n{thinking}\n</think>\n\n{content}" if thinking else content
+            return self._send_events([{"text": piece} for piece in self._chunks(text)])
+        self._send_json(200, {"thinking_content": thinking, "content": content})
+
+    @staticmethod
+    def _chunks(text):
+        return [text[i:i + STREAM_CHUNK] for i in range(0, len(text), STREAM_CHUNK)]
+
+    def _send_json(self, status, body):
+        body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, events):
+        """以 SSE 格式发送事件，发送完毕后关闭连接（没有 Content-Length，以连接关闭表示响应结束）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    本地大模型替身服务。
+
+    每个请求先等待 latency 加上 [0, jitter) 内均匀分布的随机时间，以 straggler_rate 的概率再等待 straggler_delay 秒，
+    然后以 failure_rate 的概率返回 503。
+    随机数由 seed 决定，seed 相同时注入的延迟与失败序列相同（并发请求之间的先后顺序除外）。
+
+    示例:
+    >>> with MockLLMServer(port=0, latency=0.05) as server:
+    ...     API_CONFIGS["zhipu"].update(base_url=server.base_url + "/v1", api_key="EMPTY")
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host=HOST, port=PORT, latency=LATENCY, jitter=JITTER, failure_rate=FAILURE_RATE,
+                 straggler_rate=STRAGGLER_RATE, straggler_delay=STRAGGLER_DELAY, seed=0):
+        super().__init__((host, port), MockLLMHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.straggler_rate = straggler_rate
+        self.straggler_delay = straggler_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = {"chat": 0, "generate": 0, "failures": 0}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def plan(self):
+        """返回本次请求的 (延迟秒数, 是否注入失败)"""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self._random.random() < self.straggler_rate:
+                delay += self.straggler_delay
+            return delay, self._random.random() < self.failure_rate
+
+    def rng(self):
+        """返回本次回答使用的随机数生成器，由服务的随机数派生"""
+        with self._lock:
+            return random.Random(self._random.getrandbits(64))
+
+    def count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def start(self):
+        """在后台线程中运行服务"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+
+    server = MockLLMServer()
+    print(f"mock LLM server listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,50 +1,348 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from openai import APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import httpx
 import json
+import os
+import random
 import re
+import threading
+import time
 
-def get_response(prompt, api_type="huoshan", reason=False):
+# 各 API 类型对应的密钥、基础 URL 和模型名称
+API_CONFIGS = {
+    "huoshan": {
+        "api_key": "",
+        "base_url": "https://ark.cn-beijing.volces.com/api/v3",
+        "model": "ep-20250225100445-2mvwq",
+    },
+    "zhipu": {
+        "api_key": "",
+        "base_url": "https://open.bigmodel.cn/api/paas/v4/",
+        "model": "glm-4-flash",
+    },
+    # 本地 vLLM 服务（vllm/request.py 启动的微调模型），支持 guided_json 约束解码
+    "vllm": {
+        "api_key": "EMPTY",
+        "base_url": "http://localhost:10062/v1",
+        "model": "../Qwen/Qwen3-8B",
+        "guided_json": True,
+    },
+    # 本地 qwen_api 服务（qwen/qwen_api.py），通过 /generate 接口请求，不是 OpenAI 兼容接口
+    "qwen": {
+        "api_key": "EMPTY",
+        "base_url": "http://127.0.0.1:10062",
+        "model": "Qwen3-8B",
+        "guided_json": True,
+        "protocol": "generate",
+    },
+}
 
+# 连接与重试配置
+TIMEOUT = 60.0
+CONNECT_TIMEOUT = 5.0
+MAX_CONNECTIONS = 16
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# 并发请求大模型时同时进行的最大请求数
+CONCURRENCY = 8
+
+
+class GenerateServerError(Exception):
+    """/generate 接口返回限流或服务端错误"""
+
+
+# 可以重试的错误：连接失败、超时、限流和服务端错误
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError,
+                    httpx.TransportError, GenerateServerError)
+# /generate 接口可以重试的状态码，503 为模型尚未加载完成
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+_clients = {}
+_http_clients = {}
+_executor = None
+_clients_lock = threading.Lock()
+# 退避抖动使用独立的随机数生成器，不影响遗传算法按任务设置的随机数序列
+_backoff_random = random.Random()
+
+
+def get_client(base_url, api_key, timeout=TIMEOUT, connect_timeout=CONNECT_TIMEOUT, max_connections=MAX_CONNECTIONS):
     """
-    根据给定的提示信息和 API 类型，从指定的模型获取响应。
+    按 (base_url, api_key) 返回复用的 OpenAI 客户端。
+
+    同一进程内相同服务的请求共用一个客户端及其 HTTP 连接池，保持长连接，
+    避免每次请求都重新建立 TCP 连接和 TLS 握手。客户端自身不重试（max_retries=0），重试由 with_retries 控制。
 
     参数:
-        prompt (str): 发送给模型的提示信息。
-        api_type (str, 可选): API 的类型，默认为 "huoshan"。支持的类型有 "huoshan" 和 "zhipu"。
-        reason (bool, 可选): 是否为推理，默认为 False。
+        base_url (str): API 的基础 URL。
+        api_key (str): API 密钥。
+        timeout (float, 可选): 单次请求的总超时时间（秒）。
+        connect_timeout (float, 可选): 建立连接的超时时间（秒）。
+        max_connections (int, 可选): 连接池的最大连接数，同时也是保持的长连接数上限。
 
     返回:
-        str: 模型生成的响应内容。
+        OpenAI: 客户端对象，第一次创建时的超时和连接数配置生效。
+    """
+    key = (base_url, api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                max_retries=0,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                ),
+            )
+            _clients[key] = client
+        return client
 
-    说明:
-        此函数根据 `api_type` 参数选择不同的 API 配置，使用 OpenAI 客户端与相应的模型进行交互，
-        并返回模型生成的响应。目前支持的 API 类型有 "huoshan" 和 "zhipu"，分别对应不同的 API 密钥、
-        基础 URL 和模型名称。
+
+def get_http_client(base_url, timeout=TIMEOUT, connect_timeout=CONNECT_TIMEOUT, max_connections=MAX_CONNECTIONS):
+    """按 base_url 返回复用的 httpx 客户端，用于 /generate 等非 OpenAI 兼容接口，保持长连接"""
+    with _clients_lock:
+        client = _http_clients.get(base_url)
+        if client is None:
+            client = httpx.Client(
+                base_url=base_url,
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+            _http_clients[base_url] = client
+        return client
+
+
+def close_clients():
+    """关闭所有复用的客户端及其连接"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        for client in _http_clients.values():
+            client.close()
+        _http_clients.clear()
+
+
+def _thread_pool():
+    """异步接口中运行同步请求的线程池，线程数与连接池大小相同"""
+    global _executor
+    with _clients_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_CONNECTIONS, thread_name_prefix="llm-sync")
+        return _executor
+
+
+def with_retries(call, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
     """
-    
+    调用 call()，遇到可重试的错误时按带抖动的指数退避重试。
+
+    第 n 次重试前等待 [0, min(backoff_max, backoff_base * 2**n)] 内的随机时间（full jitter），
+    多个工作进程同时失败时不会在同一时刻一起重试。超过 max_retries 次后抛出最后一次的错误。
+
+    参数:
+        call (callable): 无参数的请求函数。
+        max_retries (int, 可选): 最大重试次数。
+        backoff_base (float, 可选): 退避的基础时间（秒）。
+        backoff_max (float, 可选): 单次退避的最长时间（秒）。
+
+    返回:
+        call() 的返回值。
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except RETRYABLE_ERRORS:
+            if attempt == max_retries:
+                raise
+            time.sleep(_backoff_random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt)))
+
+
+_loop = None
+_loop_pid = None
+_async_clients = {}
+
+
+def _event_loop():
+    """返回在后台线程中持续运行的事件循环，异步客户端及其连接池绑定在该循环上，跨多次 run_async 复用"""
+    global _loop, _loop_pid
+    with _clients_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _async_clients.clear()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+
+def run_async(coro):
+    """在后台事件循环中运行协程，阻塞等待并返回其结果"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+
+def get_async_client(base_url, api_key, timeout=TIMEOUT, connect_timeout=CONNECT_TIMEOUT, max_connections=MAX_CONNECTIONS):
+    """get_client 的异步版本，返回复用的 AsyncOpenAI 客户端，只能在 run_async 运行的协程中使用"""
+    key = (base_url, api_key)
+    with _clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                ),
+            )
+            _async_clients[key] = client
+        return client
+
+
+async def async_with_retries(call, max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+    """with_retries 的异步版本，call 为返回协程的无参数函数，退避等待期间不阻塞其他请求"""
+    for attempt in range(max_retries + 1):
+        try:
+            return await call()
+        except RETRYABLE_ERRORS:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(_backoff_random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt)))
+
+
+def request_kwargs(config, schema=None, n=1):
+    """
+    请求的附加参数：支持约束解码的服务附带 JSON Schema，其他服务忽略 schema；
+    n 大于1时一次请求 n 个回答，共用同一次预填充与网络往返。
+    """
+    kwargs = {}
+    if schema is not None and config.get("guided_json"):
+        kwargs["extra_body"] = {"guided_json": schema}
+    if n > 1:
+        kwargs["n"] = n
+    return kwargs
+
+
+async def async_get_response(prompt, api_type="huoshan", semaphore=None, schema=None, n=1):
+    """
+    get_response 的异步版本。
+
+    参数:
+        prompt (str): 发送给模型的提示信息。
+        api_type (str, 可选): API 的类型，默认为 "huoshan"。
+        semaphore (asyncio.Semaphore, 可选): 限制同时进行的请求数，为 None 时不限制。
+        schema (dict, 可选): 回答的 JSON Schema，与 get_response 相同。
+        n (int, 可选): 一次请求的回答数，与 get_response 相同。
+
+    返回:
+        str: 模型生成的响应内容；n 大于1时为响应内容的列表。
+    """
+    config = API_CONFIGS.get(api_type)
+    if config is None or config.get("protocol") == "generate":
+        # 路由（api_type 为 "auto"）与 /generate 接口使用同步客户端，在线程池中运行，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        call = functools.partial(get_response, prompt, api_type, schema=schema, n=n)
+        if semaphore is None:
+            return await loop.run_in_executor(_thread_pool(), call)
+        async with semaphore:
+            return await loop.run_in_executor(_thread_pool(), call)
+
     messages = [{"role": "user", "content": prompt}]
-    if api_type == "huoshan":
-        api_key = ""
-        base_url = "https://ark.cn-beijing.volces.com/api/v3"
-        model = "ep-20250225100445-2mvwq"
-    elif api_type == "zhipu":
-        api_key = ""
-        base_url = "https://open.bigmodel.cn/api/paas/v4/"
-        model = "glm-4-flash"
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url=base_url,
-    )
+    client = get_async_client(config["base_url"], config["api_key"])
+    kwargs = request_kwargs(config, schema, n)
+
+    async def call():
+        if semaphore is None:
+            return await client.chat.completions.create(model=config["model"], messages=messages, **kwargs)
+        async with semaphore:
+            return await client.chat.completions.create(model=config["model"], messages=messages, **kwargs)
+
+    completion = await async_with_retries(call)
+    if n > 1:
+        return [choice.message.content for choice in completion.choices]
+    return completion.choices[0].message.content
+
+
+def generate_response(prompt, config, schema=None, n=1):
+    """
+    向 qwen_api 的 /generate 接口（protocol 为 "generate" 的服务）发送请求，不重试。
+    /generate 每次只生成一个回答，n 大于1时依次请求 n 次。限流或服务端错误时抛出 GenerateServerError。
+    """
+    client = get_http_client(config["base_url"])
+    payload = {"prompt": prompt}
+    if schema is not None and config.get("guided_json"):
+        payload["schema"] = schema
+    contents = []
+    for _ in range(n):
+        response = client.post("/generate", json=payload)
+        if response.status_code in RETRYABLE_STATUS:
+            raise GenerateServerError(f"/generate 返回 {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+        contents.append(response.json()["content"])
+    return contents if n > 1 else contents[0]
+
 
+def call_backend(api_type, prompt, reason=False, schema=None, n=1):
+    """
+    向 api_type 对应的服务发送一次请求，不重试。
+    按配置中的 protocol 选择 OpenAI 兼容接口或 /generate 接口，参数与返回值同 get_response。
+    """
+    config = API_CONFIGS[api_type]
+    if config.get("protocol") == "generate":
+        return generate_response(prompt, config, schema, n)
+
+    messages = [{"role": "user", "content": prompt}]
+    client = get_client(config["base_url"], config["api_key"])
     completion = client.chat.completions.create(
-        model=model,
+        model=config["model"],
         messages=messages,
+        **request_kwargs(config, schema, n),
     )
+    if n > 1:
+        return [choice.message if reason else choice.message.content for choice in completion.choices]
     if reason:
         return completion.choices[0].message
     else:
         return completion.choices[0].message.content
 
+
+def model_name(api_type):
+    """返回 api_type 对应的模型名称，用作响应缓存的键；路由（"auto"）没有固定的模型，返回 "auto" """
+    return API_CONFIGS[api_type]["model"] if api_type in API_CONFIGS else api_type
+
+
+def get_response(prompt, api_type="huoshan", reason=False, schema=None, n=1):
+
+    """
+    根据给定的提示信息和 API 类型，从指定的模型获取响应。
+
+    参数:
+        prompt (str): 发送给模型的提示信息。
+        api_type (str, 可选): API 的类型，默认为 "huoshan"。支持 API_CONFIGS 中的 "huoshan"、"zhipu"、"vllm" 和 "qwen"，
+            以及 "auto"：由 llm_router.default_router 在已配置的服务中选择当前最快且健康的一个。
+        reason (bool, 可选): 是否为推理，默认为 False。"auto" 时忽略。
+        schema (dict, 可选): 回答的 JSON Schema。配置中 guided_json 为 True 的本地服务按 Schema 约束解码，
+            回答总能被 clean_json 解析；远程服务不支持约束解码，忽略该参数。
+        n (int, 可选): 一次请求的回答数，默认为 1。大于1时在同一次调用中采样 n 个回答，
+            不支持该参数的服务可能只返回一个回答。
+
+    返回:
+        str: 模型生成的响应内容；n 大于1时为所有回答组成的列表。
+
+    说明:
+        此函数根据 `api_type` 参数选择不同的 API 配置，由 call_backend 通过复用的客户端与模型进行交互，
+        遇到连接失败、超时、限流等错误时按 with_retries 重试，并返回模型生成的响应。
+        "qwen" 为本地 qwen_api 服务的 /generate 接口，其余类型为 OpenAI 兼容接口。
+    """
+    if api_type == "auto":
+        from llm_router import default_router
+        return default_router().get_response(prompt, schema=schema, n=n)
+    return with_retries(lambda: call_backend(api_type, prompt, reason, schema, n))
+
 def clean_json(json_str):
     """
     清理和解析 JSON 字符串
@@ -1,10 +1,238 @@
 import re
+import ast
+import math
+from graph_run import translate_guard
 
 """
 图变迁中变量提取
-同一变量中，min有可能比max还大
+守卫条件解析为析取范式（DNF），每个合取项中的变量取值表示为区间的并集
 """
 
+# 未约束一侧的默认取值范围
+DOMAIN_MIN = -1000
+DOMAIN_MAX = 1000
+# 析取范式展开的最大合取项数量，超过时回退到正则提取
+MAX_CONJUNCTS = 64
+
+_FLIP_OPS = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "==", "!=": "!="}
+_AST_OPS = {ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+_NEGATE_OPS = {"==": "!=", "!=": "==", "<": ">=", "<=": ">", ">": "<=", ">=": "<"}
+
+
+def _is_constant(node):
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        return _is_constant(node.operand)
+    return isinstance(node, ast.Constant) and isinstance(node.value, (bool, int, float))
+
+
+def _atom(left, op, right):
+    """将单个比较转换为 (变量, 操作符, 常量)，常量在左侧时翻转操作符"""
+    if isinstance(left, ast.Name) and _is_constant(right):
+        return left.id, op, ast.literal_eval(right)
+    if _is_constant(left) and isinstance(right, ast.Name):
+        return right.id, _FLIP_OPS[op], ast.literal_eval(left)
+    raise ValueError("只支持变量与常量的比较")
+
+
+def _dnf(node, negate=False):
+    """
+    将守卫条件的语法树转换为析取范式。
+
+    返回值:
+    - list of list, 每个内层列表为一个合取项，由 (变量, 操作符, 常量) 组成；[] 表示恒假，[[]] 表示恒真
+    """
+    if isinstance(node, ast.BoolOp):
+        is_and = isinstance(node.op, ast.And) != negate
+        children = [_dnf(value, negate) for value in node.values]
+        if not is_and:
+            return [conj for child in children for conj in child]
+        result = [[]]
+        for child in children:
+            result = [a + b for a in result for b in child]
+            if len(result) > MAX_CONJUNCTS:
+                raise ValueError("守卫条件的析取范式过大")
+        return result
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return _dnf(node.operand, not negate)
+    if isinstance(node, ast.Compare):
+        lefts = [node.left] + node.comparators[:-1]
+        atoms = []
+        for left, op, right in zip(lefts, node.ops, node.comparators):
+            if type(op) not in _AST_OPS:
+                raise ValueError("不支持的比较操作符")
+            atoms.append(_atom(left, _AST_OPS[type(op)], right))
+        if not negate:
+            return [atoms]
+        return [[(var, _NEGATE_OPS[op], value)] for var, op, value in atoms]
+    if isinstance(node, ast.Name):
+        return [[(node.id, "==", not negate)]]
+    if isinstance(node, ast.Constant) and isinstance(node.value, bool):
+        return [[]] if node.value != negate else []
+    raise ValueError("不支持的守卫条件结构")
+
+
+def parse_guard(guard):
+    """
+    将守卫条件解析为析取范式。
+
+    参数:
+    - guard: str, 状态变迁的守卫条件。
+
+    返回值:
+    - list of list, 合取项列表，每个合取项为 (变量, 操作符, 常量) 的列表。
+
+    异常:
+    - ValueError: 守卫条件包含变量与变量比较、算术运算等无法按区间处理的结构。
+
+    示例:
+    >>> parse_guard("fuel_quantity > 50 && leak_detected == false")
+    [[('fuel_quantity', '>', 50), ('leak_detected', '==', False)]]
+    >>> parse_guard("voltage_value > 250 || voltage_value < 80")
+    [[('voltage_value', '>', 250)], [('voltage_value', '<', 80)]]
+    """
+    try:
+        tree = ast.parse(translate_guard(guard), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"守卫条件无法解析: {guard}") from e
+    return _dnf(tree.body)
+
+
+def _next_up(value, type_):
+    return math.floor(value) + 1 if type_ != "float" else math.nextafter(value, math.inf)
+
+
+def _next_down(value, type_):
+    return math.ceil(value) - 1 if type_ != "float" else math.nextafter(value, -math.inf)
+
+
+def atom_intervals(op, value, type_):
+    """
+    单个比较对应的取值区间（闭区间列表）。
+
+    int/bool 类型的开区间端点取相邻整数，float 类型取相邻浮点数；bool 的 True/False 视为 1/0。
+    """
+    value = float(value) if type_ == "float" else int(value) if isinstance(value, bool) else value
+    if type_ != "float" and op == "==" and value != math.floor(value):
+        return []
+    if type_ != "float" and op in (">=", "<="):
+        value = math.ceil(value) if op == ">=" else math.floor(value)
+    if op == "==":
+        return [(value, value)]
+    if op == "!=":
+        return [(-math.inf, _next_down(value, type_)), (_next_up(value, type_), math.inf)]
+    if op == ">":
+        return [(_next_up(value, type_), math.inf)]
+    if op == ">=":
+        return [(value, math.inf)]
+    if op == "<":
+        return [(-math.inf, _next_down(value, type_))]
+    return [(-math.inf, value)]
+
+
+def intersect_intervals(a, b):
+    """两个区间并集的交集"""
+    result = []
+    for lo1, hi1 in a:
+        for lo2, hi2 in b:
+            lo, hi = max(lo1, lo2), min(hi1, hi2)
+            if lo <= hi:
+                result.append((lo, hi))
+    return sorted(result)
+
+
+def subtract_intervals(a, b, type_):
+    """区间并集 a 中不属于 b 的部分"""
+    result = a
+    for blo, bhi in b:
+        pieces = []
+        for lo, hi in result:
+            if bhi < lo or blo > hi:
+                pieces.append((lo, hi))
+                continue
+            if lo < blo:
+                pieces.append((lo, _next_down(blo, type_)))
+            if hi > bhi:
+                pieces.append((_next_up(bhi, type_), hi))
+        result = [(lo, hi) for lo, hi in pieces if lo <= hi]
+    return result
+
+
+def union_intervals(intervals):
+    """合并重叠或相邻的区间"""
+    result = []
+    for lo, hi in sorted(intervals):
+        if result and lo <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], hi))
+        else:
+            result.append((lo, hi))
+    return result
+
+
+def full_intervals(type_):
+    """变量未受约束时的取值区间"""
+    return [(0, 1)] if type_ == "bool" else [(-math.inf, math.inf)]
+
+
+def formula_boxes(formula, guard_type):
+    """
+    将守卫条件转换为区间盒的列表。
+
+    每个区间盒对应析取范式中的一个可满足的合取项，键为变量名，值为该变量在此合取项中的取值区间并集，
+    合取项中未出现的变量取 full_intervals。守卫条件满足当且仅当变量取值落在某个区间盒内。
+
+    异常:
+    - ValueError: 变量未在guard_type中定义，或守卫条件无法按区间处理。
+
+    示例:
+    >>> formula_boxes("voltage_value > 250 || voltage_value < 80", {"voltage_value": "int"})
+    [{'voltage_value': [(251, inf)]}, {'voltage_value': [(-inf, 79)]}]
+    """
+    boxes = []
+    for conjunct in parse_guard(formula):
+        box = {var: full_intervals(type_) for var, type_ in guard_type.items()}
+        for var, op, value in conjunct:
+            if var not in guard_type:
+                raise ValueError(f"Variable {var} is not defined in guard_type.")
+            box[var] = intersect_intervals(box[var], atom_intervals(op, value, guard_type[var]))
+        if all(box.values()):
+            boxes.append(box)
+    return boxes
+
+
+def finite_interval(lo, hi):
+    """
+    将区间的无穷端点替换为有限值，用于在区间内取值。
+
+    无穷端点取 DOMAIN_MIN/DOMAIN_MAX；区间整体落在默认范围之外时（如 v > 2000），
+    从有限端点向外延伸 DOMAIN_MAX - DOMAIN_MIN 的宽度。
+    """
+    span = DOMAIN_MAX - DOMAIN_MIN
+    if math.isinf(lo) and math.isinf(hi):
+        return DOMAIN_MIN, DOMAIN_MAX
+    if math.isinf(lo):
+        lo = DOMAIN_MIN if hi >= DOMAIN_MIN else hi - span
+    if math.isinf(hi):
+        hi = DOMAIN_MAX if lo <= DOMAIN_MAX else lo + span
+    return lo, hi
+
+
+def _hull(intervals):
+    """区间并集的包络，无穷端点按 finite_interval 截断，保证 min <= max"""
+    if not intervals:
+        return DOMAIN_MIN, DOMAIN_MAX
+    return finite_interval(intervals[0][0], intervals[-1][1])
+
+
+def _clamp_default(info):
+    """
+    逐个比较更新的 min/max 中，只有一侧被约束且越过了另一侧的默认值时（如 v > 2000 得到 min 2000 / max 1000），
+    把另一侧的默认值向该侧延伸，与 finite_interval 一致
+    """
+    if info["min"] > DOMAIN_MAX and info["max"] == DOMAIN_MAX:
+        info["max"] = finite_interval(info["min"], math.inf)[1]
+    elif info["max"] < DOMAIN_MIN and info["min"] == DOMAIN_MIN:
+        info["min"] = finite_interval(-math.inf, info["max"])[0]
+
 
 def update_min_max(variables, var, op, value):
 
@@ -80,8 +308,15 @@ def formula_extra(formula, guard_type, tansition_id):
     - formula: str, 包含变量、操作符和值的公式字符串。
     - guard_type: dict, 包含变量及其类型的字典。
 
+    守卫条件能按区间处理时（变量与常量比较的与、或、非组合），另外给出：
+    - intervals: 满足守卫条件时该变量的取值区间并集（各合取项的投影之并），min/max 为其包络，
+      因此 "v > 250 || v < 80" 得到 min -1000 / max 1000，而不是 min 250 / max 80；
+      包络的无穷端点按 finite_interval 截断，"v > 2000" 得到 min 2001 / max 4001，而不是 min 2001 / max 1000；
+    - boxes: 与 formula_boxes 的合取项一一对应，该变量在每个合取项中的取值区间。
+    无法按区间处理时这两项为 None，min/max 沿用逐个比较更新的结果。
+
     返回值:
-    - variables: dict, 包含提取的变量及其类型、最小值和最大值的字典。
+    - variables: dict, 包含提取的变量及其类型、最小值、最大值、区间和别名的字典。
 
     异常:
     - ValueError: 如果公式中的变量未在guard_type中定义，则抛出此异常。
@@ -89,8 +324,11 @@ def formula_extra(formula, guard_type, tansition_id):
 
     variables = {}
     # 匹配变量和值
-    matches = re.findall(r"(\w+)\s*(==|>=|<=|>|<)\s*([\w.]+)", formula)
+    matches = re.findall(r"(\w+)\s*(==|>=|<=|>|<)\s*(-?[\w.]+)", formula)
     for var, op, value in matches:
+        # 常量写在左侧的比较（如 1 < a）由区间解析处理
+        if value in guard_type and re.fullmatch(r"[\d.]+|true|false", var):
+            continue
         if var not in guard_type:
             raise ValueError(f"Variable {var} is not defined in guard_type.")
         if var not in variables:
@@ -99,10 +337,36 @@ def formula_extra(formula, guard_type, tansition_id):
 
         update_min_max(variables, var, op, value)
 
+    try:
+        boxes = formula_boxes(formula, guard_type)
+        guard_vars = {var for conjunct in parse_guard(formula) for var, _, _ in conjunct}
+    except ValueError:
+        for info in variables.values():
+            info["intervals"] = None
+            info["boxes"] = None
+            if info["type"] != "bool":
+                _clamp_default(info)
+        return variables
+
+    for var in sorted(guard_vars - set(variables)):
+        variables[var] = {"type": guard_type[var], "min": DOMAIN_MIN, "max": DOMAIN_MAX, "alias": var + "_" + tansition_id}
+    for var, info in variables.items():
+        info["boxes"] = [box[var] for box in boxes]
+        info["intervals"] = union_intervals([interval for box in boxes for interval in box[var]])
+        if info["type"] != "bool":
+            info["min"], info["max"] = _hull(info["intervals"])
+
     return variables
 
 
 def path_var_exa(data):
+    """
+    提取状态图所有变迁守卫条件中的变量。
+
+    返回值:
+    - results: list, 每个变量为一个字典，包含原变量名 ori_name、别名 name、类型 type、取值范围 min/max、
+      区间并集 intervals、各合取项的区间 boxes（见 formula_extra）以及所属变迁 transition。
+    """
     results = []
     transitions = data["transitions"]
     # 遍历每个变迁
@@ -119,6 +383,9 @@ def path_var_exa(data):
                     "type": info["type"],
                     "min": info["min"],
                     "max": info["max"],
+                    "intervals": info["intervals"],
+                    "boxes": info["boxes"],
+                    "transition": transition_id,
                 }
             )
     return results
@@ -127,3 +394,5 @@ def path_var_exa(data):
 if __name__ == "__main__":
     data = {"name": "机载电力系统状态图", "func_desc": "控制飞机电力生成、分配与故障保护", "states": [{"id": "S1", "name": "关闭状态", "description": "主电源未激活，备用电池维持基本系统", "level": 3, "out_action": "None", "timing": {"duration": 0, "start_time": 0}}, {"id": "S2", "name": "启动预热", "description": "APU或主引擎发电机启动预热过程", "level": 2, "out_action": "激活电压检测电路", "timing": {"duration": 30, "start_time": 0}}, {"id": "S3", "name": "正常运行", "description": "稳定输出400Hz 115/200V三相交流电", "level": 1, "out_action": "None", "timing": {"duration": 9999, "start_time": 30}}, {"id": "S4", "name": "故障保护", "description": "检测到电压异常时切断电路", "level": 4, "out_action": "激活备用电源", "timing": {"duration": 15, "start_time": 0}}], "transitions": [{"id": "T1", "from": "S1", "to": "S2", "guard": "engine_start == true", "description": "引擎启动信号触发电力系统初始化", "guard_type": {"engine_start": "bool"}, "timing": {"trigger_time": 0}}, {"id": "T2", "from": "S2", "to": "S3", "guard": "voltage_stable == true && frequency_error < 0.5", "description": "电压稳定后进入正常工作模式", "guard_type": {"voltage_stable": "bool", "frequency_error": "float"}, "timing": {"trigger_time": 30}}, {"id": "T3", "from": "S3", "to": "S4", "guard": "voltage_value > 250 || voltage_value < 80", "description": "电压超限触发保护机制", "guard_type": {"voltage_value": "float"}, "timing": {"trigger_time": 0}}, {"id": "T4", "from": "S4", "to": "S2", "guard": "manual_reset == true", "description": "地面维护人员执行系统重置", "guard_type": {"manual_reset": "bool"}, "timing": {"trigger_time": 15}}]}
     print(path_var_exa(data))
+    # 区间整体落在默认范围之外时，包络向区间一侧延伸：min 2001 / max 4001
+    print(formula_extra("v > 2000", {"v": "int"}, "T1"))
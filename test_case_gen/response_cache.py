@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+"""
+大模型响应缓存
+同一提示词在同一模型上的解析结果保存到 SQLite，每个提示词保留有限个不同的答案组成答案池，
+答案池填满后按概率从池中复用或重新请求，重复运行同一状态图时不再需要网络请求
+"""
+
+# 默认缓存文件放在本模块所在目录，不随运行时的工作目录变化
+RESPONSE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_response_cache.sqlite")
+POOL_SIZE = 5
+REFRESH_RATE = 0.1
+MAX_ENTRIES = 10000
+MAX_AGE = 30 * 24 * 3600
+
+
+def prompt_key(prompt, model):
+    """
+    计算 (模型, 提示词) 的内容哈希，作为缓存的键。
+
+    参数:
+    - prompt: str, 提示词。
+    - model: str, 模型名称。
+
+    返回值:
+    - str, sha256 的十六进制摘要。
+    """
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    以 SQLite 存储的大模型响应缓存。
+
+    每条记录为某个提示词的一个解析后的答案（JSON 序列化），同一提示词下相同的答案只保存一次并记录返回次数，
+    模型总是给出相同答案时答案池也能填满。
+    get_or_fetch 在答案池中答案的返回次数之和不足 pool_size 时总是调用 fetch 请求新答案，
+    池满后以 refresh_rate 的概率请求新答案并替换池中最旧的答案，否则从池中随机复用一个。
+    超过 max_age 秒的答案视为过期；总记录数超过 max_entries 时淘汰最久未使用的答案。
+
+    数据库连接按进程创建，多个工作进程可以共用同一个缓存文件。
+
+    示例:
+    >>> cache = ResponseCache("llm_response_cache.sqlite")
+    >>> answer = cache.get_or_fetch(prompt, "glm-4-flash", lambda: clean_json(get_response(prompt, api_type="zhipu")))
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, pool_size=POOL_SIZE, refresh_rate=REFRESH_RATE,
+                 max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self.path = path
+        self.pool_size = pool_size
+        self.refresh_rate = refresh_rate
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._pid = os.getpid()
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT NOT NULL, model TEXT NOT NULL, answer TEXT NOT NULL, "
+                    "created REAL NOT NULL, last_used REAL NOT NULL, copies INTEGER NOT NULL DEFAULT 1, "
+                    "UNIQUE (key, answer))"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        return self._conn
+
+    def pool(self, prompt, model):
+        """返回提示词当前未过期的答案列表，按写入时间排序"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                self._expire(conn, prompt_key(prompt, model))
+                rows = conn.execute(
+                    "SELECT answer FROM responses WHERE key = ? ORDER BY created, rowid", (prompt_key(prompt, model),)
+                ).fetchall()
+        return [json.loads(answer) for answer, in rows]
+
+    def sample(self, prompt, model):
+        """
+        决定本次是复用答案池中的答案还是请求新答案。
+
+        参数:
+        - prompt: str, 提示词。
+        - model: str, 模型名称。
+
+        返回值:
+        - tuple, (answer, refresh)。refresh 为False时 answer 是从答案池中随机取出的答案；
+          为True时调用方应请求新答案并用 store 写入，answer 为请求失败时可以退回使用的最新答案，答案池为空时为 None。
+        """
+        key = prompt_key(prompt, model)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                self._expire(conn, key)
+                rows = conn.execute(
+                    "SELECT rowid, answer, copies FROM responses WHERE key = ? ORDER BY created, rowid", (key,)
+                ).fetchall()
+
+        if sum(row[2] for row in rows) >= self.pool_size and random.random() >= self.refresh_rate:
+            rowid, answer, _ = random.choice(rows)
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE rowid = ?", (time.time(), rowid))
+            self.hits += 1
+            return json.loads(answer), False
+
+        self.misses += 1
+        return (json.loads(rows[-1][1]) if rows else None), True
+
+    def store(self, prompt, model, answer):
+        """把新请求到的答案加入答案池，池中超过 pool_size 个答案时淘汰最旧的"""
+        key = prompt_key(prompt, model)
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO responses (key, model, answer, created, last_used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key, answer) DO UPDATE SET last_used = excluded.last_used, copies = copies + 1",
+                    (key, model, json.dumps(answer, ensure_ascii=False, sort_keys=True), now, now),
+                )
+                conn.execute(
+                    "DELETE FROM responses WHERE key = ? AND rowid NOT IN "
+                    "(SELECT rowid FROM responses WHERE key = ? ORDER BY created DESC, rowid DESC LIMIT ?)",
+                    (key, key, self.pool_size),
+                )
+                self._evict(conn)
+
+    def get_or_fetch(self, prompt, model, fetch):
+        """
+        从答案池中取一个答案，或调用 fetch 请求新答案并加入答案池。
+
+        参数:
+        - prompt: str, 提示词。
+        - model: str, 模型名称，与提示词共同决定缓存的键。
+        - fetch: callable, 无参数，返回解析后的答案（可 JSON 序列化），返回 None 表示请求或解析失败，不写入缓存。
+
+        返回值:
+        - 解析后的答案，每次调用都返回新的对象，调用方可以直接修改；fetch 失败时退回答案池中最新的答案，答案池为空时返回 None。
+        """
+        answer, refresh = self.sample(prompt, model)
+        if not refresh:
+            return answer
+        fetched = fetch()
+        if fetched is None:
+            return answer
+        self.store(prompt, model, fetched)
+        return fetched
+
+    def _expire(self, conn, key):
+        if self.max_age is not None:
+            conn.execute("DELETE FROM responses WHERE key = ? AND created < ?", (key, time.time() - self.max_age))
+
+    def _evict(self, conn):
+        if self.max_entries is None:
+            return
+        conn.execute(
+            "DELETE FROM responses WHERE rowid IN "
+            "(SELECT rowid FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            conn = self._connect()
+            entries, prompts = conn.execute("SELECT COUNT(*), COUNT(DISTINCT key) FROM responses").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "prompts": prompts,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM responses")
+            self.hits = self.misses = 0
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+_default_cache = None
+
+
+def default_response_cache():
+    """返回进程内共享的默认缓存，缓存文件路径可以通过环境变量 LLM_RESPONSE_CACHE 指定"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache(os.environ.get("LLM_RESPONSE_CACHE", RESPONSE_CACHE_PATH))
+    return _default_cache
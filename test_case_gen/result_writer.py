@@ -0,0 +1,113 @@
+import json
+import os
+
+"""
+实验结果写入
+按批次缓冲写入实验结果，并根据已有结果建立完成索引，中断后重新运行时跳过已完成的组合
+"""
+
+
+class ResultWriter:
+    """
+    实验结果的缓冲写入器。
+
+    打开时读取已有结果文件，以 (graph_id, selection, mutation) 建立完成索引；
+    无法解析的行（如中断时写了一半的最后一行）不计入索引，对应组合会重新运行。
+    结果先缓存在内存中，满 batch_size 条或退出 with 语句时（包括异常和 Ctrl-C）统一写入磁盘。
+
+    示例:
+    >>> with ResultWriter("mutation_data.jsonl") as writer:
+    ...     if not writer.is_done("8121f8fd", "rank", "swap"):
+    ...         writer.write({"graph_id": "8121f8fd", "selection": "rank", "mutation": "swap", "avg_gen": 12.3})
+    """
+
+    def __init__(self, path, batch_size=100):
+        self.path = path
+        self.batch_size = batch_size
+        self.completed = set()
+        self.written = 0
+        self.skipped = 0
+        self.failed = {}
+        self._buffer = []
+        self._file = None
+        self._load_index()
+
+    @staticmethod
+    def combo_key(graph_id, selection, mutation):
+        return graph_id, selection, mutation
+
+    def _load_index(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as exp_file:
+            for line in exp_file:
+                try:
+                    exp_data = json.loads(line)
+                    key = self.combo_key(exp_data["graph_id"], exp_data["selection"], exp_data["mutation"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                self.completed.add(key)
+
+    def open(self):
+        needs_newline = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as exp_file:
+                exp_file.seek(-1, os.SEEK_END)
+                needs_newline = exp_file.read(1) != b"\n"
+        self._file = open(self.path, "a")
+        if needs_newline:
+            self._file.write("\n")
+        return self
+
+    def is_done(self, graph_id, selection, mutation):
+        return self.combo_key(graph_id, selection, mutation) in self.completed
+
+    def skip(self, graph_id, selection, mutation):
+        """记录一个因已完成而跳过的组合"""
+        self.skipped += 1
+
+    def fail(self, graph_id, selection, mutation, error):
+        """记录一个运行失败的组合及其错误信息"""
+        self.failed[self.combo_key(graph_id, selection, mutation)] = error
+
+    def fail_graph(self, graph_id, selections, mutations, error):
+        """记录一个无法解析的状态图，它的每个选择/变异组合都计为失败"""
+        for selection in selections:
+            for mutation in mutations:
+                self.fail(graph_id, selection, mutation, error)
+
+    def write(self, exp_data):
+        self._buffer.append(json.dumps(exp_data, ensure_ascii=False) + "\n")
+        self.completed.add(self.combo_key(exp_data["graph_id"], exp_data["selection"], exp_data["mutation"]))
+        self.written += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer and self._file is not None:
+            self._file.writelines(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def summary(self):
+        """返回本次运行写入、跳过和失败的组合数量"""
+        return {
+            "written": self.written,
+            "skipped": self.skipped,
+            "failed": len(self.failed),
+            "failed_combos": [list(key) + [error] for key, error in self.failed.items()],
+        }
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -1,12 +1,35 @@
+import re
 from openai import OpenAI
 
+# 结果中的 JSON 代码块，出现结束的 ``` 后即可停止读取
+JSON_BLOCK = re.compile(r"```json.*?```", re.DOTALL)
+
 def extract_thoughts(text):
     thinking_content = ""
     thinking_content = text.split("<think>")[-1].split("</think>")[0].strip()
     content = text.split("</think>")[1].strip()
     return thinking_content, content
 
-def request_finetue_model(content, enable_thinking=False):
+def read_stream(chat_response):
+    """拼接流式响应的文本，</think> 之后的回答中 JSON 代码块结束时立即关闭连接，vLLM 随之中止该请求的生成"""
+    text = ""
+    try:
+        for chunk in chat_response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                if JSON_BLOCK.search(text.split("</think>")[-1]):
+                    break
+    finally:
+        chat_response.close()
+    return text
+
+def request_finetue_model(content, enable_thinking=False, stream=False, schema=None, n=1):
+    """
+    schema 为回答的 JSON Schema，通过 vLLM 的 guided_json 约束解码，回答总能被 json.loads 解析。
+    n 大于1时一次请求采样 n 个回答，共用同一次预填充，返回每个回答的结果组成的列表；流式读取只支持 n 为1。
+    """
+    if stream and n > 1:
+        raise ValueError("stream=True 时 n 只能为 1")
 
     openai_api_key = "EMPTY"
     openai_api_base = "http://localhost:10062/v1"
@@ -21,6 +44,13 @@ def request_finetue_model(content, enable_thinking=False):
         {"role": "user", "content": content},
     ]
 
+    extra_body = {
+        "top_k": 20,
+        "chat_template_kwargs": {"enable_thinking": enable_thinking},
+    }
+    if schema:
+        extra_body["guided_json"] = schema
+
     chat_response = client.chat.completions.create(
         model=model_name,
         messages=messages,
@@ -28,15 +58,16 @@ def request_finetue_model(content, enable_thinking=False):
         temperature=0.7,
         top_p=0.8,
         presence_penalty=1.5,
-        extra_body={
-            "top_k": 20, 
-            "chat_template_kwargs": {"enable_thinking": enable_thinking},
-        },
+        n=n,
+        extra_body=extra_body,
+        stream=stream,
     )
-    if enable_thinking:
-        return extract_thoughts(chat_response.choices[0].message.content)
+    if stream:
+        texts = [read_stream(chat_response)]
     else:
-        return chat_response.choices[0].message.content
+        texts = [choice.message.content for choice in chat_response.choices]
+    results = [extract_thoughts(text) if enable_thinking else text for text in texts]
+    return results if n > 1 else results[0]
 
 if __name__ == "__main__":
     print(request_finetue_model("你好",True))
\ No newline at end of file